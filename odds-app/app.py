@@ -1,109 +1,194 @@
-from flask import Flask, render_template
+from flask import Flask, Response, abort, jsonify, render_template, request, url_for
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text, create_engine
+from sqlalchemy import text
 import os
 from dotenv import load_dotenv
-import pandas as pd
-import requests
-from datetime import datetime, timedelta
+import queue
+import threading
+from datetime import date
+import gzip
+import hashlib
 import json
+from bundles import HISTORY_SERIES, history_series, read_bundle, read_changes
+from downsample import as_datetime
+import export
+import metrics
+from database import database_url, engine_options, replica_url
+from discrepancy import DiscrepancyEngine, comparison_row
+from jobs import listen_for_invalidations, redis_client
+from news import refresh_if_stale
+from schema import CURRENT_SEASON
+from snapshot_cache import snapshot_cache
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['ENV'] = os.getenv('FLASK_ENV', 'production')
 
-# configuring database URI to use psycopg instead of psycopg2
-uri = os.environ.get('DATABASE_URL')
-if uri and uri.startswith("postgresql://"):
-    uri = uri.replace("postgresql://", 'postgresql+psycopg://', 1)
-else:
-    uri = "sqlite:///local.db"
+# the engines are configured in database.py: WAL on sqlite, a bounded, pre-pinged pool on postgres
+uri = database_url()
+if not uri.startswith(('sqlite:', 'postgresql')):
+    uri = database_url("sqlite:///local.db")
 
 app.config['SQLALCHEMY_DATABASE_URI'] = uri
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+# the pages read from the replica when there is one, see read_engine
+if replica_url():
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': replica_url(), **engine_options(replica_url())}}
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-print(app.config['SQLALCHEMY_DATABASE_URI'])
 db = SQLAlchemy(app)
 
-engine = create_engine(uri)
+# request, SQL and external api timings, served at /metrics
+metrics.init_app(app)
+with app.app_context():
+    for engine in db.engines.values():
+        metrics.instrument_engine(engine)
+
+# export.py renders the pages from the updater's own engine by setting this while it exports
+app.config['RENDER_ENGINE'] = None
+
+def read_engine():
+    '''
+    The engine the pages read from: the read replica when DATABASE_REPLICA_URL is set, the primary otherwise.
+    Writes (the news cache) always go to db.engine.
+    '''
+    return app.config['RENDER_ENGINE'] or db.engines.get('replica') or db.engine
 
 omdb_api_key = os.environ.get('OMDB_API_KEY')
 
-def get_news_for_movie(movie_name):
-    # check db for existing articles
-    query = text("SELECT articles, last_updated FROM movie_news WHERE movie_name = :movie_name")
-    with engine.connect() as conn:
-        result = conn.execute(query, {"movie_name": movie_name}).fetchone()
-
-    if result:
-        articles, last_updated = result
-        last_updated = datetime.strptime(last_updated, "%Y-%m-%d %H:%M:%S.%f")
-        if last_updated and (datetime.now() - last_updated) < timedelta(days=1):  # Update daily
-            return json.loads(articles)
-
-    # Otherwise get from News API
-    url = "https://newsapi.org/v2/everything"
-    params = {
-        "q": f'{movie_name} movie',
-        "apiKey": os.getenv("NEWS_API_KEY"),
-        "language": "en",
-        "sortBy": "publishedAt",
-        "pageSize": 20,
-    }
-
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        raw_articles = response.json().get("articles", [])
-        relevant_articles = [
-            {
-                "title": article["title"],
-                "url": article["url"],
-                "description": article.get("description", "No description available."),
-                "publishedAt": datetime.strptime(article["publishedAt"], "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-            }
-            for article in raw_articles
-            if movie_name.lower() in article["title"].lower()
-        ]
-
-        simplified_articles = relevant_articles[:3]
-
-        query_add = """
-            INSERT INTO movie_news (movie_name, articles, last_updated)
-            VALUES (:movie_name, :articles, :last_updated)
-            ON CONFLICT (movie_name)
-            DO UPDATE SET articles = EXCLUDED.articles, last_updated = EXCLUDED.last_updated
-        """
-        with engine.connect() as conn:
-            conn.execute(
-                text(query_add),
-                {
-                    "movie_name": movie_name,
-                    "articles": json.dumps(simplified_articles),
-                    "last_updated": datetime.now()
-                }
-            )
-        return simplified_articles
-    else:
-        return []
+# the current season's odds table gaps, kept up to date for the live stream, see discrepancy.py
+with app.app_context():
+    discrepancies = DiscrepancyEngine(read_engine(), CURRENT_SEASON)
+
+def snapshot_landed(event):
+    snapshot_cache.bump()
+    discrepancies.wake()
+
+listener = None
+listener_lock = threading.Lock()
+
+@app.before_request
+def start_listening():
+    '''
+    Snapshots written by the scrape workers (worker.py) refresh the cached tables and the gaps straight away.
+    The app only subscribes once it serves a request, so scripts importing it (export.py) don't.
+    '''
+    global listener
+    if listener is not None or app.config['EXPORTING'] or not os.getenv('REDIS_URL'):
+        return
+    with listener_lock:
+        if listener is None:
+            listener = listen_for_invalidations(redis_client(), snapshot_landed)
+
+@app.template_global()
+def poster_url(movie, thumbnail=False):
+    '''
+    Serves a movie's poster from our own static folder once get_poster.py has stored it, falling back to the remote url
+    '''
+    poster_file = movie['poster_thumb'] if thumbnail else movie['poster_file']
+    if poster_file:
+        return url_for('static', filename=f'posters/{poster_file}')
+    return movie['Poster']
+
+def latest_snapshot_date():
+    '''
+    Returns when the current season's odds last changed, used to version the snapshot cache.
+    Runs that found nothing new don't change it, so frequent polling leaves the cache alone.
+    '''
+    with read_engine().connect() as conn:
+        return conn.execute(text('SELECT MAX(changed_at) FROM odds_current WHERE "Season" = :season'),
+                            {"season": CURRENT_SEASON}).scalar()
+
+def latest_check():
+    '''
+    Returns when a run last checked the current season's odds, changed or not
+    '''
+    with read_engine().connect() as conn:
+        return conn.execute(text('SELECT MAX(checked_at) FROM odds_current WHERE "Season" = :season'),
+                            {"season": CURRENT_SEASON}).scalar()
+
+# pages exported by export.py are sent straight from disk until the odds change or they age out
+export.init_app(app, lambda: snapshot_cache.version(latest_snapshot_date)[1])
+
+def load_seasons():
+    with read_engine().connect() as conn:
+        return conn.execute(text('SELECT season FROM seasons ORDER BY season DESC')).scalars().all()
+
+def requested_season():
+    '''
+    The season asked for with ?season=, the current one by default. Seasons without history are a 404.
+    '''
+    season = request.args.get('season', CURRENT_SEASON, type=int)
+    if season not in snapshot_cache.get_or_build('seasons', load_seasons, latest_snapshot_date):
+        abort(404)
+    return season
+
+@app.context_processor
+def season_links():
+    '''
+    Lets every page link to the other seasons, see _seasons.html
+    '''
+    return {'seasons': snapshot_cache.get_or_build('seasons', load_seasons, latest_snapshot_date)}
+
+def render_comparison_table(headers, rows, show_consensus=False):
+    '''
+    Renders comparison rows with the precompiled odds_table macro from _tables.html
+    '''
+    odds_table = app.jinja_env.get_template('_tables.html').module.odds_table
+    with metrics.timed('render_table'):
+        return str(odds_table(headers, rows, show_consensus))
+
+# movies the season's latest run saw, with their current values
+CURRENT_MOVIES = """
+    FROM movie_stats ms
+    JOIN odds_current oc ON ms."Movie Name" = oc."Movie Name"
+    WHERE oc."Season" = :season
+      AND oc.checked_at = (SELECT MAX(checked_at) FROM odds_current WHERE "Season" = :season)
+"""
+
+def format_update_time(value):
+    return as_datetime(value).strftime('%Y-%m-%d %H:%M') if value else None
+
+def build_comparison_rows(expert_column, user_column, star24_column, season):
+    '''
+    Reads the season's current odds for the given groups of voters and turns them into comparison rows
+    along with when they last changed
+    '''
+    query = f"""
+        SELECT oc."Movie Name", oc.{expert_column}, oc.{user_column}, oc.{star24_column}, oc.betting_pct, oc.consensus_pct, oc.changed_at
+        {CURRENT_MOVIES}
+    """
+    with read_engine().connect() as conn:
+        results = conn.execute(text(query), {"season": season}).all()
+
+    rows = []
+    latest_change = None
+    for movie_name, experts, users, star24, betting, consensus, changed_at in results:
+        rows.append(comparison_row(movie_name, experts, users, star24, betting, consensus))
+        changed_at = as_datetime(changed_at)
+        latest_change = max(latest_change or changed_at, changed_at)
+    return rows, format_update_time(latest_change)
 
 @app.route('/')
 def homepage():
-    # Finds the top 3 movies based on Goldderby all star users' votes
-    query = """
-        SELECT ms."Movie Name", ms."Poster", gd.pct_vote_star24, gd.betting_pct
-        FROM movie_stats ms
-        JOIN goldderby gd ON ms."Movie Name" = gd."Movie Name"
-        WHERE gd."Date" = (SELECT MAX("Date") FROM goldderby)
-        ORDER BY gd.pct_vote_star24 DESC
+    season = requested_season()
+    top_movies_data = snapshot_cache.get_or_build(('homepage', season), lambda: build_top_movies(season), latest_snapshot_date)
+    return render_template('homepage.html', movies=top_movies_data, season=season)
+
+def build_top_movies(season):
+    # Finds the top 3 movies of the season based on Goldderby all star users' votes
+    query = f"""
+        SELECT ms."Movie Name", ms."Poster", ms.poster_file, ms.poster_thumb, oc.pct_vote_star24, oc.betting_pct
+        {CURRENT_MOVIES}
+        ORDER BY oc.pct_vote_star24 DESC
         LIMIT 3
     """
-    top_movies = pd.read_sql(text(query), db.engine)
-
-    # converts to dictionary which is then used in the homepage template
-    top_movies_data = top_movies.to_dict(orient='records')
+    with read_engine().connect() as conn:
+        top_movies = conn.execute(text(query), {"season": season}).mappings().all()
 
-    return render_template('homepage.html', movies=top_movies_data)
+    # converts to dictionaries which are then used in the homepage template
+    return [dict(movie) for movie in top_movies]
 
 @app.route('/about')
 def about():
@@ -115,131 +200,159 @@ def index():
     """
     Displays the movie betting odds table
     """
-    movie_stats_query = "SELECT * FROM movie_stats"
-    movie_stats_df = pd.read_sql(movie_stats_query, db.engine)
-
-    # query the db for the latest odds data
-    goldderby_query = """
-            SELECT "Movie Name", imp_prob_expert, imp_prob_user, imp_prob_star24, betting_pct, "Date"
-            FROM goldderby
-            WHERE "Date" = (SELECT MAX("Date") FROM goldderby)
-        """
-    goldderby_df = pd.read_sql(goldderby_query, db.engine)
-
-    merged_df = pd.merge(movie_stats_df, goldderby_df, left_on="Movie Name", right_on="Movie Name", how="inner")
-
-    # replacing movies that don't have odds with 'Unavailable' label
-    def format_value(value):
-        if pd.isna(value):
-            return "Unavailable"
-        return int(value)
-
-    # Turning integer values into percentages
-    def to_pct(value):
-        if isinstance(value, int):
-            return f"{value}%"
-        return value
-
-
-    # applying the above functions to clean the betting percentage and 'Difference' columns
-    merged_df['betting_pct'] = merged_df['betting_pct'].apply(format_value)
-    merged_df['Difference'] = merged_df['imp_prob_star24'].fillna(0) - merged_df['betting_pct'].replace("Unavailable",0)
-    merged_df['Difference (Betting Odds vs. All Star)'] = merged_df.apply(
-        lambda row: "Unavailable" if row['betting_pct'] == "Unavailable" or pd.isna(row['imp_prob_star24']) else row[
-            'Difference'],axis=1)
-
-    # movie name links to the movie's stats page
-    merged_df['Movie Name'] = merged_df['Movie Name'].apply(lambda x: f'<a href="/movie/{x}">{x}</a>')
-
-    # converting odds to percentages
-    merged_df['Experts Odds'] = merged_df['imp_prob_expert'].apply(to_pct)
-    merged_df['GoldDerby Users Odds'] = merged_df['imp_prob_user'].apply(to_pct)
-    merged_df['All Star Users Odds'] = merged_df['imp_prob_star24'].apply(to_pct)
-    merged_df['Betting Odds'] = merged_df['betting_pct'].apply(to_pct)
-
-    latest_date = merged_df["Date"].iloc[0]
-
-    merged_df = merged_df[["Movie Name", 'Experts Odds', 'GoldDerby Users Odds', 'All Star Users Odds', 'Betting Odds', 'Difference (Betting Odds vs. All Star)']]
-    table_html = merged_df.to_html(classes='data', index=False, escape=False)
-
-    return render_template('index.html', table=table_html, latest_date=latest_date)
+    season = requested_season()
+    _, table_html, latest_date = snapshot_cache.get_or_build(('odds_table', season), lambda: build_odds_table(season), latest_snapshot_date)
+    # only the current season changes, so only its table listens for updates
+    return render_template('index.html', table=table_html, latest_date=latest_date, season=season, live=season == CURRENT_SEASON)
+
+def build_odds_table(season):
+    '''
+    Builds the rows and rendered html for the betting odds table from a season's latest snapshot
+    '''
+    rows, latest_date = build_comparison_rows('imp_prob_expert', 'imp_prob_user', 'imp_prob_star24', season)
+    headers = ["Movie Name", 'Experts Odds', 'GoldDerby Users Odds', 'All Star Users Odds', 'Betting Odds', 'Difference (Betting Odds vs. All Star)',
+               'Market Consensus', 'Difference (Market Consensus vs. All Star)']
+    return rows, render_comparison_table(headers, rows, show_consensus=True), latest_date
+
+@app.route('/api/discrepancies')
+def discrepancy_ranking():
+    '''
+    The current season's largest gaps between the All Star users and the betting odds, and the latest alerts
+    '''
+    discrepancies.start()
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(season=CURRENT_SEASON, ranked=[row._asdict() for row in discrepancies.ranked(limit)],
+                   alerts=list(discrepancies.alerts))
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+@app.route('/api/discrepancies/stream')
+def discrepancy_stream():
+    '''
+    Server-sent events for the odds table: every row on connecting, then the rows that changed ('rows'),
+    movies that left the table ('removed') and gaps that opened past the alert threshold ('alert')
+    '''
+    discrepancies.start()
+    subscription = discrepancies.subscribe()
+
+    def stream():
+        try:
+            # everything once, in case the page was served from an older snapshot
+            yield sse('rows', [row._asdict() for row in discrepancies.rows()])
+            while True:
+                try:
+                    message = subscription.get(timeout=15)
+                except queue.Empty:
+                    # a comment line keeps proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                if message is None:
+                    return
+                yield sse(*message)
+        finally:
+            discrepancies.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/win_votes_table')
 def win_votes_table():
     """
     Displays the movie odds table that compares online betting odds to the percentage of voters who expect a movie to win
     """
-    movie_stats_query = "SELECT * FROM movie_stats"
-    movie_stats_df = pd.read_sql(movie_stats_query, db.engine)
-
+    season = requested_season()
+    _, table_html, latest_date = snapshot_cache.get_or_build(('win_votes_table', season), lambda: build_win_votes_table(season), latest_snapshot_date)
+    return render_template('win_votes.html', table=table_html, latest_date=latest_date, season=season)
+
+def build_win_votes_table(season):
+    '''
+    Builds the rows and rendered html for the win votes table from a season's latest snapshot
+    '''
     # instead of using goldderby's odds to compare to the betting odds, this table uses the % of voters who expect a movie to win as a proxy for the odds
-    goldderby_query = """
-            SELECT "Movie Name", pct_vote_expert, pct_vote_user, pct_vote_star24, betting_pct, "Date"
-            FROM goldderby
-            WHERE "Date" = (SELECT MAX("Date") FROM goldderby)
-        """
-    goldderby_df = pd.read_sql(goldderby_query, db.engine)
-
-    merged_df = pd.merge(movie_stats_df, goldderby_df, left_on="Movie Name", right_on="Movie Name", how="inner")
-
-    # replacing movies that don't have odds with 'Unavailable' label
-    def format_value(value):
-        if pd.isna(value):
-            return "Unavailable"
-        return int(value)
-
-    # Turning integer values into percentages
-    def to_pct(value):
-        if isinstance(value, int):
-            return f"{value}%"
-        return value
-
-    # applying the above functions to clean the betting percentage and 'Difference' columns
-    merged_df['betting_pct'] = merged_df['betting_pct'].apply(format_value)
-    merged_df['Difference'] = merged_df['pct_vote_star24'].fillna(0) - merged_df['betting_pct'].replace("Unavailable",0)
-    merged_df['Difference (Betting Odds vs. All Star)'] = merged_df.apply(
-        lambda row: "Unavailable" if row['betting_pct'] == "Unavailable" or pd.isna(row['pct_vote_star24']) else row[
-            'Difference'],axis=1)
-
-    # movie name links to the movie's stats page
-    merged_df['Movie Name'] = merged_df['Movie Name'].apply(lambda x: f'<a href="/movie/{x}">{x}</a>')
-
-    # converting odds to percentages
-    merged_df['Experts Votes (%)'] = merged_df['pct_vote_expert'].apply(to_pct)
-    merged_df['GoldDerby Users Votes (%)'] = merged_df['pct_vote_user'].apply(to_pct)
-    merged_df['All Star Users Votes (%)'] = merged_df['pct_vote_star24'].apply(to_pct)
-    merged_df['Betting Odds'] = merged_df['betting_pct'].apply(to_pct)
-
-    latest_date = merged_df["Date"].iloc[0]
-
-    merged_df = merged_df[["Movie Name", 'Experts Votes (%)', 'GoldDerby Users Votes (%)', 'All Star Users Votes (%)', 'Betting Odds', 'Difference (Betting Odds vs. All Star)']]
-    table_html = merged_df.to_html(classes='data', index=False, escape=False)
-    return render_template('win_votes.html', table=table_html, latest_date=latest_date)
+    rows, latest_date = build_comparison_rows('pct_vote_expert', 'pct_vote_user', 'pct_vote_star24', season)
+    headers = ["Movie Name", 'Experts Votes (%)', 'GoldDerby Users Votes (%)', 'All Star Users Votes (%)', 'Betting Odds', 'Difference (Betting Odds vs. All Star)']
+    return rows, render_comparison_table(headers, rows), latest_date
 
 @app.route('/movie/<movie_name>')
 def movie_page(movie_name):
     """
-    Extracts the stats and charts for a particular movie to be used in the individual movie pages
+    Renders a movie's page from its bundle (see bundles.py), which holds the stats, chart series and articles in one row
     """
-    movie_stats_query = text("SELECT * FROM movie_stats WHERE \"Movie Name\" = :movie_name")
-    movie_stats_df = pd.read_sql(movie_stats_query, db.engine, params={"movie_name": movie_name})
-
-    if movie_stats_df.empty:
+    bundle = read_bundle(read_engine(), movie_name)
+    if bundle is None:
+        # the updater builds every movie's bundle as it adds the movie, pages never build one
         return "Movie not found", 404
 
-    probabilities_query = f"""
-        SELECT "Date", "pct_vote_expert", "pct_vote_user", "pct_vote_star24", "betting_pct"
-        FROM goldderby
-        WHERE "Movie Name" = :movie_name
-        ORDER BY "Date"
+    # stale articles are refreshed in the background, which rebuilds the bundle
+    with metrics.timed('news'):
+        refresh_if_stale(db.engine, movie_name, bundle['news_updated'], refresh=not app.config['EXPORTING'])
+
+    return render_template('movie.html', movie_stats=bundle['stats'], articles=bundle['articles'], series=bundle['series'])
+
+def compressed_json(payload, etag, max_age=300):
+    '''
+    Builds a cacheable JSON response, gzipped when the client accepts it
+    '''
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    if 'gzip' in request.accept_encodings and len(body) > 1024:
+        response.set_data(gzip.compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+@app.route('/api/movie/<movie_name>/history')
+def movie_history(movie_name):
     """
-    probabilities_df = pd.read_sql(probabilities_query, db.engine, params={"movie_name": movie_name})
-    probabilities_json = probabilities_df.to_json(orient='records')
-
-    # getting the latest news about the movie
-    articles = get_news_for_movie(movie_name)
-
-    return render_template('movie.html', movie_stats=movie_stats_df.iloc[0], chart_data=probabilities_json, articles = articles)
+    Returns a movie's probability series as JSON, one {"x": times, "y": values} pair per series, rebuilt from
+    the changes recorded in odds_changes: a point wherever the value changed, and the last value again at the latest check.
+    Optional query parameters: from/to (YYYY-MM-DD), series (comma separated), bucket (the value each day or week ends on)
+    and points (downsamples each series to about that many points with LTTB)
+    """
+    args = request.args
+    series = args.get('series', ','.join(HISTORY_SERIES)).split(',')
+    bucket = args.get('bucket')
+    if any(name not in HISTORY_SERIES for name in series):
+        return jsonify(error=f"series must be among {', '.join(HISTORY_SERIES)}"), 400
+    if bucket not in (None, 'day', 'week'):
+        return jsonify(error="bucket must be 'day' or 'week'"), 400
+    try:
+        start = date.fromisoformat(args['from']) if 'from' in args else None
+        end = date.fromisoformat(args['to']) if 'to' in args else None
+        points = int(args['points']) if 'points' in args else None
+    except ValueError:
+        return jsonify(error="from/to must be YYYY-MM-DD dates and points an integer"), 400
+
+    # the history only changes when a snapshot lands or a run checks the odds (every series runs on to the latest
+    # check), so the etag follows when the odds last changed and were last checked. The snapshot cache's generation
+    # is left out, it counts this process's invalidations and differs between workers
+    latest = snapshot_cache.version(latest_snapshot_date)[1]
+    etag = hashlib.sha1(f'{latest}|{latest_check()}|{movie_name}|{request.query_string!r}'.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        metrics.cache_lookup('history_etag', 'hit')
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    metrics.cache_lookup('history_etag', 'miss')
+
+    with read_engine().connect() as conn:
+        movie = conn.execute(text('SELECT "Season" FROM movie_stats WHERE "Movie Name" = :movie_name'),
+                             {"movie_name": movie_name}).first()
+        if movie is None:
+            return jsonify(error="Movie not found"), 404
+        changes, last_checked = read_changes(conn, movie_name, movie.Season or CURRENT_SEASON, series)
+
+    until = as_datetime(last_checked) if last_checked else None
+    payload = {"movie": movie_name, "latest": str(latest),
+               "series": history_series(changes, series, start, end, bucket, points, until)}
+
+    return compressed_json(payload, etag)
 
 
 
@@ -0,0 +1,197 @@
+'''
+Keeps what every update run saw, so the parsers can be improved and the history rebuilt without the network:
+
+- raw/<season>/<YYYY-MM-DD>/<page>.html.gz, the pages as fetched, one folder per snapshot in the same layout
+  backfill.py reads (the last run of a day wins)
+- rows/<dataset>/date=<YYYY-MM-DD>/part-<run>.parquet, an append-only Parquet dataset of the parsed
+  goldderby and bookmaker_odds rows, one file per run and snapshot date
+
+Analysis reads the rows through open_dataset, which compacts the parts into one Arrow file and memory-maps it.
+Re-parsing the whole raw archive in parallel and rebuilding the dataset from it:
+    python archive.py replay --workers 8
+    python archive.py replay --load   # also upserts the re-parsed rows into the database
+'''
+import gzip
+import os
+import shutil
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from sqlalchemy import REAL, Date, DateTime, Float, Integer, Text
+
+from files import folder_setting, write_atomically
+from schema import bookmaker_odds, clean_table, goldderby
+
+load_dotenv()
+
+ARCHIVE_DIR = folder_setting('ARCHIVE_DIR', 'archive')
+RAW_DIR = os.path.join(ARCHIVE_DIR, 'raw')
+ROWS_DIR = os.path.join(ARCHIVE_DIR, 'rows')
+
+# the file each scraped page is kept under in a snapshot folder
+ARCHIVE_PAGES = {'Experts': 'experts.html', 'Star24': 'star24.html', 'Users': 'users.html', 'Oddschecker': 'oddschecker.html'}
+
+# the parsed rows kept for each dataset, every row also records when its run happened
+DATASETS = {'goldderby': goldderby, 'bookmaker_odds': bookmaker_odds}
+
+# checked in order, REAL is a kind of Float
+ARROW_TYPES = [(REAL, pa.float32()), (Float, pa.float64()), (Integer, pa.int64()), (Text, pa.string()),
+               (DateTime, pa.timestamp('us')), (Date, pa.date32())]
+
+
+def arrow_schema(table):
+    '''
+    The Arrow schema matching a table's columns, so every part of a dataset has the same types
+    '''
+    fields = []
+    for column in table.columns:
+        arrow_type = next(arrow_type for sql_type, arrow_type in ARROW_TYPES if isinstance(column.type, sql_type))
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields + [pa.field('run_at', pa.timestamp('us'))])
+
+
+def snapshot_dir(season, snapshot_date, root=None):
+    return os.path.join(root or RAW_DIR, str(int(season)), str(snapshot_date))
+
+
+def archive_pages(season, snapshot_date, raw_pages, nominees, root=None):
+    '''
+    Gzips a run's pages into its snapshot folder. Pages that came back unchanged (304) have no body, their
+    latest earlier copy is carried forward instead so every snapshot folder can be replayed on its own.
+    '''
+    directory = snapshot_dir(season, snapshot_date, root)
+    os.makedirs(directory, exist_ok=True)
+    for name, file_name in ARCHIVE_PAGES.items():
+        path = os.path.join(directory, f'{file_name}.gz')
+        if raw_pages.get(name):
+            write_atomically(path, lambda f: f.write(gzip.compress(raw_pages[name].encode('utf-8'))))
+        elif not os.path.exists(path):
+            previous = latest_copy(os.path.dirname(directory), f'{file_name}.gz', str(snapshot_date))
+            if previous:
+                shutil.copyfile(previous, path)
+
+    # the movies the run looked for, which replay needs to parse the pages the same way
+    nominees_path = os.path.join(os.path.dirname(directory), 'nominees.csv')
+    write_atomically(nominees_path, lambda f: pd.DataFrame({'Movie Name': sorted(nominees)}).to_csv(f, index=False))
+
+
+def latest_copy(season_dir, file_name, before):
+    for snapshot in sorted(os.listdir(season_dir), reverse=True):
+        path = os.path.join(season_dir, snapshot, file_name)
+        if snapshot < before and os.path.exists(path):
+            return path
+    return None
+
+
+def append_rows(name, df, run_at, root=None):
+    '''
+    Appends rows to a dataset, as one Parquet file per snapshot date
+    '''
+    table = DATASETS[name]
+    schema = arrow_schema(table)
+    rows = clean_table(table, df).assign(run_at=run_at)
+    for day, day_rows in rows.groupby('Date'):
+        directory = os.path.join(root or ROWS_DIR, name, f'date={day.isoformat()}')
+        os.makedirs(directory, exist_ok=True)
+        batch = pa.Table.from_pandas(day_rows, schema=schema, preserve_index=False)
+        path = os.path.join(directory, f'part-{run_at:%Y%m%dT%H%M%S%f}.parquet')
+        write_atomically(path, lambda f: pq.write_table(batch, f, compression='zstd'))
+
+
+def archive_run(season, snapshot_date, raw_pages, nominees, history, prices=None):
+    '''
+    Keeps one update run: its raw pages and its parsed rows
+    '''
+    run_at = datetime.now()
+    archive_pages(season, snapshot_date, raw_pages, nominees)
+    append_rows('goldderby', history, run_at)
+    if prices is not None and len(prices):
+        append_rows('bookmaker_odds', prices, run_at)
+
+
+def compact(name, root=None):
+    '''
+    Merges a dataset's parts into one uncompressed Arrow file, keeping the latest run's copy of each row.
+    The file is only rebuilt when a part is newer than it.
+    '''
+    root = root or ROWS_DIR
+    directory = os.path.join(root, name)
+    path = os.path.join(root, f'{name}.arrow')
+    parts = [os.path.join(folder, file_name) for folder, _, files in os.walk(directory) for file_name in files
+             if file_name.endswith('.parquet')]
+    if os.path.exists(path) and all(os.path.getmtime(part) <= os.path.getmtime(path) for part in parts):
+        return path
+
+    table = DATASETS[name]
+    schema = arrow_schema(table)
+    if parts:
+        rows = ds.dataset(parts, format='parquet', schema=schema).to_table().to_pandas()
+        key = [column.name for column in table.primary_key.columns]
+        rows = rows.sort_values('run_at').drop_duplicates(subset=key, keep='last').sort_values(key)
+        merged = pa.Table.from_pandas(rows, schema=schema, preserve_index=False)
+    else:
+        merged = schema.empty_table()
+
+    os.makedirs(root, exist_ok=True)
+
+    def write(f):
+        with pa.ipc.new_file(f, schema) as writer:
+            writer.write_table(merged)
+    write_atomically(path, write)
+    return path
+
+
+def open_dataset(name, root=None):
+    '''
+    Returns a dataset as an Arrow table backed by a memory map of its compacted file: nothing is copied
+    until columns are actually used, and several processes can share the same pages
+    '''
+    source = pa.memory_map(compact(name, root), 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def replay(workers=None, load=False):
+    '''
+    Re-parses every archived snapshot in parallel and rebuilds the rows dataset from the results,
+    swapping the new dataset in once it's complete
+    '''
+    from backfill import load_rows, parse_archive
+
+    history, prices, consensus = parse_archive(RAW_DIR, workers)
+    if history is None:
+        print("Nothing archived to replay.")
+        return
+
+    root = ROWS_DIR
+    rebuilt = f'{root}.replay'
+    shutil.rmtree(rebuilt, ignore_errors=True)
+    run_at = datetime.now()
+    append_rows('goldderby', history, run_at, rebuilt)
+    if prices is not None:
+        append_rows('bookmaker_odds', prices, run_at, rebuilt)
+
+    retired = f'{root}.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(root):
+        os.replace(root, retired)
+    os.replace(rebuilt, root)
+    shutil.rmtree(retired, ignore_errors=True)
+    print(f"Replayed {len(history)} rows into {root}.")
+
+    if load:
+        load_rows(history, prices, consensus)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['replay'])
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    parser.add_argument('--load', action='store_true', help='also upsert the re-parsed rows into the database')
+    args = parser.parse_args()
+    replay(args.workers, args.load)
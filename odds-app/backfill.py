@@ -0,0 +1,158 @@
+'''
+Loads archived seasons into the goldderby history. Each snapshot is a folder of saved pages:
+    <archive>/<season>/<YYYY-MM-DD>/experts.html, star24.html, users.html and optionally oddschecker.html
+(gzipped .html.gz pages, as archive.py keeps them, work too)
+with an optional <archive>/<season>/nominees.csv (a "Movie Name" column) limiting which movies are kept,
+every movie on the pages is kept without it. Snapshots are parsed in a process pool, then each season's
+rows are upserted into its own partition, so a backfill can be re-run or extended safely.
+
+    python backfill.py archive/ --workers 8
+    python backfill.py archive/ --season 2023
+'''
+import argparse
+import gzip
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from archive import ARCHIVE_PAGES
+from bundles import rebuild_bundles
+from changes import seed_changes
+from loader import upsert_history, upsert_rows
+from parsers import parse_goldderby_odds, parse_oddschecker_odds
+from schema import bookmaker_odds, market_consensus, movie_stats
+from weekly_update import GOLDDERBY_CATEGORIES, build_snapshot, engine, market_frames
+
+SNAPSHOT_DIR = re.compile(r'\d{4}-\d{2}-\d{2}$')
+
+
+def read_page(path):
+    for candidate, open_page in ((path, open), (f'{path}.gz', gzip.open)):
+        if os.path.exists(candidate):
+            with open_page(candidate, 'rt', encoding='utf-8') as f:
+                return f.read()
+    return None
+
+
+def season_nominees(season_dir):
+    '''
+    The movies to keep for a season, None (every movie) when there's no nominees.csv
+    '''
+    path = os.path.join(season_dir, 'nominees.csv')
+    if not os.path.exists(path):
+        return None
+    return set(pd.read_csv(path)['Movie Name'].tolist())
+
+
+def find_snapshots(archive, only_season=None):
+    '''
+    Lists (season, snapshot folder, nominees) for every snapshot in the archive
+    '''
+    snapshots = []
+    for season in sorted(os.listdir(archive)):
+        season_dir = os.path.join(archive, season)
+        if not season.isdigit() or not os.path.isdir(season_dir) or (only_season and int(season) != only_season):
+            continue
+        nominees = season_nominees(season_dir)
+        for snapshot in sorted(os.listdir(season_dir)):
+            if SNAPSHOT_DIR.match(snapshot):
+                snapshots.append((int(season), os.path.join(season_dir, snapshot), nominees))
+    return snapshots
+
+
+def parse_snapshot(season, snapshot_dir, nominees):
+    '''
+    Parses one archived snapshot into goldderby, bookmaker_odds and market_consensus rows, runs in a worker process
+    '''
+    snapshot_date = os.path.basename(snapshot_dir)
+    categories = {}
+    for category in GOLDDERBY_CATEGORIES:
+        html = read_page(os.path.join(snapshot_dir, ARCHIVE_PAGES[category]))
+        categories[category] = (html and parse_goldderby_odds(html, nominees)) or []
+    if not any(categories.values()):
+        return None, None, None
+
+    html = read_page(os.path.join(snapshot_dir, ARCHIVE_PAGES['Oddschecker']))
+    odds_rows = parse_oddschecker_odds(html) if html else None
+    history = build_snapshot(categories['Experts'], categories['Star24'], categories['Users'], odds_rows, snapshot_date, season)
+
+    prices, consensus = None, None
+    if odds_rows:
+        prices, consensus = market_frames(odds_rows, history['Movie Name'].tolist(), snapshot_date)
+    return history, prices, consensus
+
+
+def parse_archive(archive, workers=None, only_season=None):
+    '''
+    Parses every snapshot in the archive across worker processes, returning the goldderby, bookmaker_odds
+    and market_consensus rows (None when there's nothing to parse)
+    '''
+    snapshots = find_snapshots(archive, only_season)
+    history, prices, consensus = [], [], []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(parse_snapshot, *snapshot): snapshot for snapshot in snapshots}
+        for future in as_completed(futures):
+            season, snapshot_dir, _ = futures[future]
+            try:
+                snapshot_history, snapshot_prices, snapshot_consensus = future.result()
+            except Exception as e:
+                print(f"Warning: couldn't parse {snapshot_dir}: {e}")
+                continue
+            if snapshot_history is None:
+                print(f"Warning: no Best Picture odds found in {snapshot_dir}")
+                continue
+            history.append(snapshot_history)
+            if snapshot_prices is not None:
+                prices.append(snapshot_prices)
+                consensus.append(snapshot_consensus)
+
+    if not history:
+        return None, None, None
+    print(f"Parsed {len(history)} of {len(snapshots)} snapshots.")
+    if not prices:
+        return pd.concat(history, ignore_index=True), None, None
+    return pd.concat(history, ignore_index=True), pd.concat(prices, ignore_index=True), pd.concat(consensus, ignore_index=True)
+
+
+def load_rows(history, prices=None, consensus=None):
+    '''
+    Upserts parsed rows, each season's goldderby rows into its own partition
+    '''
+    count = upsert_history(engine, history)
+    if prices is not None:
+        upsert_rows(engine, bookmaker_odds, prices)
+        upsert_rows(engine, market_consensus, consensus)
+
+    # the movie pages find a nominee's history through its season, movies new to movie_stats start with just that
+    nominees = history.groupby('Movie Name', as_index=False)['Season'].max()
+    upsert_rows(engine, movie_stats, nominees)
+
+    # seasons new to the database get their changes derived from the loaded history, ones already tracked
+    # keep theirs (python changes.py rebuild --season re-derives them)
+    seed_changes(engine, sorted(history['Season'].unique().tolist()))
+    rebuild_bundles(engine, history['Movie Name'].unique())
+
+    print(f"Loaded {count} rows across seasons {sorted(history['Season'].unique().tolist())}.")
+    return count
+
+
+def backfill(archive, workers=None, only_season=None):
+    '''
+    Parses every snapshot in the archive across worker processes and loads the rows
+    '''
+    history, prices, consensus = parse_archive(archive, workers, only_season)
+    if history is None:
+        print("No snapshots to load.")
+        return 0
+    return load_rows(history, prices, consensus)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('archive', help='folder with one subfolder per season')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    parser.add_argument('--season', type=int, default=None, help='only load this season')
+    args = parser.parse_args()
+    backfill(args.archive, args.workers, args.season)
@@ -0,0 +1,169 @@
+'''
+Load test of reads during an update: reader threads request movie pages and histories through the Flask
+test client in one process while another process writes snapshots the way the updater does (upsert_history
+and save_changes). Reports the read throughput before, during and after the writes, and the failed requests,
+for sqlite in WAL mode and with sqlite's default rollback journal, and optionally for postgres.
+
+Run from the odds-app folder:
+    python benchmarks/bench_concurrency.py --movies 500 --days 365 --readers 8 --seconds 15
+    python benchmarks/bench_concurrency.py --postgres postgresql+psycopg://localhost/odds_bench
+'''
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_history, make_movie_stats, make_news, movie_names
+
+# the routes that read the database on every request, the tables are served from the snapshot cache
+READ_ROUTES = ('/movie/{movie}', '/api/movie/{movie}/history?points=300')
+
+
+def read_worker(movies, readers, seconds):
+    '''
+    Requests READ_ROUTES for random movies from readers threads for seconds, returning when each request
+    finished and which failed
+    '''
+    from app import app
+
+    finished, failed = [], []
+    deadline = time.time() + seconds
+
+    def read():
+        client = app.test_client()
+        while time.time() < deadline:
+            url = random.choice(READ_ROUTES).format(movie=random.choice(movies))
+            try:
+                status = client.get(url).status_code
+            except Exception as e:
+                status = repr(e)
+            (finished if status == 200 else failed).append((time.time(), status))
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'finished': [at for at, _ in finished], 'failed': failed}
+
+
+def write_worker(movies, season, start, delay, seconds):
+    '''
+    Waits delay seconds, then writes one day's snapshot after another for seconds, as weekly_update does
+    '''
+    from changes import compute_changes, save_changes, tracked_values
+    from database import create_db_engine
+    from loader import upsert_history
+
+    engine = create_db_engine()
+    days = make_history(movies, days=200, start=start, seed=1)
+    time.sleep(delay)
+    began, writes, errors = time.time(), 0, []
+    for day, rows in days.groupby('Date'):
+        if time.time() - began > seconds:
+            break
+        try:
+            upsert_history(engine, rows)
+            observed_at = datetime.combine(day, datetime.min.time())
+            save_changes(engine, compute_changes(engine, season, tracked_values(rows), observed_at))
+            writes += 1
+        except Exception as e:
+            errors.append(repr(e))
+    return {'start': began, 'end': time.time(), 'writes': writes, 'errors': errors[:5], 'failed_writes': len(errors)}
+
+
+def run_worker(role, url, env, args):
+    return subprocess.Popen(
+        [sys.executable, __file__, f'--{role}-worker', url] + args,
+        env=dict(os.environ, DATABASE_URL=url, **env), cwd=ROOT, stdout=subprocess.PIPE, text=True,
+    )
+
+
+def load_test(url, env, season, start, args):
+    '''
+    Runs the readers for the whole test and the writer through its middle third, returning reads per second in each phase
+    '''
+    delay, window = args.seconds / 3, args.seconds / 3
+    common = ['--movies', str(args.movies), '--season', str(season)]
+    readers = run_worker('read', url, env, common + ['--readers', str(args.readers), '--seconds', str(args.seconds)])
+    writer = run_worker('write', url, env, common + ['--start', start.isoformat(), '--delay', str(delay), '--seconds', str(window)])
+    writes = json.loads(writer.communicate()[0].strip().splitlines()[-1])
+    reads = json.loads(readers.communicate()[0].strip().splitlines()[-1])
+
+    finished = reads['finished']
+    # the readers' first and last moments are warm-up and wind-down, only whole phases are compared
+    first = min(finished) if finished else writes['start']
+    phases = {
+        'before': (first, writes['start']),
+        'during': (writes['start'], writes['end']),
+        'after': (writes['end'], max(finished) if finished else writes['end']),
+    }
+    throughput = {}
+    for phase, (begin, end) in phases.items():
+        count = sum(1 for at in finished if begin <= at < end)
+        throughput[f'reads_per_s.{phase}'] = round(count / (end - begin), 1) if end > begin else None
+    failures = {}
+    for _, status in reads['failed']:
+        failures[str(status)] = failures.get(str(status), 0) + 1
+    return {**throughput, 'failed_reads': failures, 'writes': writes['writes'], 'failed_writes': writes['failed_writes'],
+            'write_errors': writes['errors']}
+
+
+def main():
+    from benchmarks.bench_suite import load_database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', type=int, default=500)
+    parser.add_argument('--days', type=int, default=365, help='daily snapshots of history loaded first')
+    parser.add_argument('--readers', type=int, default=8, help='reader threads in the app process')
+    parser.add_argument('--seconds', type=float, default=15, help='length of the test, the writes run through the middle third')
+    parser.add_argument('--postgres', help='also test this (scratch) postgres database')
+    parser.add_argument('--read-worker', metavar='DB_URL', help=argparse.SUPPRESS)
+    parser.add_argument('--write-worker', metavar='DB_URL', help=argparse.SUPPRESS)
+    parser.add_argument('--season', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--start', help=argparse.SUPPRESS)
+    parser.add_argument('--delay', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.read_worker:
+        print(json.dumps(read_worker(movie_names(args.movies), args.readers, args.seconds)))
+        return
+    if args.write_worker:
+        start = datetime.fromisoformat(args.start).date()
+        print(json.dumps(write_worker(args.movies, args.season, start, args.delay, args.seconds)))
+        return
+
+    stats, news = make_movie_stats(args.movies), make_news(args.movies)
+    history = make_history(args.movies, args.days)
+    start = history['Date'].max() + timedelta(days=1)
+    print(f'{len(history)} goldderby rows, {args.movies} movies, {args.readers} readers', file=sys.stderr)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        season = load_database(f'sqlite:///{tmp}/loaded.db', stats, history, news)
+        for journal in ('WAL', 'DELETE'):
+            # every run starts from the same freshly loaded copy, the writes change it
+            shutil.copy(f'{tmp}/loaded.db', f'{tmp}/{journal}.db')
+            result = load_test(f'sqlite:///{tmp}/{journal}.db', {'SQLITE_JOURNAL_MODE': journal, 'CURRENT_SEASON': str(season)},
+                               season, start, args)
+            results[f'sqlite.{journal.lower()}'] = result
+        if args.postgres:
+            season = load_database(args.postgres, stats, history, news)
+            results['postgres'] = load_test(args.postgres, {'CURRENT_SEASON': str(season)}, season, start, args)
+
+    params = {'movies': args.movies, 'days': args.days, 'rows': len(history), 'readers': args.readers, 'seconds': args.seconds}
+    print(json.dumps({'params': params, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
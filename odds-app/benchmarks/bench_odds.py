@@ -0,0 +1,61 @@
+'''
+Times recomputing the implied probabilities over a whole goldderby history: the old per-string
+odds_to_prob applied row by row (twice for betting_pct) against the vectorized odds.add_implied_probabilities.
+
+Run from the odds-app folder:
+    python benchmarks/bench_odds.py --movies 240 --days 1825
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_history
+from odds import add_implied_probabilities
+
+
+def legacy_odds_to_prob(odds):
+    try:
+        if '/' in odds:
+            vals = odds.split('/')
+            numerator, denominator = int(vals[0]), int(vals[1])
+            prob = (denominator / (numerator + denominator)) * 100
+        else:
+            decimal_odds = float(odds)
+            prob = (1 / decimal_odds) * 100
+        return int(round(prob))
+    except:
+        return None
+
+
+def legacy_implied_probabilities(df):
+    df['imp_prob_expert'] = df['Experts Odds'].apply(lambda x: legacy_odds_to_prob(x) if x != 'N/A' else None)
+    df['imp_prob_star24'] = df['Star24 Odds'].apply(lambda x: legacy_odds_to_prob(x) if x != 'N/A' else None)
+    df['imp_prob_user'] = df['Users Odds'].apply(lambda x: legacy_odds_to_prob(x) if x != 'N/A' else None)
+    df['betting_pct'] = df['betting_odds'].apply(lambda x: int(legacy_odds_to_prob(x)) if x != 'N/A' and legacy_odds_to_prob(x) is not None else None)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', type=int, default=240)
+    parser.add_argument('--days', type=int, default=365 * 5)
+    args = parser.parse_args()
+
+    history = make_history(args.movies, args.days)
+    print(f'{len(history)} goldderby rows')
+
+    timings = {}
+    for name, recompute in (('per-string apply', legacy_implied_probabilities), ('vectorized', add_implied_probabilities)):
+        df = history.copy()
+        start = time.perf_counter()
+        recompute(df)
+        timings[name] = time.perf_counter() - start
+        print(f'  {name:<18}{timings[name] * 1000:10.1f} ms')
+    print(f"  speedup {timings['per-string apply'] / timings['vectorized']:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Times the Oddschecker lookup for every nominee: the old per-movie soup.find/find_next search on an
+html.parser tree against the single-pass lxml index in parsers.parse_oddschecker_odds.
+
+Run from the odds-app folder, optionally on a saved browser-rendered page:
+    python benchmarks/bench_oddschecker.py --runners 500
+    python benchmarks/bench_oddschecker.py --page saved_oddschecker.html
+'''
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+from benchmarks.pages import make_oddschecker_page
+from parsers import parse_oddschecker_odds
+
+
+def legacy_lookup(html_content, names):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    found = {}
+    for name in names:
+        movie_tag = soup.find('span', {'data-name': name})
+        if not movie_tag:
+            continue
+        ew_tag = movie_tag.find_next(
+            lambda tag: tag.name == 'td' and tag.has_attr('data-best-ew') and tag['data-best-ew'] == 'true')
+        if ew_tag:
+            found[name] = ew_tag.get('data-o', None)
+    return found
+
+
+def indexed_lookup(html_content, names):
+    odds_rows = parse_oddschecker_odds(html_content)
+    return {name: odds_rows[name].best_ew for name in names if name in odds_rows}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page', help='saved Oddschecker page, a synthetic one is generated otherwise')
+    parser.add_argument('--runners', type=int, default=500)
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page, encoding='utf-8') as f:
+            html_content = f.read()
+    else:
+        html_content = make_oddschecker_page(args.runners)
+    names = sorted(set(re.findall(r'<span[^>]*data-name="([^"]+)"', html_content)))
+
+    legacy, legacy_s = timed(legacy_lookup, html_content, names)
+    indexed, indexed_s = timed(indexed_lookup, html_content, names)
+    assert legacy == indexed, 'the parsers disagree on the best each-way prices'
+
+    print(f'{len(names)} runners, {len(html_content) / 1e6:.1f} MB page')
+    print(f'  per-movie find_next (html.parser): {legacy_s:8.3f} s')
+    print(f'  single-pass index (lxml):          {indexed_s:8.3f} s  ({legacy_s / indexed_s:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+'''
+Times the queries the routes run against a multi-year, multi-category history, once on tables dumped
+with DataFrame.to_sql (untyped, no keys or indexes) and once on the typed schema from schema.py,
+where the latest-snapshot queries only read the newest season's partition.
+
+Run from the odds-app folder, optionally against a scratch postgres database:
+    python benchmarks/bench_queries.py --movies 240 --days 1825
+    python benchmarks/bench_queries.py --url postgresql+psycopg://localhost/odds_bench
+'''
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, text
+
+from benchmarks.synthetic import make_history, make_movie_stats, make_news
+from schema import assign_seasons, create_tables, history_kind, load_table, metadata, movie_news, movie_stats, partition_name, season_table
+
+QUERIES = {
+    'latest snapshot': ('''
+        SELECT gd."Movie Name", gd.imp_prob_expert, gd.imp_prob_user, gd.imp_prob_star24, gd.betting_pct, gd."Date"
+        FROM movie_stats ms
+        JOIN {latest} gd ON ms."Movie Name" = gd."Movie Name"
+        WHERE gd."Date" = (SELECT MAX("Date") FROM {latest})
+    ''', {}),
+    'latest date': ('SELECT MAX("Date") FROM {latest}', {}),
+    'movie history': ('''
+        SELECT "Date", "pct_vote_expert", "pct_vote_user", "pct_vote_star24", "betting_pct"
+        FROM goldderby
+        WHERE "Movie Name" = :movie_name
+        ORDER BY "Date"
+    ''', {'movie_name': 'Movie 00117'}),
+    'movie stats': ('SELECT * FROM movie_stats WHERE "Movie Name" = :movie_name', {'movie_name': 'Movie 00117'}),
+    'news lookup': ('SELECT articles, last_updated FROM movie_news WHERE movie_name = :movie_name', {'movie_name': 'Movie 00117'}),
+}
+
+
+def drop_history(engine):
+    with engine.begin() as conn:
+        kind = history_kind(conn)
+        if kind == 'view':
+            conn.execute(text('DROP VIEW goldderby'))
+        elif kind:
+            conn.execute(text('DROP TABLE goldderby CASCADE' if engine.dialect.name == 'postgresql' else 'DROP TABLE goldderby'))
+        for name in inspect(conn).get_table_names():
+            if name.startswith('goldderby'):
+                conn.execute(text(f'DROP TABLE "{name}"'))
+
+
+def load_untyped(engine, stats, history, news):
+    metadata.drop_all(engine)
+    drop_history(engine)
+    stats.to_sql('movie_stats', engine, index=False, if_exists='replace')
+    history.assign(Date=history['Date'].astype(str)).to_sql('goldderby', engine, index=False, if_exists='replace', chunksize=50000)
+    news.to_sql('movie_news', engine, index=False, if_exists='replace')
+    return 'goldderby'
+
+
+def load_typed(engine, stats, history, news):
+    for name in ('movie_stats', 'movie_news'):
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {name}'))
+    drop_history(engine)
+    history = assign_seasons(history)
+    latest_season = int(history['Season'].max())
+    for season, season_rows in history.groupby('Season'):
+        create_tables(engine, season)
+        with engine.begin() as conn:
+            load_table(season_table(season), season_rows, conn)
+    with engine.begin() as conn:
+        load_table(movie_stats, stats, conn)
+        load_table(movie_news, news, conn)
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text('ANALYZE'))
+    return partition_name(latest_season)
+
+
+def time_queries(engine, repeat, latest):
+    timings = {}
+    with engine.connect() as conn:
+        for name, (query, params) in QUERIES.items():
+            query = text(query.format(latest=latest))
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(query, params).fetchall()
+                samples.append(time.perf_counter() - start)
+            timings[name] = statistics.median(samples)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', type=int, default=240, help='nominees across all categories')
+    parser.add_argument('--days', type=int, default=365 * 5, help='daily snapshots of history')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--url', help='database to benchmark on, a temporary sqlite file by default')
+    args = parser.parse_args()
+
+    stats, history, news = make_movie_stats(args.movies), make_history(args.movies, args.days), make_news(args.movies)
+    print(f'{len(history)} goldderby rows, {args.movies} movies, {args.days} days')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.url or f'sqlite:///{tmp}/bench.db')
+        results = {}
+        for name, loader in (('to_sql dump', load_untyped), ('typed schema', load_typed)):
+            latest = loader(engine, stats, history, news)
+            results[name] = time_queries(engine, args.repeat, latest)
+        engine.dispose()
+
+    print(f"{'query':<18}{'to_sql dump':>14}{'typed schema':>14}")
+    for query in QUERIES:
+        before, after = results['to_sql dump'][query], results['typed schema'][query]
+        print(f'{query:<18}{before * 1000:>12.2f}ms{after * 1000:>12.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
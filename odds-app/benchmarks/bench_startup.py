@@ -0,0 +1,73 @@
+'''
+Compares worker cold start and memory for the web tier with and without pandas loaded.
+
+Each measurement runs in a fresh interpreter (like a newly forked gunicorn worker), imports
+the app, serves the first request to each table route and reports import time, first
+request time and peak RSS. The "pandas" path preloads pandas and numpy before the app, which is
+what every worker paid before the request path stopped using DataFrames.
+
+Run from the odds-app folder once the database has been created:
+    python benchmarks/bench_startup.py --runs 5
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, resource, sys, time
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+if {with_pandas!r}:
+    import numpy, pandas
+import app as web
+imported = time.perf_counter()
+client = web.app.test_client()
+for route in ('/', '/movies-odds', '/win_votes_table'):
+    client.get(route)
+served = time.perf_counter()
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    'import_s': imported - start,
+    'first_requests_s': served - imported,
+    'max_rss_mb': rss_kb / 1024 if sys.platform != 'darwin' else rss_kb / 1024 / 1024,
+    'pandas_loaded': 'pandas' in sys.modules,
+}}))
+'''
+
+
+def measure(with_pandas, runs):
+    code = CHILD.format(app_dir=APP_DIR, with_pandas=with_pandas)
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {
+        'import_s': statistics.median(r['import_s'] for r in results),
+        'first_requests_s': statistics.median(r['first_requests_s'] for r in results),
+        'max_rss_mb': statistics.median(r['max_rss_mb'] for r in results),
+        'pandas_loaded': results[0]['pandas_loaded'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    report = {
+        'pandas': measure(True, args.runs),
+        'lean': measure(False, args.runs),
+    }
+    for name, result in report.items():
+        print(f"{name:>7}: import {result['import_s'] * 1000:7.1f} ms  first requests {result['first_requests_s'] * 1000:7.1f} ms  "
+              f"peak rss {result['max_rss_mb']:6.1f} MB  (pandas loaded: {result['pandas_loaded']})")
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+'''
+Benchmark suite over a synthetic history far larger than the sample data, written out as JSON so runs
+from different commits can be compared:
+
+- routes: homepage, index, win_votes_table, movie_page and the movie history API through the Flask
+  test client, cold (snapshot cache cleared) and warm, on sqlite and optionally on postgres
+- scraping: find_movies and find_odds_for_movie against saved fixture pages, parse_oddschecker_odds
+- computation: calculate_pct_votes, odds_to_prob row by row and the vectorized implied_probability
+
+Run from the odds-app folder:
+    python benchmarks/bench_suite.py --movies 2000 --days 730 --output results.json
+    python benchmarks/bench_suite.py --postgres postgresql+psycopg://localhost/odds_bench
+    python benchmarks/bench_suite.py --compare results.json   # exits 1 if anything got slower than --tolerance
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# weekly_update builds its engine at import, the scraping benchmarks never use it
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import httpx
+import pandas as pd
+
+from benchmarks.pages import make_goldderby_page, make_oddschecker_page, runner_name
+from benchmarks.synthetic import make_history, make_movie_stats, make_news
+
+ROUTES = {
+    'homepage': '/',
+    'index': '/movies-odds',
+    'win_votes_table': '/win_votes_table',
+    'movie_page': '/movie/{movie}',
+    'movie_history': '/api/movie/{movie}/history?points=300',
+}
+
+
+def measure(fn, repeat, setup=None):
+    '''
+    Runs fn repeat times after one untimed warm-up, returning the timings in milliseconds
+    '''
+    if setup:
+        setup()
+    fn()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': round(statistics.median(samples), 3), 'min_ms': round(min(samples), 3), 'runs': repeat}
+
+
+def bench_routes(db_url, season, movie, repeat):
+    '''
+    Times every route through the test client, runs in its own process since app.py reads DATABASE_URL at import
+    '''
+    from app import app
+    from snapshot_cache import snapshot_cache
+
+    client = app.test_client()
+    results = {}
+    for name, path in ROUTES.items():
+        url = path.format(movie=movie)
+
+        def get():
+            response = client.get(url)
+            assert response.status_code == 200, f'{url} returned {response.status_code}'
+
+        results[f'{name}.cold'] = measure(get, repeat, setup=snapshot_cache.clear)
+        results[f'{name}.warm'] = measure(get, repeat)
+    return results
+
+
+def run_routes(db_url, season, movie, repeat):
+    env = dict(os.environ, DATABASE_URL=db_url, CURRENT_SEASON=str(season))
+    output = subprocess.run(
+        [sys.executable, __file__, '--routes-worker', db_url, '--season', str(season), '--movie', movie, '--repeat', str(repeat)],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def load_database(url, stats, history, news):
+    '''
+    Loads the synthetic data into the typed, season-partitioned schema and derives the latest season's changes
+    and the movie bundles, returning the latest season
+    '''
+    from benchmarks.bench_queries import load_typed
+    from bundles import rebuild_bundles
+    from changes import rebuild_changes
+    from database import create_db_engine
+    from schema import assign_seasons
+
+    engine = create_db_engine(url)
+    latest_season = int(assign_seasons(history)['Season'].max())
+    load_typed(engine, stats.assign(Season=latest_season), history, news)
+    # the routes read the latest season through its changes
+    rebuild_changes(engine, latest_season)
+    # and the movie pages their bundles
+    rebuild_bundles(engine)
+    engine.dispose()
+    return latest_season
+
+
+def fixture_pages(directory, movies, runners):
+    '''
+    Saved pages to scrape: goldderby.html and oddschecker.html from directory, generated there if missing
+    '''
+    os.makedirs(directory, exist_ok=True)
+    pages = {}
+    for file_name, make in (('goldderby.html', lambda: make_goldderby_page(movies)),
+                            ('oddschecker.html', lambda: make_oddschecker_page(runners))):
+        path = os.path.join(directory, file_name)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(make())
+        with open(path, encoding='utf-8') as f:
+            pages[file_name] = f.read()
+    return pages
+
+
+def bench_scraping(pages, movie_names, repeat):
+    import weekly_update
+    from parsers import parse_oddschecker_odds
+
+    # serving the saved page in place of Goldderby, so find_movies runs its whole fetch and parse path offline
+    goldderby_page = pages['goldderby.html']
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=goldderby_page))
+    weekly_update.make_client = lambda: httpx.Client(transport=transport)
+    movies_df = pd.DataFrame({'Movie Name': movie_names})
+
+    odds_rows = parse_oddschecker_odds(pages['oddschecker.html'])
+    runners = list(odds_rows)
+    return {
+        'find_movies': measure(lambda: weekly_update.find_movies('https://www.goldderby.com/odds/', movies_df), repeat),
+        'parse_oddschecker_odds': measure(lambda: parse_oddschecker_odds(pages['oddschecker.html']), repeat),
+        'find_odds_for_movie': measure(lambda: [weekly_update.find_odds_for_movie(name, odds_rows) for name in runners], repeat),
+    }
+
+
+def bench_computation(history, repeat):
+    from odds import implied_probability, odds_to_prob
+    from weekly_update import calculate_pct_votes
+
+    return {
+        'calculate_pct_votes': measure(lambda: calculate_pct_votes(history, 'Experts Vote'), repeat),
+        'odds_to_prob': measure(lambda: history['Experts Odds'].map(odds_to_prob), repeat),
+        'implied_probability': measure(lambda: implied_probability(history['Experts Odds']), repeat),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints every benchmark's change against a baseline run, returning the names of those slower than tolerance allows
+    '''
+    regressions = []
+    print(f"{'benchmark':<44}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for name, timing in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median_ms'], timing['median_ms']
+        ratio = after / before if before else float('inf')
+        flag = ' !' if ratio > tolerance else ''
+        print(f'{name:<44}{before:>10.2f}ms{after:>10.2f}ms{ratio:>7.2f}x{flag}')
+        if ratio > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', type=int, default=2000, help='nominees across all categories')
+    parser.add_argument('--days', type=int, default=365 * 2, help='daily snapshots of history')
+    parser.add_argument('--category-size', type=int, default=10, help='nominees per category')
+    parser.add_argument('--runners', type=int, default=500, help='runners on the Oddschecker fixture page')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--postgres', help='also time the routes on this (scratch) postgres database')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'odds-bench-fixtures'),
+                        help='folder of saved pages to scrape, generated pages are saved there when missing')
+    parser.add_argument('--output', help='write the results to this JSON file, stdout by default')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio counted as a regression')
+    parser.add_argument('--routes-worker', metavar='DB_URL', help=argparse.SUPPRESS)
+    parser.add_argument('--season', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--movie', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.routes_worker:
+        print(json.dumps(bench_routes(args.routes_worker, args.season, args.movie, args.repeat)))
+        return
+
+    stats, news = make_movie_stats(args.movies), make_news(args.movies)
+    history = make_history(args.movies, args.days, category_size=args.category_size)
+    movie = stats['Movie Name'].iloc[len(stats) // 2]
+    print(f'{len(history)} goldderby rows, {args.movies} movies, {args.days} days', file=sys.stderr)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        databases = {'sqlite': f'sqlite:///{tmp}/bench.db'}
+        if args.postgres:
+            databases['postgres'] = args.postgres
+        for backend, url in databases.items():
+            season = load_database(url, stats, history, news)
+            for name, timing in run_routes(url, season, movie, args.repeat).items():
+                results[f'routes.{backend}.{name}'] = timing
+
+    pages = fixture_pages(args.fixtures, stats['Movie Name'].tolist()[:200], args.runners)
+    names = stats['Movie Name'].tolist()[:200] + [runner_name(i) for i in range(args.runners)]
+    for name, timing in bench_scraping(pages, names, args.repeat).items():
+        results[f'scraping.{name}'] = timing
+    for name, timing in bench_computation(history, args.repeat).items():
+        results[f'computation.{name}'] = timing
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': {'movies': args.movies, 'days': args.days, 'category_size': args.category_size,
+                   'rows': len(history), 'runners': args.runners, 'repeat': args.repeat},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['params'] != report['params']:
+            print(f"Warning: the baseline ran with {baseline['params']}, timings may not be comparable", file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.tolerance}x: {", ".join(regressions)}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
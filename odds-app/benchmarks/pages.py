@@ -0,0 +1,64 @@
+'''
+Synthetic stand-ins for the scraped pages, shaped like the parts of the real markup the parsers read
+'''
+import random
+
+BOOKMAKERS = ['B3', 'SK', 'PP', 'WH', 'EE', 'FB', 'VC', 'PE', 'LD', 'CE', 'UN', 'BF', 'SX', 'BY', 'OE', 'MR', 'QN', 'WA', 'LS', 'G5']
+
+
+def runner_name(i):
+    return f'Runner {i:04d}'
+
+
+def fractional(rng):
+    numerator = rng.randint(1, 200)
+    denominator = rng.choice([1, 2, 4, 5])
+    return f'{numerator}/{denominator}'
+
+
+def make_oddschecker_page(runners=500, bookmakers=BOOKMAKERS, filler=2000, seed=0):
+    '''
+    Builds a browser-rendered-sized Oddschecker page: navigation and promo filler around an odds
+    table with one row per runner and one priced cell per bookmaker
+    '''
+    rng = random.Random(seed)
+    parts = ['<html><head><title>Best Picture Odds</title></head><body>']
+    parts.extend(f'<div class="promo"><a href="/offer/{i}"><span>Offer {i}</span></a><p>Terms apply</p></div>' for i in range(filler))
+    parts.append('<table class="eventTable"><tbody id="t1">')
+    for i in range(runners):
+        name = runner_name(i)
+        best = rng.randrange(len(bookmakers))
+        parts.append(f'<tr class="diff-row evTabRow bc" data-bname="{name}"><td class="sel nm basket-active">'
+                     f'<a class="popup selTxt" data-name="{name}"><span data-name="{name}">{name}</span></a></td>')
+        for j, bookmaker in enumerate(bookmakers):
+            odds = fractional(rng)
+            best_ew = ' data-best-ew="true"' if j == best else ''
+            parts.append(f'<td class="bc bs" data-bk="{bookmaker}" data-o="{odds}"{best_ew}><p>{odds}</p></td>')
+        parts.append('</tr>')
+    parts.append('</tbody></table>')
+    parts.extend(f'<footer><ul><li><a href="/help/{i}">Help {i}</a></li></ul></footer>' for i in range(filler // 4))
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def make_goldderby_page(movies, categories=20, contenders=20, filler=500, seed=0):
+    '''
+    Builds a Goldderby odds page: one predictions list per category, Best Picture listing every given movie
+    and the other categories contenders each, inside site chrome filler
+    '''
+    rng = random.Random(seed)
+    parts = ['<html><head><title>Oscar Predictions</title></head><body>']
+    parts.extend(f'<div class="widget"><a href="/article/{i}">Article {i}</a><p>Teaser text</p></div>' for i in range(filler))
+    parts.append('<div id="odds-page">')
+    for c in range(categories):
+        title = 'Best Picture' if c == 0 else f'Category {c}'
+        names = movies if c == 0 else [f'Contender {c}-{i}' for i in range(contenders)]
+        parts.append(f'<div class="category-title">{title}</div><ul class="predictions-list">')
+        for name in names:
+            parts.append(f'<li><div class="predictions-name">{name}</div>'
+                         f'<div class="predictions-odds">{rng.randint(0, 30)}</div>'
+                         f'<div class="predictions-odds">{rng.randint(0, 2000)}</div>'
+                         f'<div class="predictions-odds">{fractional(rng)}</div></li>')
+        parts.append('</ul>')
+    parts.append('</div></body></html>')
+    return ''.join(parts)
@@ -0,0 +1,83 @@
+'''
+Generators for synthetic histories far larger than the sample data: many categories of nominees
+scraped every day for years
+'''
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+def movie_names(movies):
+    return [f'Movie {i:05d}' for i in range(movies)]
+
+
+def make_movie_stats(movies):
+    names = movie_names(movies)
+    return pd.DataFrame({
+        'Movie Name': names,
+        'Director': [f'Director {i}' for i in range(movies)],
+        'Released': [date(2020, 1, 1) + timedelta(days=i % 1500) for i in range(movies)],
+        'Actors': 'Actor A, Actor B, Actor C',
+        'Plot': 'A synthetic plot.',
+        'RT Score': '90%',
+        'imdb_id': [f'tt{i:08d}' for i in range(movies)],
+        'Poster': None,
+    })
+
+
+def fractional_odds(probabilities, rng):
+    # turning win probabilities into GoldDerby/bookmaker style "n/d" strings
+    denominators = rng.choice([1, 2, 4], size=len(probabilities))
+    numerators = np.maximum(1, np.round((1 / np.clip(probabilities, 0.005, 0.95) - 1) * denominators)).astype(int)
+    return [f'{n}/{d}' for n, d in zip(numerators, denominators)]
+
+
+def make_history(movies=240, days=365 * 5, start=date(2020, 8, 1), category_size=10, seed=0):
+    '''
+    Builds a goldderby-shaped history: every movie belongs to a category of category_size nominees
+    and gets one row per day, with votes drifting as a random walk
+    '''
+    rng = np.random.default_rng(seed)
+    names = np.array(movie_names(movies))
+    dates = [start + timedelta(days=d) for d in range(days)]
+    frames = []
+    strength = rng.random(movies) + 0.1
+    for day in dates:
+        strength = np.clip(strength * np.exp(rng.normal(0, 0.05, movies)), 0.01, None)
+        # probabilities normalised within each category
+        categories = np.arange(movies) // category_size
+        totals = np.bincount(categories, weights=strength)[categories]
+        probabilities = strength / totals
+        votes = {group: rng.poisson(probabilities * scale) for group, scale in (('Experts', 30), ('Star24', 24), ('Users', 2000))}
+        pct = {group: np.round(values / np.maximum(np.bincount(categories, weights=values)[categories], 1) * 100).astype(int)
+               for group, values in votes.items()}
+        implied = np.round(probabilities * 100).astype(int)
+        betting = np.clip(implied + rng.integers(-5, 6, movies), 1, 99)
+        frames.append(pd.DataFrame({
+            'Movie Name': names,
+            'Experts Vote': votes['Experts'],
+            'Experts Odds': fractional_odds(probabilities, rng),
+            'Star24 Vote': votes['Star24'],
+            'Star24 Odds': fractional_odds(probabilities, rng),
+            'Users Vote': votes['Users'],
+            'Users Odds': fractional_odds(probabilities, rng),
+            'Date': day,
+            'pct_vote_expert': pct['Experts'],
+            'pct_vote_star24': pct['Star24'],
+            'pct_vote_user': pct['Users'],
+            'imp_prob_expert': implied,
+            'imp_prob_star24': implied,
+            'imp_prob_user': implied,
+            'betting_odds': fractional_odds(betting / 100, rng),
+            'betting_pct': betting,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_news(movies):
+    return pd.DataFrame({
+        'movie_name': movie_names(movies),
+        'articles': '[]',
+        'last_updated': pd.Timestamp.now(),
+    })
@@ -0,0 +1,205 @@
+'''
+Prebuilds each movie page's data into one movie_bundles row: the movie's stats, its chart series already
+downsampled and serialized, and its cached articles. The page then costs one primary key read, and the
+bundles are rebuilt only for the movies an update changed or whose news was refreshed.
+
+Large rebuilds are split across worker processes, building a bundle is mostly formatting timestamps, which
+threads can't share. Smaller ones stay in the calling process: a bundle builds in about 3.5 ms, while each
+worker costs about 20 ms to start (fork, its own engine and first query), so on 8 workers a rebuild has to
+reach about 50 movies before the pool pays for itself (measured on a 1000-movie synthetic history: 50 movies
+in 0.17 s serially, the same 50 through 2 and 4 workers 0.24 s and 0.30 s before any parallel gain).
+The history API builds its series with the same functions, for the ranges and resolutions
+the bundle doesn't hold.
+    python bundles.py              # rebuilds every movie's bundle, reporting how long it took
+    python bundles.py --workers 16
+'''
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time
+from itertools import repeat
+from time import perf_counter
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, text
+
+import metrics
+from database import create_db_engine
+from downsample import as_datetime, bucket_last, lttb, step_series
+from loader import upsert_records
+from schema import CURRENT_SEASON, movie_bundles
+
+load_dotenv()
+
+# series that can be requested from the history, and that the bundles hold
+HISTORY_SERIES = ('pct_vote_expert', 'pct_vote_user', 'pct_vote_star24', 'betting_pct')
+# points per series kept in a bundle, about as many as the widest chart shows
+BUNDLE_POINTS = int(os.getenv('BUNDLE_POINTS', '1000'))
+# worker processes for large rebuilds, one per CPU by default
+BUNDLE_WORKERS = int(os.getenv('BUNDLE_WORKERS', '0')) or os.cpu_count()
+# rebuilds of fewer movies (a news refresh, a poll where a few odds moved) stay in the calling process,
+# starting the workers costs more than building that many bundles (see above)
+PARALLEL_MIN = 50
+
+
+def read_changes(conn, movie_name, season, series=HISTORY_SERIES):
+    '''
+    The movie's changes of each series in time order, and when a run last saw it
+    '''
+    params = {"movie_name": movie_name, "season": season, "series": list(series)}
+    # read straight off odds_changes' primary key
+    query = text('''
+        SELECT series, changed_at, value FROM odds_changes
+        WHERE "Season" = :season AND "Movie Name" = :movie_name AND series IN :series
+        ORDER BY series, changed_at
+    ''').bindparams(bindparam('series', expanding=True))
+    changes = conn.execute(query, params).all()
+    last_checked = conn.execute(text('''
+        SELECT checked_at FROM odds_current WHERE "Season" = :season AND "Movie Name" = :movie_name
+    '''), params).scalar()
+    return changes, last_checked
+
+
+def history_series(changes, series=HISTORY_SERIES, start=None, end=None, bucket=None, points=None, until=None):
+    '''
+    Turns changes into one {"x": times, "y": values} pair per series: a point wherever the value changed, and the
+    last value again at until (the latest check). start/end are dates limiting the range, bucket keeps the value each
+    day or week ends on and points downsamples each series to about that many points with LTTB.
+    '''
+    # the series run from the start of the start day to the end of the end day, or until
+    since = datetime.combine(start, time.min) if start else None
+    if end:
+        until = min(until, datetime.combine(end, time.max)) if until else datetime.combine(end, time.max)
+
+    result = {}
+    for name in series:
+        events = [(as_datetime(changed_at), value) for series_name, changed_at, value in changes
+                  if series_name == name and value is not None]
+        times, values = step_series([moment for moment, _ in events], [value for _, value in events], since, until)
+        if bucket:
+            times, values = bucket_last(times, values, bucket)
+        if points:
+            keep = lttb([moment.toordinal() if bucket else moment.timestamp() for moment in times], values, points)
+            times, values = [times[k] for k in keep], [values[k] for k in keep]
+        x = [moment.isoformat() if bucket else moment.isoformat(' ', 'minutes') for moment in times]
+        result[name] = {"x": x, "y": values}
+    return result
+
+
+def extend_series(series, checked_at):
+    '''
+    Carries each series' last value on to checked_at. Bundles stop at each series' last change, so runs that
+    only checked a movie don't need to rebuild it.
+    '''
+    if checked_at is None:
+        return series
+    last = as_datetime(checked_at).isoformat(' ', 'minutes')
+    for points in series.values():
+        if points["x"] and points["x"][-1] < last:
+            points["x"].append(last)
+            points["y"].append(points["y"][-1])
+    return series
+
+
+def build_bundle(engine, movie_name):
+    '''
+    Reads everything the movie's page shows, None when there's no such movie
+    '''
+    with engine.connect() as conn:
+        stats = conn.execute(text('SELECT * FROM movie_stats WHERE "Movie Name" = :movie_name'),
+                             {"movie_name": movie_name}).mappings().first()
+        if stats is None:
+            return None
+        season = stats['Season'] or CURRENT_SEASON
+        changes, _ = read_changes(conn, movie_name, season)
+        news = conn.execute(text('SELECT articles, last_updated FROM movie_news WHERE movie_name = :movie_name'),
+                            {"movie_name": movie_name}).first()
+
+    return {
+        "season": season,
+        # dates and timestamps as the template prints them
+        "stats": {name: None if value is None else value if isinstance(value, (int, float)) else str(value)
+                  for name, value in stats.items()},
+        "series": history_series(changes, points=BUNDLE_POINTS),
+        "articles": json.loads(news.articles) if news and news.articles else [],
+        "news_updated": str(news.last_updated) if news and news.last_updated else None,
+    }
+
+
+def build_timed(engine, movie_name):
+    start = perf_counter()
+    return movie_name, build_bundle(engine, movie_name), perf_counter() - start
+
+
+def build_batch(url, movie_names):
+    '''
+    Builds a batch of bundles in a worker process, on an engine of its own
+    '''
+    engine = create_db_engine(url)
+    try:
+        return [build_timed(engine, movie_name) for movie_name in movie_names]
+    finally:
+        engine.dispose()
+
+
+def rebuild_bundles(engine, movie_names=None, workers=BUNDLE_WORKERS):
+    '''
+    Rebuilds the bundles of movie_names (every movie in movie_stats when None), across worker processes when
+    there are many, and saves them in one transaction, returning the bundles built by movie name
+    '''
+    if movie_names is None:
+        with engine.connect() as conn:
+            movie_names = conn.execute(text('SELECT "Movie Name" FROM movie_stats')).scalars().all()
+    movie_names = sorted(set(movie_names))
+    if not movie_names:
+        return {}
+
+    start = perf_counter()
+    with metrics.timed('build_bundles'):
+        if workers <= 1 or len(movie_names) < PARALLEL_MIN:
+            workers = 1
+            built = [build_timed(engine, movie_name) for movie_name in movie_names]
+        else:
+            url = engine.url.render_as_string(hide_password=False)
+            batches = [movie_names[i::workers] for i in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                built = [result for batch in executor.map(build_batch, repeat(url), batches) for result in batch]
+    built = [result for result in built if result[1] is not None]
+    build_seconds = perf_counter() - start
+
+    built_at = datetime.now()
+    rows = [(movie_name, bundle["season"], json.dumps(bundle, separators=(',', ':')), built_at) for movie_name, bundle, _ in built]
+    upsert_records(engine, movie_bundles, ["Movie Name", "Season", "bundle", "built_at"], rows)
+
+    slowest_name, _, slowest = max(built, key=lambda result: result[2], default=(None, None, 0))
+    where = f'with {workers} workers' if workers > 1 else 'in the calling process'
+    print(f"Built {len(built)} movie bundles in {build_seconds:.2f} s {where} "
+          f"(saved in {perf_counter() - start - build_seconds:.2f} s, slowest '{slowest_name}' {slowest * 1000:.0f} ms).")
+    return {movie_name: bundle for movie_name, bundle, _ in built}
+
+
+def read_bundle(engine, movie_name):
+    '''
+    The movie's bundle with its series carried on to the latest check, in one indexed read. None when it has no bundle yet.
+    '''
+    with engine.connect() as conn:
+        row = conn.execute(text('''
+            SELECT mb.bundle, oc.checked_at FROM movie_bundles mb
+            LEFT JOIN odds_current oc ON oc."Season" = mb."Season" AND oc."Movie Name" = mb."Movie Name"
+            WHERE mb."Movie Name" = :movie_name
+        '''), {"movie_name": movie_name}).first()
+    if row is None:
+        return None
+    bundle = json.loads(row.bundle)
+    extend_series(bundle["series"], row.checked_at)
+    return bundle
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=BUNDLE_WORKERS, help='worker processes, one per CPU by default')
+    args = parser.parse_args()
+
+    rebuild_bundles(create_db_engine(), workers=args.workers)
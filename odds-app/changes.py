@@ -0,0 +1,158 @@
+'''
+Keeps the odds as change events, so polling often only costs storage when the odds actually move.
+odds_current holds every movie's latest value of each tracked series, and odds_changes gets one row
+per series whenever its value changes. A run diffs its snapshot against odds_current and writes just the differences.
+
+The events of seasons loaded from the daily history (create_db.py, backfill.py) are derived from it,
+and can be rebuilt after the history is edited:
+    python changes.py rebuild
+    python changes.py rebuild --season 2024
+'''
+from collections import namedtuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from loader import upsert_rows
+from schema import TRACKED_SERIES, begin_ddl, load_table, odds_changes, odds_current, partition_name
+
+# what a run changed: the odds_changes rows to add and the odds_current rows to replace
+Changes = namedtuple('Changes', ['events', 'current'])
+
+
+def tracked_values(history, consensus=None, keys=('Movie Name',)):
+    '''
+    The tracked series of goldderby rows and their market consensus, one row per keys
+    '''
+    keys = list(keys)
+    state = history[keys].copy()
+    for name in TRACKED_SERIES:
+        if name in history.columns:
+            state[name] = pd.to_numeric(history[name].replace('N/A', None), errors='coerce')
+    if consensus is not None and len(consensus):
+        state = state.merge(consensus[keys + ['consensus_pct']], on=keys, how='left')
+    state = state.reindex(columns=keys + list(TRACKED_SERIES))
+    # the consensus moves by fractions of a percent whenever any bookmaker does, tenths are movement enough
+    state['consensus_pct'] = state['consensus_pct'].astype(float).round(1)
+    return state
+
+
+def read_current(conn, season):
+    return pd.read_sql(text('SELECT * FROM odds_current WHERE "Season" = :season'), conn, params={'season': season})
+
+
+def compute_changes(engine, season, observed, observed_at):
+    '''
+    Diffs one run's tracked values against the season's current state. A value the run didn't find is
+    no observation, the movie keeps its last known value for it. A movie back after missing the latest
+    check counts as changed, so the tables that dropped it pick it up again.
+    '''
+    with engine.connect() as conn:
+        current = read_current(conn, season).set_index('Movie Name')
+
+    values = observed.melt(id_vars='Movie Name', value_vars=list(TRACKED_SERIES), var_name='series')
+    values = values.dropna(subset=['value'])
+    previous = current[list(TRACKED_SERIES)].reset_index().melt(id_vars='Movie Name', var_name='series', value_name='previous')
+    values = values.merge(previous, on=['Movie Name', 'series'], how='left')
+    events = values[values['previous'].isna() | (values['value'] != values['previous'])]
+    events = events[['Movie Name', 'series', 'value']].assign(Season=season, changed_at=observed_at)
+
+    # observed values replace the current ones, the rest carry over
+    state = observed.set_index('Movie Name')[list(TRACKED_SERIES)]
+    state = state.combine_first(current.loc[current.index.intersection(state.index), list(TRACKED_SERIES)])
+    moved = set(events['Movie Name'])
+    if len(current):
+        returning = current.index[current['checked_at'] != current['checked_at'].max()]
+        moved |= set(returning.intersection(state.index))
+    state['changed_at'] = [observed_at if movie in moved else current['changed_at'].get(movie) for movie in state.index]
+    state['checked_at'] = observed_at
+    return Changes(events, state.reset_index().assign(Season=season))
+
+
+def save_changes(engine, changes):
+    upsert_rows(engine, odds_changes, changes.events)
+    upsert_rows(engine, odds_current, changes.current)
+    return len(changes.events)
+
+
+def record_changes(engine, season, observed, observed_at):
+    '''
+    Diffs and saves one run's tracked values, returning how many values changed
+    '''
+    return save_changes(engine, compute_changes(engine, season, observed, observed_at))
+
+
+def history_changes(history, consensus=None):
+    '''
+    Turns a season's daily history into change events at each snapshot's date, along with the state it ends in
+    '''
+    state = tracked_values(history, consensus, keys=('Date', 'Movie Name'))
+    state['Date'] = pd.to_datetime(state['Date'])
+    values = state.melt(id_vars=['Date', 'Movie Name'], var_name='series').dropna(subset=['value'])
+    values = values.sort_values(['Movie Name', 'series', 'Date'])
+    previous = values.groupby(['Movie Name', 'series'])['value'].shift()
+    events = values[previous.isna() | (values['value'] != previous)].rename(columns={'Date': 'changed_at'})
+
+    last = values.groupby(['Movie Name', 'series'])['value'].last().unstack('series')
+    current = last.reindex(columns=list(TRACKED_SERIES))
+    current['changed_at'] = events.groupby('Movie Name')['changed_at'].max()
+    current['checked_at'] = state.groupby('Movie Name')['Date'].max()
+    return events, current.reset_index()
+
+
+def rebuild_changes(engine, season):
+    '''
+    Replaces a season's events and current state with those derived from its daily history.
+    Changes seen between daily snapshots are lost, so this is meant for seasons that weren't polled.
+    '''
+    with engine.connect() as conn:
+        history = pd.read_sql(text(f'SELECT * FROM "{partition_name(season)}"'), conn)
+        consensus = pd.read_sql(text(f'''
+            SELECT "Date", "Movie Name", consensus_pct FROM market_consensus
+            WHERE "Date" IN (SELECT DISTINCT "Date" FROM "{partition_name(season)}")
+        '''), conn)
+    events, current = history_changes(history, consensus)
+
+    with engine.begin() as conn:
+        begin_ddl(conn)
+        for table in (odds_changes, odds_current):
+            conn.execute(table.delete().where(table.c.Season == season))
+        load_table(odds_changes, events.assign(Season=season), conn)
+        load_table(odds_current, current.assign(Season=season), conn)
+    print(f"Rebuilt {len(events)} changes for season {season} from {len(history)} history rows.")
+    return len(events)
+
+
+def history_seasons(engine):
+    with engine.connect() as conn:
+        return conn.execute(text('SELECT season FROM seasons ORDER BY season')).scalars().all()
+
+
+def seed_changes(engine, seasons=None):
+    '''
+    Derives the events of seasons that have none yet from their daily history, leaving the others alone
+    '''
+    with engine.connect() as conn:
+        tracked = set(conn.execute(text('SELECT DISTINCT "Season" FROM odds_current')).scalars().all())
+    for season in seasons or history_seasons(engine):
+        if season not in tracked:
+            rebuild_changes(engine, season)
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from database import create_db_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--season', type=int, default=None, help='only rebuild this season')
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_db_engine()
+    for season in [args.season] if args.season else history_seasons(engine):
+        rebuild_changes(engine, season)
+    # the movie pages' series come from the changes
+    from bundles import rebuild_bundles
+    rebuild_bundles(engine)
@@ -1,23 +1,26 @@
 import os
 import pandas as pd
 from app import db, app
-from sqlalchemy import text
+from bundles import rebuild_bundles
+from changes import rebuild_changes
+from loader import swap_history, swap_table
+from schema import assign_seasons, create_tables, movie_stats, movie_news
 
 def initialize_database():
     with app.app_context():
-        db.session.execute(text('DROP TABLE IF EXISTS movie_stats'))
-        db.session.execute(text('DROP TABLE IF EXISTS goldderby'))
-        db.session.execute(text('DROP TABLE IF EXISTS movie_news'))
-        db.session.commit()
+        # any tables the app uses that aren't loaded below start out empty
+        create_tables(db.engine)
 
-        movie_stats = pd.read_csv('Database/movie_stats.csv')
-        goldderby = pd.read_csv('Database/goldderby.csv')
-        movie_news = pd.read_csv('Database/movie_news.csv')
-
-
-        movie_stats.to_sql('movie_stats', db.engine, index=False, if_exists='replace')
-        movie_news.to_sql('movie_news', db.engine, index=False, if_exists='replace')
-        goldderby.to_sql('goldderby', db.engine, index=False, if_exists='replace')
+        # each table is rebuilt beside the live one and swapped in, so the app keeps serving the old rows meanwhile
+        swap_table(db.engine, movie_stats, pd.read_csv('Database/movie_stats.csv'))
+        swap_table(db.engine, movie_news, pd.read_csv('Database/movie_news.csv'))
+        history = pd.read_csv('Database/goldderby.csv')
+        swap_history(db.engine, history)
+        # the tables and charts read the history as changes, derived here from the daily snapshots
+        for season in assign_seasons(history)['Season'].unique():
+            rebuild_changes(db.engine, int(season))
+        # and each movie page reads its prebuilt bundle
+        rebuild_bundles(db.engine)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+'''
+The one place database engines are configured, so the app, the updater and the scripts all connect the same way:
+
+- SQLite runs in WAL mode, so the pages keep reading while the updater writes, with a busy timeout
+  instead of failing straight away with "database is locked" when two writers meet
+- Postgres connections come from a bounded pool (DB_POOL_SIZE + DB_MAX_OVERFLOW per process) and are
+  pinged before use, so connections dropped by the server or a failover aren't handed to a request
+- DATABASE_REPLICA_URL, when set, is a read replica the app's pages read from, writes stay on DATABASE_URL
+'''
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine
+
+load_dotenv()
+
+# relative sqlite paths are taken from the odds-app folder, so the app and every script open the same file
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# connections each process keeps open to postgres, and how many more it may open under load
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+# seconds a request waits for a free connection before failing, rather than queueing forever
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# seconds after which a connection is replaced, below the usual server and load balancer idle timeouts
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# seconds a sqlite connection waits for another one's write lock
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '15'))
+# WAL unless told otherwise, benchmarks/bench_concurrency.py compares it with sqlite's default DELETE
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+
+
+def database_url(url=None, default='sqlite:///local.db'):
+    '''
+    The url to connect to (DATABASE_URL unless given), using psycopg 3 for postgres and an absolute path for sqlite
+    '''
+    url = url or os.getenv('DATABASE_URL') or default
+    if url.startswith('postgresql://'):
+        url = url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    elif url.startswith('sqlite'):
+        parsed = make_url(url)
+        path = parsed.database
+        if path and path != ':memory:' and not path.startswith('file:') and not os.path.isabs(path):
+            url = parsed.set(database=os.path.join(BASE_DIR, path)).render_as_string(hide_password=False)
+    return url
+
+
+def replica_url():
+    '''
+    The read replica's url, None when there's no replica
+    '''
+    url = os.getenv('DATABASE_REPLICA_URL')
+    return database_url(url) if url else None
+
+
+def engine_options(url):
+    '''
+    create_engine keyword arguments for the url, also used as Flask-SQLAlchemy's engine options
+    '''
+    if url.startswith('sqlite'):
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT}}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    '''
+    Sets the pragmas on every new sqlite connection, whichever engine opened it
+    '''
+    if type(dbapi_connection).__module__ != 'sqlite3':
+        return
+    cursor = dbapi_connection.cursor()
+    # readers see the last committed snapshot while a writer appends to the log, neither blocks the other
+    cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+    # in WAL mode syncing at checkpoints is enough to survive a crash, a power cut may lose the last commits
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
+def create_db_engine(url=None, **options):
+    '''
+    An engine for the url (DATABASE_URL unless given) with the settings above, options override them
+    '''
+    url = database_url(url)
+    return create_engine(url, **{**engine_options(url), **options})
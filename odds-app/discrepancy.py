@@ -0,0 +1,213 @@
+'''
+Keeps the odds table's gaps between the All Star users and the betting market up to date as snapshots land.
+Each refresh only reads and recomputes the movies whose odds changed since the last one (odds_current's
+changed_at), keeps the gaps ranked by size, fires an alert when a gap grows past DISCREPANCY_ALERT_POINTS
+and pushes the changed rows to subscribers, which is what the app's server-sent events stream listens to.
+'''
+import bisect
+import os
+import queue
+import threading
+from collections import deque, namedtuple
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from downsample import as_datetime
+
+load_dotenv()
+
+# a gap this many points wide or wider raises an alert when it opens
+ALERT_POINTS = float(os.getenv('DISCREPANCY_ALERT_POINTS', '15'))
+# how often (seconds) the engine checks for changes when nobody tells it a snapshot landed
+REFRESH_SECONDS = float(os.getenv('DISCREPANCY_REFRESH_SECONDS', '15'))
+# updates a subscriber can fall behind by before it's dropped, its browser reconnects and starts over
+SUBSCRIBER_BACKLOG = 100
+
+# compact record for a row of the comparison tables, values are ints or None when unavailable
+# consensus is the de-vigged average across every bookmaker, only shown on the odds table
+ComparisonRow = namedtuple('ComparisonRow', ['movie_name', 'experts', 'users', 'star24', 'betting', 'difference',
+                                             'consensus', 'consensus_difference'])
+
+
+def as_int(value):
+    if value is None:
+        return None
+    return int(value)
+
+
+def comparison_row(movie_name, experts, users, star24, betting, consensus):
+    experts, users, star24, betting = as_int(experts), as_int(users), as_int(star24), as_int(betting)
+    consensus = None if consensus is None else round(consensus)
+    # the difference is unavailable when either side of the comparison is missing
+    difference = None if betting is None or star24 is None else star24 - betting
+    consensus_difference = None if consensus is None or star24 is None else star24 - consensus
+    return ComparisonRow(movie_name, experts, users, star24, betting, difference, consensus, consensus_difference)
+
+
+# the odds table's columns for every movie of the season
+CURRENT_ROWS = '''
+    SELECT oc."Movie Name", oc.imp_prob_expert, oc.imp_prob_user, oc.imp_prob_star24, oc.betting_pct, oc.consensus_pct,
+           oc.changed_at
+    FROM odds_current oc
+    JOIN movie_stats ms ON ms."Movie Name" = oc."Movie Name"
+    WHERE oc."Season" = :season
+'''
+# and just those whose odds changed since :since
+CHANGED_ROWS = CURRENT_ROWS + ' AND oc.changed_at > :since'
+
+
+class DiscrepancyEngine:
+    '''
+    The odds table's rows of one season, kept current incrementally and ranked by the size of their gap
+    '''
+
+    def __init__(self, engine, season, alert_points=ALERT_POINTS, refresh_seconds=REFRESH_SECONDS):
+        self.engine = engine
+        self.season = season
+        self.alert_points = alert_points
+        self.refresh_seconds = refresh_seconds
+        self.alerts = deque(maxlen=50)
+        self._rows = {}
+        # (-abs(difference), movie name) of every row with a difference, largest gap first
+        self._ranked = []
+        # the latest changed_at and checked_at applied, as the database returned them so they compare exactly
+        self._changed_since = None
+        self._checked_at = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._subscribers = set()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''
+        Loads the rows and starts refreshing them in the background, once per process
+        '''
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='discrepancy-engine', daemon=True)
+        self.refresh()
+        self._thread.start()
+
+    def wake(self):
+        '''
+        Refreshes straight away, called when a snapshot is known to have landed
+        '''
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.refresh_seconds)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Warning: refreshing the discrepancies failed: {e}")
+
+    def refresh(self):
+        '''
+        Applies the changes since the last refresh, publishing and returning the rows that changed
+        '''
+        with self._refresh_lock:
+            params = {"season": self.season, "since": self._changed_since}
+            with self.engine.connect() as conn:
+                latest_check = conn.execute(text('SELECT MAX(checked_at) FROM odds_current WHERE "Season" = :season'),
+                                            params).scalar()
+                changed = conn.execute(text(CURRENT_ROWS if self._changed_since is None else CHANGED_ROWS), params).all()
+                # movies the latest run didn't see have left the table
+                gone = []
+                if latest_check is not None and latest_check != self._checked_at:
+                    gone = conn.execute(text('''
+                        SELECT "Movie Name" FROM odds_current WHERE "Season" = :season AND checked_at < :latest
+                    '''), {**params, "latest": latest_check}).scalars().all()
+
+            # the first refresh only loads the rows, the page being served already shows them
+            first_load = not self._loaded
+            updated, removed, alerts = [], [], []
+            with self._lock:
+                for movie_name, experts, users, star24, betting, consensus, changed_at in changed:
+                    row = comparison_row(movie_name, experts, users, star24, betting, consensus)
+                    previous = self._rows.get(movie_name)
+                    if row != previous:
+                        self._replace(previous, row)
+                        updated.append(row)
+                        if not first_load and self._opened(previous, row):
+                            alerts.append(self._alert(row))
+                    if self._changed_since is None or as_datetime(changed_at) > as_datetime(self._changed_since):
+                        self._changed_since = changed_at
+                for movie_name in gone:
+                    if movie_name in self._rows:
+                        self._replace(self._rows[movie_name], None)
+                        removed.append(movie_name)
+                self._checked_at = latest_check
+                self._loaded = True
+
+            if not first_load:
+                if updated:
+                    self._publish('rows', [row._asdict() for row in updated])
+                if removed:
+                    self._publish('removed', removed)
+                for alert in alerts:
+                    self._publish('alert', alert)
+            return updated
+
+    def _replace(self, previous, row):
+        if previous is not None:
+            if previous.difference is not None:
+                del self._ranked[bisect.bisect_left(self._ranked, (-abs(previous.difference), previous.movie_name))]
+            del self._rows[previous.movie_name]
+        if row is not None:
+            self._rows[row.movie_name] = row
+            if row.difference is not None:
+                bisect.insort(self._ranked, (-abs(row.difference), row.movie_name))
+
+    def _opened(self, previous, row):
+        '''
+        Whether the row's gap just reached the alert threshold
+        '''
+        if row.difference is None or abs(row.difference) < self.alert_points:
+            return False
+        return previous is None or previous.difference is None or abs(previous.difference) < self.alert_points
+
+    def _alert(self, row):
+        alert = {"movie_name": row.movie_name, "difference": row.difference, "star24": row.star24, "betting": row.betting,
+                 "at": datetime.now().isoformat(timespec='seconds')}
+        self.alerts.append(alert)
+        print(f"Alert: the All Star users and the betting odds on '{row.movie_name}' are {row.difference} points apart.")
+        return alert
+
+    def rows(self):
+        with self._lock:
+            return list(self._rows.values())
+
+    def ranked(self, limit=None):
+        '''
+        Rows with a difference, the largest gap first
+        '''
+        with self._lock:
+            return [self._rows[movie_name] for _, movie_name in self._ranked[:limit]]
+
+    def subscribe(self):
+        subscription = queue.Queue()
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.qsize() >= SUBSCRIBER_BACKLOG:
+                # a None tells the stream to close, better than letting a stalled client hold updates forever
+                self.unsubscribe(subscription)
+                subscription.put(None)
+            else:
+                subscription.put((event, data))
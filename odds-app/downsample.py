@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+
+def lttb(xs, ys, threshold):
+    '''
+    Largest-Triangle-Three-Buckets downsampling: returns the indices of at most threshold points that keep
+    the visual shape of the series, always including the first and last points
+    '''
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket, the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        # keeping the point of this bucket that forms the largest triangle with the last kept point
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a_next = j
+        selected.append(a_next)
+        a = a_next
+
+    selected.append(n - 1)
+    return selected
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def bucket_last(times, values, bucket):
+    '''
+    The value each day or week (starting Monday) ends on, returning (bucket dates, values)
+    '''
+    last = {}
+    for moment, value in zip(times, values):
+        last[bucket_start(moment.date(), bucket)] = value
+    keys = sorted(last)
+    return keys, [last[key] for key in keys]
+
+
+def step_series(times, values, start=None, end=None):
+    '''
+    Turns change events (when a value changed, and to what) into the points of the series between start
+    and end: the value holding at start, every change in between and the last value again at end
+    '''
+    points = []
+    held = None
+    for moment, value in zip(times, values):
+        if start and moment < start:
+            held = value
+        elif end and moment > end:
+            break
+        else:
+            points.append((moment, value))
+    if held is not None:
+        points.insert(0, (start, held))
+    if points and end and points[-1][0] < end:
+        points.append((end, points[-1][1]))
+    return [moment for moment, _ in points], [value for _, value in points]
+
+
+def as_datetime(value):
+    '''
+    Timestamps come back as datetime objects on postgres and strings on sqlite
+    '''
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
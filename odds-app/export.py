@@ -0,0 +1,223 @@
+'''
+Renders every page of the current season to static files after each update, so a web server can serve
+the site without Python on the hot path:
+
+- versions/<version>/ holds one export: <path>/index.html for each page and <path>.json for each movie's
+  history, every file next to its .gz and .br copies
+- current is a symlink to the newest complete version, swapped atomically, older versions are pruned
+
+nginx can serve it straight from disk, sending requests with a query string (other seasons, the charts'
+downsampled histories) and anything not exported to the app:
+    map $args $export_prefix { "" ""; default /-; }
+    location / {
+        root /path/to/odds-app/export/current;
+        gzip_static on;
+        brotli_static on;
+        try_files $export_prefix$uri/index.html $export_prefix$uri.json @app;
+    }
+
+The app serves the export itself while it's fresh: no odds changed since it was rendered and it's younger
+than EXPORT_MAX_AGE, as the news on the movie pages ages too. The updater exports after every run that
+wrote something and the scheduler re-exports every EXPORT_INTERVAL, so the export never ages out between runs.
+Pages are rendered from the database the caller passes, the updater's own engine.
+    python export.py
+'''
+import gzip
+import json
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from urllib.parse import unquote
+
+import brotli
+from dotenv import load_dotenv
+from flask import request, send_file
+
+from files import folder_setting
+
+load_dotenv()
+
+EXPORT_DIR = folder_setting('EXPORT_DIR', 'export')
+# seconds an export is served for at most, even when no odds changed since
+EXPORT_MAX_AGE = float(os.getenv('EXPORT_MAX_AGE', '3600'))
+# seconds between the scheduler's re-exports, twice per EXPORT_MAX_AGE so a fresh export replaces the old one in time
+EXPORT_INTERVAL = EXPORT_MAX_AGE / 2
+# complete exports kept besides the current one, so pages being sent from an older version finish
+EXPORT_KEEP = 2
+# held by the export in progress
+_export_lock = threading.Lock()
+
+# the pages of the site that don't depend on anything but the data
+PAGES = ('homepage', 'about', 'index', 'win_votes_table')
+
+
+def compress(path, data):
+    '''
+    Writes the gzip and brotli copies of a file next to it, compressed once here so nothing compresses per request
+    '''
+    with open(f'{path}.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    with open(f'{path}.br', 'wb') as f:
+        f.write(brotli.compress(data))
+
+
+def export_path(root, url_path, is_json):
+    relative = unquote(url_path).strip('/')
+    if is_json:
+        return os.path.join(root, f'{relative}.json')
+    return os.path.join(root, relative, 'index.html')
+
+
+def export_site(engine, root=None):
+    '''
+    Renders every page and movie history from engine's database into a new version and makes it the current one,
+    returning its folder. The render switches the app's config and clears its snapshot cache, so exports run one
+    at a time: while one is running (the scheduler's re-export overlapping an updater run's), others are skipped
+    and return None, the next export picks up whatever the running one missed.
+    '''
+    if not _export_lock.acquire(blocking=False):
+        print("Skipping the export, another one is still running.")
+        return None
+    try:
+        return render_export(engine, root)
+    finally:
+        _export_lock.release()
+
+
+def render_export(engine, root=None):
+    '''
+    export_site's work, to be run while holding _export_lock
+    '''
+    from app import app, latest_snapshot_date
+    from sqlalchemy import text
+    from flask import url_for
+    from snapshot_cache import snapshot_cache
+
+    root = root or EXPORT_DIR
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    versions = os.path.join(root, 'versions')
+    building = os.path.join(versions, f'{version}.tmp')
+    os.makedirs(building)
+
+    start = time.perf_counter()
+    # the pages read from engine while rendering, and nothing cached from another database is reused.
+    # rendering must neither serve the previous export nor set off a news refresh per movie
+    app.config.update(RENDER_ENGINE=engine, EXPORTING=True)
+    snapshot_cache.clear()
+    snapshot_cache.bump()
+    pages = []
+    try:
+        with app.app_context():
+            # the version the export reflects is read first, a change landing while rendering just makes it stale sooner
+            changed = latest_snapshot_date()
+            with engine.connect() as conn:
+                movies = conn.execute(text('SELECT "Movie Name" FROM movie_stats ORDER BY "Movie Name"')).scalars().all()
+            with app.test_request_context():
+                urls = [(url_for(page), False) for page in PAGES]
+                for movie_name in movies:
+                    urls.append((url_for('movie_page', movie_name=movie_name), False))
+                    urls.append((url_for('movie_history', movie_name=movie_name), True))
+
+        client = app.test_client()
+        for url, is_json in urls:
+            response = client.get(url)
+            if response.status_code != 200:
+                print(f"Warning: not exporting {url}, it returned {response.status_code}")
+                continue
+            path = export_path(building, url, is_json)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = response.get_data()
+            with open(path, 'wb') as f:
+                f.write(data)
+            compress(path, data)
+            pages.append(url)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    finally:
+        app.config.update(RENDER_ENGINE=None, EXPORTING=False)
+        snapshot_cache.clear()
+
+    with open(os.path.join(building, 'manifest.json'), 'w') as f:
+        json.dump({'version': version, 'created': time.time(), 'changed': str(changed), 'pages': pages}, f)
+
+    # the finished folder is renamed into place, then current is pointed at it in one rename
+    folder = os.path.join(versions, version)
+    os.rename(building, folder)
+    link = os.path.join(root, f'current.{version}')
+    os.symlink(os.path.relpath(folder, root), link)
+    os.replace(link, os.path.join(root, 'current'))
+    prune(versions, version)
+
+    print(f"Exported {len(pages)} pages to {folder} in {time.perf_counter() - start:.1f} s.")
+    return folder
+
+
+def prune(versions, current):
+    finished = sorted(name for name in os.listdir(versions) if not name.endswith('.tmp') and name != current)
+    for name in finished[:max(len(finished) - EXPORT_KEEP, 0)]:
+        shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+
+_manifests = {}
+
+
+def fresh_export(root, current_version):
+    '''
+    The current export's folder when it may be served: rendered from the latest odds, no older than EXPORT_MAX_AGE
+    '''
+    try:
+        folder = os.path.realpath(os.path.join(root, 'current'))
+        manifest = _manifests.get(folder)
+        if manifest is None:
+            with open(os.path.join(folder, 'manifest.json')) as f:
+                manifest = _manifests[folder] = json.load(f)
+    except OSError:
+        return None
+    if manifest['changed'] != str(current_version()) or time.time() - manifest['created'] > EXPORT_MAX_AGE:
+        return None
+    return folder
+
+
+def init_app(app, current_version, root=None):
+    '''
+    Serves exported pages straight from disk while the export is fresh, picking the brotli or gzip copy the
+    browser accepts. current_version returns when the odds last changed, as the export's manifest records it.
+    '''
+    root = root or EXPORT_DIR
+    app.config.setdefault('EXPORTING', False)
+
+    @app.before_request
+    def serve_exported():
+        # requests with a query string (other seasons, history parameters) are always rendered
+        if request.method not in ('GET', 'HEAD') or request.query_string or app.config['EXPORTING']:
+            return None
+        folder = fresh_export(root, current_version)
+        if folder is None:
+            return None
+        for is_json in (False, True):
+            path = os.path.realpath(export_path(folder, request.path, is_json))
+            if path.startswith(folder + os.sep) and os.path.isfile(path):
+                break
+        else:
+            return None
+
+        mimetype = mimetypes.guess_type(path)[0]
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in request.accept_encodings and os.path.isfile(path + suffix):
+                response = send_file(path + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_file(path, mimetype=mimetype)
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+if __name__ == "__main__":
+    from database import create_db_engine
+
+    export_site(create_db_engine())
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+from sqlalchemy import text
+
+from metrics import observe_external
+from schema import fetch_cache
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
+# status codes worth retrying, everything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# a single page to fetch: parse is called with the response as soon as it arrives
+FetchJob = namedtuple('FetchJob', ['method', 'url', 'timeout', 'parse', 'options'], defaults=[None])
+
+# what a previous fetch of a url left behind: its validators, the hash of the part we parse and the parsed rows
+FetchState = namedtuple('FetchState', ['url', 'etag', 'last_modified', 'content_hash', 'parsed'])
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class FetchCache:
+    '''
+    Remembers the ETag/Last-Modified validators and content hash of each scraped url in the fetch_cache table,
+    so unchanged pages can be skipped without being downloaded or parsed again
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        fetch_cache.create(engine, checkfirst=True)
+
+    def get(self, url):
+        query = text("SELECT url, etag, last_modified, content_hash, parsed FROM fetch_cache WHERE url = :url")
+        with self.engine.connect() as conn:
+            row = conn.execute(query, {"url": url}).fetchone()
+        if not row:
+            return None
+        return FetchState(row.url, row.etag, row.last_modified, row.content_hash, json.loads(row.parsed) if row.parsed else None)
+
+    def store(self, states):
+        query = text("""
+            INSERT INTO fetch_cache (url, etag, last_modified, content_hash, parsed, fetched_at)
+            VALUES (:url, :etag, :last_modified, :content_hash, :parsed, :fetched_at)
+            ON CONFLICT (url)
+            DO UPDATE SET etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified, content_hash = EXCLUDED.content_hash,
+                          parsed = EXCLUDED.parsed, fetched_at = EXCLUDED.fetched_at
+        """)
+        fetched_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        with self.engine.begin() as conn:
+            for state in states:
+                conn.execute(query, {**state._asdict(), "parsed": json.dumps(state.parsed), "fetched_at": fetched_at})
+
+
+def conditional_headers(state):
+    '''
+    Headers that let the server answer 304 Not Modified when the page hasn't changed since the stored fetch
+    '''
+    headers = {}
+    if state and state.etag:
+        headers['If-None-Match'] = state.etag
+    if state and state.last_modified:
+        headers['If-Modified-Since'] = state.last_modified
+    return headers
+
+
+def make_client(max_connections=10):
+    '''
+    Creates the http client whose connection pool is shared by every fetch in a run
+    '''
+    return httpx.Client(
+        headers=HEADERS,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+def fetch(client, method, url, timeout, retries=3, backoff=1.0, **options):
+    '''
+    Sends a request, retrying connection errors, timeouts and retryable statuses with exponential backoff
+    '''
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            response = client.request(method, url, timeout=timeout, **options)
+            observe_external(url, time.perf_counter() - start, ok=response.status_code < 400)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        except httpx.TransportError:
+            observe_external(url, time.perf_counter() - start, ok=False)
+            if attempt == retries:
+                raise
+        time.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+
+
+def fetch_all(jobs, client=None, retries=3, backoff=1.0):
+    '''
+    Fetches and parses every job concurrently, returning a dict of job name to parsed result.
+    A job that still fails after its retries, or whose page can't be parsed, maps to None so one bad source doesn't sink the run.
+    '''
+    own_client = client is None
+    if own_client:
+        client = make_client()
+
+    def run(name, job):
+        try:
+            response = fetch(client, job.method, job.url, job.timeout, retries=retries, backoff=backoff, **(job.options or {}))
+            # a 304 answers a conditional request and is left for the job's parser to handle
+            if response.status_code != 304:
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Warning: fetching {name} ({job.url}) failed: {e}")
+            return None
+        # parsing happens on the worker thread, overlapping with the other fetches still in flight
+        try:
+            return job.parse(response)
+        except Exception as e:
+            print(f"Warning: parsing {name} ({job.url}) failed: {e!r}")
+            return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as executor:
+            futures = {name: executor.submit(run, name, job) for name, job in jobs.items()}
+            return {name: future.result() for name, future in futures.items()}
+    finally:
+        if own_client:
+            client.close()
@@ -0,0 +1,30 @@
+'''
+File helpers shared by the scripts that keep files next to the database (posters, the raw archive)
+'''
+import os
+import tempfile
+
+# the odds-app folder, which relative paths in .env are taken from
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def folder_setting(name, default):
+    '''
+    The folder an environment variable names, default when it's unset or empty. A relative path is taken
+    from the odds-app folder like a relative sqlite DATABASE_URL, so it doesn't depend on where a script is run from.
+    '''
+    return os.path.join(BASE_DIR, os.getenv(name) or default)
+
+
+def write_atomically(path, write):
+    '''
+    Writes a file under a unique temporary name and moves it into place, so concurrent writers and readers never see half a file
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,17 +1,26 @@
 import pandas as pd
-from sqlalchemy import create_engine
-import os
 from dotenv import load_dotenv
+from bundles import rebuild_bundles
+from changes import rebuild_changes
+from database import create_db_engine
+from loader import swap_history, swap_table
+from schema import assign_seasons, create_tables, movie_stats
 
 load_dotenv()
 
-engine = create_engine(os.getenv('DATABASE_URL').replace('postgresql://', 'postgresql+psycopg://'))
+engine = create_db_engine()
 
 goldderby_df = pd.read_csv('goldderby_data.csv')
 
 movie_stats_df = pd.read_csv('movies_df.csv')
 
-goldderby_df.to_sql('goldderby', engine, if_exists='replace', index=False)
-movie_stats_df.to_sql('movie_stats', engine, if_exists='replace', index=False)
+create_tables(engine)
+swap_history(engine, goldderby_df)
+swap_table(engine, movie_stats, movie_stats_df)
+# the tables and charts read the history as changes, derived here from the daily snapshots
+for season in assign_seasons(goldderby_df)['Season'].unique():
+    rebuild_changes(engine, int(season))
+# and each movie page reads its prebuilt bundle
+rebuild_bundles(engine)
 
 print("Data loaded into DB successfully.")
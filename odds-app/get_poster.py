@@ -1,27 +1,138 @@
-import requests
-from sqlalchemy import create_engine
-import pandas as pd
+import hashlib
+import io
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import httpx
 from dotenv import load_dotenv
+from PIL import Image
+from sqlalchemy import text
+
+from bundles import rebuild_bundles
+from database import create_db_engine
+from files import write_atomically
+from metrics import observe_external
 
 load_dotenv()
 
 API_KEY = os.getenv("OMDB_API_KEY")
-engine = create_engine(os.getenv('DATABASE_URL').replace('postgresql://', 'postgresql+psycopg://'))
 
-def fetch_poster_by_id(imdb_id):
+# posters are stored under their content hash, so an unchanged poster is never written twice
+POSTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'posters')
+THUMBNAIL_WIDTH = 300
+# posters are checked again once they're this old, in case OMDb has a better one
+POSTER_TTL = timedelta(days=30)
+MAX_WORKERS = 8
+TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+
+
+def fetch_poster_by_id(client, imdb_id):
+    '''
+    Asks OMDb for a movie's poster url
+    '''
     if not imdb_id:
         return None
-    url = f"http://www.omdbapi.com/?i={imdb_id}&apikey={API_KEY}"
-    response = requests.get(url)
+    url = "http://www.omdbapi.com/"
+    start = time.perf_counter()
+    try:
+        response = client.get(url, params={"i": imdb_id, "apikey": API_KEY})
+    except httpx.HTTPError:
+        observe_external(url, time.perf_counter() - start, ok=False)
+        raise
+    observe_external(url, time.perf_counter() - start, ok=response.status_code == 200)
     data = response.json()
-    if response.status_code == 200 and 'Poster' in data:
+    if response.status_code == 200 and data.get('Poster', 'N/A') != 'N/A':
         return data['Poster']
     return None
 
-movie_stats_query = "SELECT * FROM movie_stats"
-movie_stats_df = pd.read_sql(movie_stats_query, engine)
 
-movie_stats_df['Poster'] = movie_stats_df['imdb_id'].apply(fetch_poster_by_id)
+def resize_to_thumbnail(image_bytes, f):
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert('RGB')
+        height = round(image.height * THUMBNAIL_WIDTH / image.width)
+        image.resize((THUMBNAIL_WIDTH, height), Image.LANCZOS).save(f, 'JPEG', quality=85, optimize=True)
+
+
+def store_poster(image_bytes):
+    '''
+    Saves a poster and its thumbnail under the image's content hash, returning both file names
+    '''
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    poster_file = f'{digest}.jpg'
+    thumbnail_file = f'{digest}-w{THUMBNAIL_WIDTH}.jpg'
+
+    poster_path = os.path.join(POSTER_DIR, poster_file)
+    if not os.path.exists(poster_path):
+        write_atomically(poster_path, lambda f: f.write(image_bytes))
+
+    thumbnail_path = os.path.join(POSTER_DIR, thumbnail_file)
+    if not os.path.exists(thumbnail_path):
+        write_atomically(thumbnail_path, lambda f: resize_to_thumbnail(image_bytes, f))
+
+    return poster_file, thumbnail_file
+
+
+def sync_poster(client, movie):
+    '''
+    Fetches one movie's poster, returning the values to update its row with or None if nothing could be fetched
+    '''
+    try:
+        poster_url = fetch_poster_by_id(client, movie.imdb_id) or movie.Poster
+        if not poster_url:
+            return None
+        response = client.get(poster_url)
+        response.raise_for_status()
+        poster_file, thumbnail_file = store_poster(response.content)
+    except (httpx.HTTPError, ValueError, OSError) as e:
+        print(f"Warning: couldn't fetch the poster for '{movie.movie_name}': {e}")
+        return None
+
+    return {
+        "movie_name": movie.movie_name,
+        "poster": poster_url,
+        "poster_file": poster_file,
+        "poster_thumb": thumbnail_file,
+        "poster_updated": datetime.now(),
+    }
+
+
+def movies_needing_posters(engine):
+    '''
+    Movies whose poster was never stored locally, or was stored longer than POSTER_TTL ago
+    '''
+    query = text("""
+        SELECT "Movie Name" AS movie_name, imdb_id, "Poster"
+        FROM movie_stats
+        WHERE poster_file IS NULL OR poster_updated IS NULL OR poster_updated < :cutoff
+    """)
+    with engine.connect() as conn:
+        return conn.execute(query, {"cutoff": datetime.now() - POSTER_TTL}).fetchall()
+
+
+def sync_posters(engine):
+    '''
+    Fetches the missing or stale posters concurrently and updates only those movies' rows
+    '''
+    os.makedirs(POSTER_DIR, exist_ok=True)
+    movies = movies_needing_posters(engine)
+
+    with httpx.Client(timeout=TIMEOUT, follow_redirects=True) as client:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            updates = [update for update in executor.map(lambda movie: sync_poster(client, movie), movies) if update]
+
+    if updates:
+        query = text("""
+            UPDATE movie_stats
+            SET "Poster" = :poster, poster_file = :poster_file, poster_thumb = :poster_thumb, poster_updated = :poster_updated
+            WHERE "Movie Name" = :movie_name
+        """)
+        with engine.begin() as conn:
+            conn.execute(query, updates)
+        rebuild_bundles(engine, [update['movie_name'] for update in updates])
+    print(f"Updated posters for {len(updates)} of {len(movies)} movies due.")
+
 
-movie_stats_df.to_sql('movie_stats', engine, if_exists='replace', index=False)
+if __name__ == "__main__":
+    sync_posters(create_db_engine())
@@ -0,0 +1,22 @@
+'''
+gunicorn hooks keeping the workers' shared metrics (see metrics.py) right, used with:
+    PROMETHEUS_MULTIPROC_DIR=/tmp/odds-metrics gunicorn -c gunicorn.conf.py --workers 4 --threads 8 app:app
+'''
+import os
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    # the metric files of a previous run would be counted again
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for name in os.listdir(MULTIPROC_DIR):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+
+
+def child_exit(server, worker):
+    # an exited worker's gauges stop counting, its counters and histograms are kept
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
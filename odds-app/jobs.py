@@ -0,0 +1,216 @@
+'''
+Redis plumbing shared by the scrape workers and the web app: the job queue, the run bookkeeping, the
+distributed snapshot lock and the invalidation channel. Every function takes the Redis client to use,
+so a local Redis and fakeredis work the same.
+'''
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+QUEUE_KEY = 'odds:jobs'
+# worker id -> when it last asked for a job, so the requeue knows whose processing lists to look at
+WORKERS_KEY = 'odds:workers'
+INVALIDATION_CHANNEL = 'odds:invalidate'
+
+# how long (seconds) a run's parsed pages are kept, runs that never complete simply expire
+RUN_TTL = 6 * 3600
+# how long (seconds) a lock is held at most, so a crashed writer can't block the snapshot forever
+LOCK_TTL = 600
+# how long (seconds) a worker may hold a job before it's presumed dead and the job goes back on the queue,
+# well above a scrape with all its retries
+JOB_TIMEOUT = 900
+
+
+def redis_client(url=None):
+    return redis.Redis.from_url(url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+
+
+def run_key(run_id):
+    return f'odds:run:{run_id}'
+
+
+def enqueue_run(r, season, snapshot_date, sources, dedupe=None):
+    '''
+    Starts a scrape run with one job per source, returning its id. With dedupe (such as the scheduled time)
+    the run is only started once however many schedulers ask for it, and None is returned to the others.
+    '''
+    if dedupe and not r.set(f'odds:scheduled:{dedupe}', 1, nx=True, ex=RUN_TTL):
+        return None
+
+    run_id = uuid.uuid4().hex
+    pipe = r.pipeline()
+    pipe.hset(run_key(run_id), mapping={'season': season, 'date': snapshot_date, 'sources': json.dumps(list(sources))})
+    pipe.expire(run_key(run_id), RUN_TTL)
+    for source in sources:
+        pipe.lpush(QUEUE_KEY, json.dumps({'run': run_id, 'season': season, 'date': snapshot_date, 'source': source}))
+    pipe.execute()
+    return run_id
+
+
+def processing_key(worker_id):
+    return f'odds:processing:{worker_id}'
+
+
+def next_job(r, worker_id, timeout=5):
+    '''
+    Waits up to timeout seconds for the next job, None when there's none. The job is moved onto the worker's
+    processing list rather than popped, and stays there until finish_job, so a worker dying mid-job doesn't
+    lose it: requeue_stale puts it back on the queue.
+    '''
+    r.hset(WORKERS_KEY, worker_id, int(time.time()))
+    item = r.blmove(QUEUE_KEY, processing_key(worker_id), timeout, 'RIGHT', 'LEFT')
+    if item is None:
+        return None
+    r.hset(f'{processing_key(worker_id)}:taken', item, int(time.time()))
+    return json.loads(item)
+
+
+def finish_job(r, worker_id, job):
+    '''
+    Drops a job from the worker's processing list once its result is saved
+    '''
+    # the job's JSON comes back from json.loads as enqueue_run wrote it, so it dumps to the same string
+    item = json.dumps(job)
+    pipe = r.pipeline()
+    pipe.lrem(processing_key(worker_id), 1, item)
+    pipe.hdel(f'{processing_key(worker_id)}:taken', item)
+    pipe.execute()
+
+
+def requeue_stale(r, older_than=JOB_TIMEOUT):
+    '''
+    Puts the jobs workers have held for more than older_than seconds back on the queue, returning how many.
+    A worker that was only slow saves its result too, the run keeps whichever result came first.
+    '''
+    now = time.time()
+    requeued = 0
+    for worker_id, last_seen in r.hgetall(WORKERS_KEY).items():
+        key = processing_key(worker_id.decode())
+        for item in r.lrange(key, 0, -1):
+            # a job whose taken time wasn't recorded (the worker died right after taking it) is timed from now
+            r.hsetnx(f'{key}:taken', item, int(now))
+            if now - float(r.hget(f'{key}:taken', item) or now) < older_than:
+                continue
+            with r.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    if item not in pipe.lrange(key, 0, -1):
+                        # finished in the meantime
+                        pipe.unwatch()
+                        continue
+                    pipe.multi()
+                    pipe.lrem(key, 1, item)
+                    pipe.hdel(f'{key}:taken', item)
+                    # onto the end jobs are taken from, it's waited long enough
+                    pipe.rpush(QUEUE_KEY, item)
+                    pipe.execute()
+                    requeued += 1
+                except redis.WatchError:
+                    # the worker finished a job meanwhile, this one is looked at again next time
+                    pass
+        # workers gone for longer than a run lives, with nothing left in hand, are forgotten
+        if now - float(last_seen) > RUN_TTL and not r.llen(key):
+            r.hdel(WORKERS_KEY, worker_id)
+    return requeued
+
+
+def save_result(r, run_id, source, result):
+    '''
+    Stores a source's result, returning True to exactly one caller: the one whose result completed the run
+    '''
+    results_key = f'{run_key(run_id)}:results'
+    pipe = r.pipeline()
+    pipe.hsetnx(results_key, source, json.dumps(result))
+    pipe.expire(results_key, RUN_TTL)
+    pipe.hlen(results_key)
+    pipe.hget(run_key(run_id), 'sources')
+    added, _, saved, sources = pipe.execute()
+    # a job delivered twice doesn't add a result, so it can't complete the run a second time
+    return bool(added) and sources is not None and saved == len(json.loads(sources))
+
+
+def run_results(r, run_id):
+    '''
+    The run's season, snapshot date and each source's result
+    '''
+    run = r.hgetall(run_key(run_id))
+    results = r.hgetall(f'{run_key(run_id)}:results')
+    return int(run[b'season']), run[b'date'].decode(), {
+        source.decode(): json.loads(result) for source, result in results.items()
+    }
+
+
+def mark_written(r, run_id):
+    '''
+    Records that the run's snapshot was written, returning False when it already had been
+    '''
+    return bool(r.hsetnx(run_key(run_id), 'written', int(time.time())))
+
+
+def is_written(r, run_id):
+    return r.hexists(run_key(run_id), 'written')
+
+
+@contextmanager
+def distributed_lock(r, name, ttl=LOCK_TTL, wait=30):
+    '''
+    Holds a lock across every worker, yielding whether it was acquired within wait seconds.
+    The lock expires after ttl seconds and is only ever released by its holder.
+    '''
+    key = f'odds:lock:{name}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not r.set(key, token, nx=True, px=int(ttl * 1000)):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(0.1)
+    try:
+        yield True
+    finally:
+        release_lock(r, key, token)
+
+
+def release_lock(r, key, token):
+    with r.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.get(key) == token.encode():
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+            else:
+                pipe.unwatch()
+        except redis.WatchError:
+            # the lock expired and was taken by another worker in the meantime, it's theirs now
+            pass
+
+
+def publish_invalidation(r, season, snapshot_date):
+    r.publish(INVALIDATION_CHANNEL, json.dumps({'season': season, 'date': snapshot_date}))
+
+
+def listen_for_invalidations(r, on_invalidate, retry=5.0):
+    '''
+    Calls on_invalidate(event) on a background thread whenever a snapshot is written, reconnecting after
+    connection errors. Events published while disconnected are lost, the snapshot cache's ttl covers those.
+    '''
+    def listen():
+        while True:
+            try:
+                pubsub = r.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    on_invalidate(json.loads(message['data']))
+            except redis.ConnectionError as e:
+                print(f"Warning: lost the invalidation channel, reconnecting: {e}")
+                time.sleep(retry)
+
+    thread = threading.Thread(target=listen, name='invalidation-listener', daemon=True)
+    thread.start()
+    return thread
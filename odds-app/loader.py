@@ -0,0 +1,171 @@
+from sqlalchemy import Column, MetaData, PrimaryKeyConstraint, Table, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from schema import add_season, assign_seasons, begin_ddl, clean_table, refresh_history_view, season_table
+
+BATCH_SIZE = 1000
+
+
+def table_rows(table, df):
+    '''
+    Cleans a DataFrame for a table and returns its rows as tuples in column order, with NULLs as None
+    '''
+    df = clean_table(table, df)
+    columns = list(df.columns)
+    df = df.astype(object).where(df.notna(), None)
+    return columns, list(df.itertuples(index=False, name=None))
+
+
+def copy_rows(conn, table_name, columns, rows):
+    '''
+    Streams rows into a postgres table with COPY
+    '''
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    with conn.connection.driver_connection.cursor() as cursor:
+        with cursor.copy(f'COPY "{table_name}" ({column_list}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def upsert_rows(engine, table, df, keep_existing=False):
+    '''
+    Inserts rows, replacing any that share the table's primary key, all in one transaction so re-running a load is harmless.
+    With keep_existing, a NULL in a new row leaves the stored value alone instead of replacing it.
+    Postgres COPYs the rows into a temporary staging table and merges it with one INSERT ... ON CONFLICT,
+    SQLite runs the INSERT ... ON CONFLICT in batches.
+    '''
+    columns, rows = table_rows(table, df)
+    return upsert_records(engine, table, columns, rows, keep_existing)
+
+
+def upsert_records(engine, table, columns, rows, keep_existing=False):
+    '''
+    upsert_rows for rows already given as tuples in the order of columns, so callers on the web tier don't need pandas
+    '''
+    if not rows:
+        return 0
+
+    key = [column.name for column in table.primary_key.columns]
+    updates = [column for column in columns if column not in key]
+
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            staging_name = f'{table.name}_upsert'
+            conn.execute(text(f'CREATE TEMPORARY TABLE "{staging_name}" (LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DROP'))
+            copy_rows(conn, staging_name, columns, rows)
+
+            column_list = ', '.join(f'"{column}"' for column in columns)
+            key_list = ', '.join(f'"{column}"' for column in key)
+            if keep_existing:
+                set_list = ', '.join(f'"{column}" = COALESCE(EXCLUDED."{column}", "{table.name}"."{column}")' for column in updates)
+            else:
+                set_list = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in updates)
+            conn.execute(text(f'''
+                INSERT INTO "{table.name}" ({column_list})
+                SELECT {column_list} FROM "{staging_name}"
+                ON CONFLICT ({key_list}) DO {f"UPDATE SET {set_list}" if updates else "NOTHING"}
+            '''))
+        else:
+            statement = sqlite_insert(table)
+            if updates:
+                if keep_existing:
+                    set_ = {column: func.coalesce(statement.excluded[column], table.c[column]) for column in updates}
+                else:
+                    set_ = {column: statement.excluded[column] for column in updates}
+                statement = statement.on_conflict_do_update(index_elements=key, set_=set_)
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=key)
+            for start in range(0, len(rows), BATCH_SIZE):
+                batch = rows[start:start + BATCH_SIZE]
+                conn.execute(statement, [dict(zip(columns, row)) for row in batch])
+    return len(rows)
+
+
+def staging_table(table, name):
+    '''
+    Copy of a table's columns and primary key under another name, left without indexes so it loads quickly
+    '''
+    columns = [Column(column.name, column.type, nullable=column.nullable) for column in table.columns]
+    key = [column.name for column in table.primary_key.columns]
+    return Table(name, MetaData(), *columns, PrimaryKeyConstraint(*key))
+
+
+def load_staging(engine, table, df):
+    '''
+    Loads rows into a fresh copy of a table named <table>_staging, returning it along with the row count
+    '''
+    staging = staging_table(table, f'{table.name}_staging')
+    staging.drop(engine, checkfirst=True)
+    staging.create(engine)
+
+    columns, rows = table_rows(table, df)
+    with engine.begin() as conn:
+        if rows and engine.dialect.name == 'postgresql':
+            copy_rows(conn, staging.name, columns, rows)
+        elif rows:
+            for start in range(0, len(rows), BATCH_SIZE):
+                conn.execute(staging.insert(), [dict(zip(columns, row)) for row in rows[start:start + BATCH_SIZE]])
+    return staging, len(rows)
+
+
+def swap_table(engine, table, df):
+    '''
+    Replaces a table's contents without readers ever seeing it empty: the new rows are loaded into a staging
+    table first, then the old table is dropped and the staging table renamed into place in one transaction
+    '''
+    staging, count = load_staging(engine, table, df)
+
+    with engine.begin() as conn:
+        begin_ddl(conn)
+        table.drop(conn, checkfirst=True)
+        conn.execute(text(f'ALTER TABLE "{staging.name}" RENAME TO "{table.name}"'))
+        if engine.dialect.name == 'postgresql' and table.primary_key.name:
+            conn.execute(text(f'ALTER TABLE "{table.name}" RENAME CONSTRAINT "{staging.name}_pkey" TO "{table.primary_key.name}"'))
+        for index in table.indexes:
+            index.create(conn)
+    return count
+
+
+def upsert_history(engine, df):
+    '''
+    upsert_rows for goldderby rows: each season's rows go straight into that season's partition,
+    which is created first if the season is new. A re-run of a day that failed to fetch a source keeps
+    the values the day's earlier run found for it.
+    '''
+    count = 0
+    for season, season_rows in assign_seasons(df).groupby('Season'):
+        with engine.begin() as conn:
+            begin_ddl(conn)
+            add_season(conn, season)
+        count += upsert_rows(engine, season_table(season), season_rows, keep_existing=True)
+    return count
+
+
+def swap_history(engine, df):
+    '''
+    swap_table for goldderby rows: every season in df replaces that season's partition, other seasons are left alone
+    '''
+    count = 0
+    for season, season_rows in assign_seasons(df).groupby('Season'):
+        table = season_table(season)
+        staging, loaded = load_staging(engine, table, season_rows)
+
+        with engine.begin() as conn:
+            begin_ddl(conn)
+            add_season(conn, season)
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text(f'DROP TABLE "{table.name}"'))
+                conn.execute(text(f'ALTER TABLE "{staging.name}" RENAME TO "{table.name}"'))
+                conn.execute(text(f'ALTER TABLE "{table.name}" RENAME CONSTRAINT "{staging.name}_pkey" TO "{table.name}_pkey"'))
+                # attaching builds the partition's copy of goldderby's indexes
+                conn.execute(text(f'ALTER TABLE goldderby ATTACH PARTITION "{table.name}" FOR VALUES IN ({int(season)})'))
+            else:
+                # sqlite checks the views that use a table when renaming it, so the view is rebuilt afterwards
+                conn.execute(text('DROP VIEW IF EXISTS goldderby'))
+                table.drop(conn)
+                conn.execute(text(f'ALTER TABLE "{staging.name}" RENAME TO "{table.name}"'))
+                for index in table.indexes:
+                    index.create(conn)
+                refresh_history_view(conn)
+        count += loaded
+    return count
@@ -0,0 +1,115 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from odds import to_decimal
+
+
+class OddsMatrix:
+    '''
+    Every bookmaker's price for every runner in one Oddschecker snapshot: a runners x bookmakers array of
+    decimal odds (float32), NaN where a bookmaker doesn't price a runner
+    '''
+
+    def __init__(self, runners, bookmakers, decimal):
+        self.runners = list(runners)
+        self.bookmakers = list(bookmakers)
+        self.decimal = decimal
+
+    @classmethod
+    def from_rows(cls, odds_rows):
+        '''
+        Builds the matrix from parsers.parse_oddschecker_odds output, parsing all prices in one vectorized pass
+        '''
+        runners = list(odds_rows)
+        bookmakers = sorted({bookmaker for row in odds_rows.values() for bookmaker in row.prices})
+        columns = {bookmaker: j for j, bookmaker in enumerate(bookmakers)}
+
+        row_index, column_index, prices = [], [], []
+        for i, row in enumerate(odds_rows.values()):
+            for bookmaker, price in row.prices.items():
+                row_index.append(i)
+                column_index.append(columns[bookmaker])
+                prices.append(price)
+
+        decimal = np.full((len(runners), len(bookmakers)), np.nan, dtype=np.float32)
+        if prices:
+            decimal[row_index, column_index] = to_decimal(prices)
+        return cls(runners, bookmakers, decimal)
+
+    def book_totals(self):
+        '''
+        Sum of each bookmaker's implied probabilities across the runners it prices, 1 plus its margin for a full book
+        '''
+        return np.nansum(1 / self.decimal, axis=0)
+
+    def full_books(self):
+        '''
+        Which bookmakers price every runner that anyone prices. Only their totals hold the whole market,
+        a book quoting part of the field leaves out the probability of the rest.
+        '''
+        priced = ~np.isnan(self.decimal)
+        return priced[priced.any(axis=1)].all(axis=0) & priced.any(axis=0)
+
+    def overround(self):
+        '''
+        The market's typical margin in percent: the median full book's total above 100, None without a full book
+        '''
+        totals = self.book_totals()[self.full_books()]
+        return float(np.median(totals) * 100 - 100) if totals.size else None
+
+    def consensus(self):
+        '''
+        Returns per-runner consensus probability (mean of every bookmaker's margin-free probability), its dispersion
+        (standard deviation across bookmakers), both in percent, and how many bookmakers price each runner.
+        Full books are de-vigged by their own total, books quoting part of the field by the full books' median
+        total (their own when there's no full book), and the consensus is scaled to sum to 100.
+        '''
+        implied = 1 / self.decimal
+        totals = self.book_totals()
+        full = self.full_books()
+        if full.any():
+            totals = np.where(full, totals, np.median(totals[full]))
+        fair = implied / np.where(totals > 0, totals, np.nan)
+        with warnings.catch_warnings():
+            # runners nobody prices are all-NaN rows, and come out as NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            consensus = np.nanmean(fair, axis=1) * 100
+            dispersion = np.nanstd(fair, axis=1) * 100
+        # the books' margins differ, so the mean of their fair probabilities needn't sum to 100 on its own
+        total = np.nansum(consensus)
+        if total > 0:
+            consensus, dispersion = consensus * 100 / total, dispersion * 100 / total
+        return consensus, dispersion, np.count_nonzero(~np.isnan(self.decimal), axis=1)
+
+    def to_long(self, date, names):
+        '''
+        Long-format rows (Date, Movie Name, bookmaker, decimal_odds) for the priced cells of the runners in names,
+        a dict of runner -> movie name
+        '''
+        rows, columns = np.nonzero(~np.isnan(self.decimal))
+        keep = np.array([self.runners[i] in names for i in rows], dtype=bool)
+        rows, columns = rows[keep], columns[keep]
+        return pd.DataFrame({
+            'Date': date,
+            'Movie Name': [names[self.runners[i]] for i in rows],
+            'bookmaker': [self.bookmakers[j] for j in columns],
+            'decimal_odds': self.decimal[rows, columns],
+        })
+
+    def consensus_frame(self, date, names):
+        '''
+        One row per runner in names with its consensus, dispersion, bookmaker count and the snapshot's overround.
+        The consensus is computed over the whole market before filtering, so the margins stay right.
+        '''
+        consensus, dispersion, bookmakers = self.consensus()
+        keep = [i for i, runner in enumerate(self.runners) if runner in names]
+        return pd.DataFrame({
+            'Date': date,
+            'Movie Name': [names[self.runners[i]] for i in keep],
+            'consensus_pct': consensus[keep],
+            'dispersion': dispersion[keep],
+            'bookmakers': bookmakers[keep],
+            'overround': self.overround(),
+        })
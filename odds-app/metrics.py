@@ -0,0 +1,228 @@
+'''
+Prometheus metrics for the app and the updater: request latency per route, SQL time per statement verb and table,
+external API calls, cache lookups and updater runs. The app serves them at /metrics, the scheduler
+process on its own port when UPDATER_METRICS_PORT is set.
+
+Cache hit ratios come from odds_cache_lookups_total, everything but a miss was served from a cache:
+    sum by (cache) (rate(odds_cache_lookups_total{result!="miss"}[5m])) / sum by (cache) (rate(odds_cache_lookups_total[5m]))
+
+Setting SLOW_REQUEST_MS logs every request slower than that with a breakdown of where its time went.
+
+Under gunicorn each worker process has its own metrics. Pointing PROMETHEUS_MULTIPROC_DIR at a folder makes the
+workers share them through files there, so /metrics answers for all of them whichever worker serves it.
+gunicorn.conf.py empties the folder on start and drops an exited worker's gauges.
+'''
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               multiprocess, start_http_server)
+from sqlalchemy import event
+
+load_dotenv()
+
+REQUEST_SECONDS = Histogram('odds_request_seconds', 'Time spent handling a request', ['endpoint', 'method', 'status'])
+SQL_SECONDS = Histogram(
+    'odds_sql_seconds', 'Time spent executing a SQL statement, by its verb and table', ['statement'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0),
+)
+STEP_SECONDS = Histogram('odds_step_seconds', 'Time spent in a named step of a request', ['step'])
+EXTERNAL_REQUESTS = Counter('odds_external_requests_total', 'Calls to external APIs', ['service', 'outcome'])
+EXTERNAL_SECONDS = Histogram(
+    'odds_external_request_seconds', 'Latency of calls to external APIs', ['service'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+CACHE_LOOKUPS = Counter('odds_cache_lookups_total', 'Cache lookups by outcome', ['cache', 'result'])
+UPDATER_SECONDS = Histogram(
+    'odds_updater_run_seconds', 'Duration of update runs', ['outcome'],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+UPDATER_LAST_SUCCESS = Gauge('odds_updater_last_success_timestamp_seconds', 'When the last update run finished without error',
+                             multiprocess_mode='max')
+
+# external API hosts and the service they're counted under, other hosts are counted under their own name
+EXTERNAL_SERVICES = {
+    'newsapi.org': 'newsapi',
+    'www.omdbapi.com': 'omdb',
+    'api.zyte.com': 'zyte',
+    'www.goldderby.com': 'goldderby',
+}
+
+# requests slower than this many milliseconds are logged with their breakdown, 0 turns the log off
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '0'))
+# longest statement text the slow request log shows
+STATEMENT_LABEL_LENGTH = 200
+# the table a statement reads or writes first, which together with its verb names it in the metrics
+STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|INDEX)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?"?([\w.]+)', re.IGNORECASE)
+
+# (kind, name, seconds) of everything timed during the current request, None outside requests
+_breakdown = ContextVar('request_breakdown', default=None)
+
+
+def record(kind, name, seconds):
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.append((kind, name, seconds))
+
+
+def statement_label(statement):
+    label = ' '.join(statement.split())
+    if len(label) > STATEMENT_LABEL_LENGTH:
+        label = label[:STATEMENT_LABEL_LENGTH - 3] + '...'
+    return label
+
+
+def statement_name(statement):
+    '''
+    A statement's verb and first table, e.g. "SELECT odds_current", so there are about as many labels as tables
+    '''
+    words = statement.split(None, 1)
+    verb = words[0].upper() if words else 'EMPTY'
+    match = STATEMENT_TABLE.search(statement)
+    return f'{verb} {match.group(1)}' if match else verb
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    SQL_SECONDS.labels(statement_name(statement)).observe(elapsed)
+    record('sql', statement_label(statement), elapsed)
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    '''
+    Times every statement the engine runs, labelled by its verb and table
+    '''
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+@contextmanager
+def timed(step):
+    '''
+    Times a named step, such as rendering a table or reading the news
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STEP_SECONDS.labels(step).observe(elapsed)
+        record('step', step, elapsed)
+
+
+def observe_external(url, seconds, ok):
+    '''
+    Counts one call to an external API, ok being False for errors and failed statuses
+    '''
+    host = urlsplit(url).hostname or 'unknown'
+    service = EXTERNAL_SERVICES.get(host, host)
+    EXTERNAL_REQUESTS.labels(service, 'ok' if ok else 'error').inc()
+    EXTERNAL_SECONDS.labels(service).observe(seconds)
+    record('external', service, seconds)
+
+
+def cache_lookup(cache, result):
+    '''
+    Counts a cache lookup, result being 'hit', 'miss' or a cache's own outcome such as 'stale'
+    '''
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+@contextmanager
+def updater_run():
+    '''
+    Times an update run and remembers when one last succeeded
+    '''
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+        UPDATER_LAST_SUCCESS.set_to_current_time()
+    finally:
+        UPDATER_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+
+
+def slow_request_report(elapsed, breakdown):
+    '''
+    One line saying where a slow request's time went: totals per kind, then the slowest few items
+    '''
+    totals = {}
+    for kind, _, seconds in breakdown:
+        count, total = totals.get(kind, (0, 0.0))
+        totals[kind] = (count + 1, total + seconds)
+    summary = ', '.join(f'{kind} {count}x {total * 1000:.1f} ms' for kind, (count, total) in sorted(totals.items()))
+    slowest = '; '.join(f'{seconds * 1000:.1f} ms {kind} {name}'
+                        for kind, name, seconds in sorted(breakdown, key=lambda item: item[2], reverse=True)[:3])
+    return (f"Slow request: {request.method} {request.full_path.rstrip('?')} took {elapsed * 1000:.1f} ms"
+            f" ({summary or 'nothing timed'}). Slowest: {slowest or 'n/a'}")
+
+
+def collected_registry():
+    '''
+    The metrics of every process sharing PROMETHEUS_MULTIPROC_DIR, or just this process's without it
+    '''
+    if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view():
+    return Response(generate_latest(collected_registry()), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+def init_app(app):
+    '''
+    Times every request of a Flask app, serves /metrics and logs slow requests
+    '''
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_breakdown = _breakdown.set([])
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.labels(request.endpoint or 'unmatched', request.method, str(response.status_code)).observe(elapsed)
+
+        breakdown = _breakdown.get()
+        _breakdown.reset(g.pop('metrics_breakdown'))
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            print(slow_request_report(elapsed, breakdown))
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def serve_metrics():
+    '''
+    Serves this process's metrics over http on UPDATER_METRICS_PORT, for processes without a Flask app
+    '''
+    port = os.getenv('UPDATER_METRICS_PORT')
+    if port:
+        start_http_server(int(port))
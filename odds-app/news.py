@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from bundles import rebuild_bundles
+from database import create_db_engine
+from metrics import cache_lookup, observe_external
+
+# cached articles are served as they are, and refreshed in the background once they're older than this
+NEWS_TTL = timedelta(days=1)
+NEWS_API_TIMEOUT = 10
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='news-refresh')
+# movie name -> future of the refresh in flight, so concurrent views of a movie share one api call
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+class NewsAPIError(Exception):
+    pass
+
+
+class QuotaExceeded(NewsAPIError):
+    pass
+
+
+class CircuitBreaker:
+    '''
+    Stops calling NewsAPI for a while after repeated failures, or straight away once the quota runs out
+    '''
+
+    def __init__(self, failure_threshold=3, cooldown=300, quota_cooldown=3600):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.quota_cooldown = quota_cooldown
+        self._failures = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return time.monotonic() >= self._open_until
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self, quota=False):
+        with self._lock:
+            self._failures += 1
+            if quota:
+                self._open_until = time.monotonic() + self.quota_cooldown
+            elif self._failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._failures = 0
+
+
+breaker = CircuitBreaker()
+
+
+def fetch_articles(movie_name):
+    '''
+    Gets the latest articles mentioning the movie from NewsAPI
+    '''
+    # imported here so web workers only pay for requests when a news refresh is needed
+    import requests
+
+    url = "https://newsapi.org/v2/everything"
+    params = {
+        "q": f'{movie_name} movie',
+        "apiKey": os.getenv("NEWS_API_KEY"),
+        "language": "en",
+        "sortBy": "publishedAt",
+        "pageSize": 20,
+    }
+
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, params=params, timeout=NEWS_API_TIMEOUT)
+    except requests.RequestException as e:
+        observe_external(url, time.perf_counter() - start, ok=False)
+        raise NewsAPIError(f"request for '{movie_name}' failed: {e}") from e
+    observe_external(url, time.perf_counter() - start, ok=response.status_code == 200)
+
+    if response.status_code == 429:
+        raise QuotaExceeded(f"rate limited while fetching '{movie_name}'")
+    if response.status_code != 200:
+        raise NewsAPIError(f"status {response.status_code} while fetching '{movie_name}'")
+
+    raw_articles = response.json().get("articles", [])
+    relevant_articles = [
+        {
+            "title": article["title"],
+            "url": article["url"],
+            "description": article.get("description", "No description available."),
+            "publishedAt": datetime.strptime(article["publishedAt"], "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
+        }
+        for article in raw_articles
+        if movie_name.lower() in article["title"].lower()
+    ]
+
+    return relevant_articles[:3]
+
+
+def parse_last_updated(last_updated):
+    if last_updated is None or isinstance(last_updated, datetime):
+        return last_updated
+    return datetime.fromisoformat(last_updated)
+
+
+def read_cached_news(engine, movie_name):
+    '''
+    Returns the stored articles for a movie and when they were fetched, (None, None) if there are none yet
+    '''
+    query = text("SELECT articles, last_updated FROM movie_news WHERE movie_name = :movie_name")
+    with engine.connect() as conn:
+        result = conn.execute(query, {"movie_name": movie_name}).fetchone()
+
+    if not result:
+        return None, None
+    articles, last_updated = result
+    return json.loads(articles), parse_last_updated(last_updated)
+
+
+def save_articles(engine, movie_name, articles):
+    query_add = """
+        INSERT INTO movie_news (movie_name, articles, last_updated)
+        VALUES (:movie_name, :articles, :last_updated)
+        ON CONFLICT (movie_name)
+        DO UPDATE SET articles = EXCLUDED.articles, last_updated = EXCLUDED.last_updated
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(query_add),
+            {
+                "movie_name": movie_name,
+                "articles": json.dumps(articles),
+                "last_updated": datetime.now()
+            }
+        )
+    # the movie's page shows the articles from its bundle
+    rebuild_bundles(engine, [movie_name])
+
+
+def refresh_news(engine, movie_name):
+    '''
+    Fetches and stores fresh articles for a movie, returning None when NewsAPI is unavailable
+    '''
+    if not breaker.allow():
+        return None
+
+    try:
+        articles = fetch_articles(movie_name)
+    except QuotaExceeded as e:
+        print(f"Warning: NewsAPI quota exceeded, pausing news refreshes: {e}")
+        breaker.record_failure(quota=True)
+        return None
+    except NewsAPIError as e:
+        print(f"Warning: NewsAPI {e}")
+        breaker.record_failure()
+        return None
+
+    breaker.record_success()
+    try:
+        save_articles(engine, movie_name, articles)
+    except SQLAlchemyError as e:
+        print(f"Warning: couldn't save news for '{movie_name}': {e}")
+    return articles
+
+
+def request_refresh(engine, movie_name):
+    '''
+    Schedules a background refresh for a movie, or returns the one already in flight
+    '''
+    with _in_flight_lock:
+        future = _in_flight.get(movie_name)
+        if future is not None:
+            return future
+        future = _executor.submit(refresh_news, engine, movie_name)
+        _in_flight[movie_name] = future
+
+    def done(_):
+        with _in_flight_lock:
+            _in_flight.pop(movie_name, None)
+
+    future.add_done_callback(done)
+    return future
+
+
+def refresh_if_stale(engine, movie_name, last_updated, refresh=True):
+    '''
+    Refreshes a movie's articles in the background when they're missing or stale (unless refresh is False)
+    '''
+    last_updated = parse_last_updated(last_updated)
+    if last_updated is None or datetime.now() - last_updated >= NEWS_TTL:
+        cache_lookup('news', 'miss' if last_updated is None else 'stale')
+        if refresh:
+            request_refresh(engine, movie_name)
+    else:
+        cache_lookup('news', 'hit')
+
+
+def get_news_for_movie(engine, movie_name, refresh=True):
+    '''
+    Returns the cached articles for a movie straight away, refreshing them in the background once they're stale
+    '''
+    articles, last_updated = read_cached_news(engine, movie_name)
+    refresh_if_stale(engine, movie_name, last_updated, refresh)
+    return articles or []
+
+
+def prefetch_news(engine, lead=timedelta(hours=2)):
+    '''
+    Refreshes the news for every nominee in movie_stats whose articles are missing or expire within lead
+    '''
+    query = text("""
+        SELECT ms."Movie Name", mn.last_updated
+        FROM movie_stats ms
+        LEFT JOIN movie_news mn ON mn.movie_name = ms."Movie Name"
+    """)
+    with engine.connect() as conn:
+        movies = conn.execute(query).fetchall()
+
+    cutoff = datetime.now() - NEWS_TTL + lead
+    futures = [
+        request_refresh(engine, movie_name)
+        for movie_name, last_updated in movies
+        if last_updated is None or parse_last_updated(last_updated) <= cutoff
+    ]
+    wait(futures)
+    print(f"Refreshed news for {sum(1 for future in futures if future.result() is not None)} of {len(futures)} movies due.")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    prefetch_news(create_db_engine())
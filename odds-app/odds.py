@@ -0,0 +1,142 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# bookmaker spellings of 1/1
+EVENS = {'evs', 'evens', 'even'}
+
+
+@lru_cache(maxsize=None)
+def decimal_odds(odds):
+    '''
+    Parses one odds string into decimal odds: fractional ("15/2"), decimal ("8.5") or American ("+650", "-200").
+    Returns NaN for anything else ('N/A', blanks). Cached, since only a few hundred distinct strings ever appear.
+    '''
+    odds = odds.strip().rstrip('-').lower()
+    if not odds:
+        return np.nan
+    if odds in EVENS:
+        return 2.0
+    try:
+        if '/' in odds:
+            numerator, denominator = odds.split('/')
+            numerator, denominator = float(numerator), float(denominator)
+            return 1 + numerator / denominator if numerator >= 0 and denominator > 0 else np.nan
+        if odds[0] in '+-':
+            american = float(odds)
+            if american >= 100:
+                return 1 + american / 100
+            if american <= -100:
+                return 1 + 100 / -american
+            return np.nan
+        decimal = float(odds)
+        return decimal if decimal > 1 else np.nan
+    except ValueError:
+        return np.nan
+
+
+def to_decimal(odds):
+    '''
+    Converts a Series (or array/list) of odds strings to decimal odds as a float array.
+    Each distinct string is parsed once and the results are broadcast back with its codes.
+    '''
+    codes, uniques = pd.factorize(pd.Series(odds, dtype=object), use_na_sentinel=True)
+    lookup = np.array([decimal_odds(value) if isinstance(value, str) else np.nan for value in uniques] + [np.nan])
+    # missing values get code -1, which indexes the trailing NaN
+    return lookup[codes]
+
+
+def implied_probability(odds):
+    '''
+    Implied win probability in whole percent for each odds string, as a nullable integer Series
+    '''
+    index = odds.index if isinstance(odds, pd.Series) else None
+    return whole_percent(100 / to_decimal(odds), index)
+
+
+def whole_percent(probability, index=None):
+    '''
+    Percentages rounded to whole numbers as a nullable integer Series, NaN becoming NA
+    '''
+    probability = np.round(probability)
+    # building the nullable integers from values and a mask directly, astype('Int64') would check every float
+    missing = np.isnan(probability)
+    values = np.where(missing, 0, probability).astype('int64')
+    return pd.Series(pd.arrays.IntegerArray(values, missing), index=index)
+
+
+def devig(probability, snapshot):
+    '''
+    Removes the overround: scales the implied probabilities within each snapshot so they sum to 100.
+    snapshot holds the key (or a list of keys) telling each row's snapshot apart.
+    '''
+    probability = pd.Series(probability, dtype=float)
+    keys = [pd.Series(key, index=probability.index) for key in (snapshot if isinstance(snapshot, list) else [snapshot])]
+    total = probability.groupby(keys).transform('sum')
+    return probability / total.where(total > 0) * 100
+
+
+def odds_to_prob(odds):
+    '''
+    Converts one odds string to a percentage, None when it can't be parsed
+    '''
+    if not isinstance(odds, str):
+        return None
+    decimal = decimal_odds(odds)
+    if np.isnan(decimal):
+        return None
+    return int(round(100 / decimal))
+
+
+# goldderby odds columns and the implied probability column computed from each
+PROBABILITY_COLUMNS = {
+    'Experts Odds': 'imp_prob_expert',
+    'Star24 Odds': 'imp_prob_star24',
+    'Users Odds': 'imp_prob_user',
+    'betting_odds': 'betting_pct',
+}
+
+# and the de-vigged probability column next to each, normalised to sum to 100 within a snapshot
+NORMALISED_COLUMNS = {
+    'Experts Odds': 'norm_prob_expert',
+    'Star24 Odds': 'norm_prob_star24',
+    'Users Odds': 'norm_prob_user',
+    'betting_odds': 'norm_betting_pct',
+}
+
+
+def add_implied_probabilities(df):
+    '''
+    Fills in every implied probability column of a goldderby DataFrame from its odds columns, the raw
+    percentages and their de-vigged counterparts normalised per snapshot (the rows sharing a Date and Season)
+    '''
+    snapshot = [df[column].to_numpy() for column in ('Season', 'Date') if column in df.columns]
+    for odds_column, probability_column in PROBABILITY_COLUMNS.items():
+        if odds_column in df.columns:
+            probability = 100 / to_decimal(df[odds_column])
+            df[probability_column] = whole_percent(probability, df.index)
+            # normalised from the unrounded probabilities, in tenths of a percent like the market consensus
+            df[NORMALISED_COLUMNS[odds_column]] = devig(probability, snapshot).round(1).to_numpy()
+    return df
+
+
+if __name__ == "__main__":
+    import time
+    from dotenv import load_dotenv
+    from database import create_db_engine
+    from changes import rebuild_changes
+    from loader import upsert_history
+
+    # recomputes the implied probabilities over the whole goldderby history, e.g. after a formula change
+    load_dotenv()
+    engine = create_db_engine()
+    history = pd.read_sql('SELECT * FROM goldderby', engine)
+    start = time.perf_counter()
+    add_implied_probabilities(history)
+    print(f"Recomputed {len(history)} rows in {(time.perf_counter() - start) * 1000:.1f} ms.")
+    upsert_history(engine, history)
+
+    # the changes the app reads are re-derived from the recomputed daily snapshots
+    for season in history['Season'].unique():
+        rebuild_changes(engine, int(season))
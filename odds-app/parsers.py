@@ -0,0 +1,109 @@
+from collections import namedtuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# a runner in the Oddschecker table: every bookmaker's price (data-bk -> data-o) and the best each-way price
+OddsRow = namedtuple('OddsRow', ['name', 'prices', 'best_ew'])
+
+# only the table rows are built into the tree, everything else on the rendered page is skipped
+ODDS_ROWS = SoupStrainer('tr')
+
+# likewise only the odds-page subtree of a Goldderby page is built
+GOLDDERBY_ODDS_PAGE = SoupStrainer('div', id='odds-page')
+
+
+def odds_clean(odds):
+    """
+    Some odds on the betting website end in '-', this function cleans those up
+    """
+    if odds[-1] == "-":
+        return odds[:-1]
+    else:
+        return odds
+
+
+def find_odds_page(html_content):
+    '''
+    Returns the section in a Goldderby page's html with the movie odds data, or None if it's missing
+    '''
+    soup = BeautifulSoup(html_content, 'lxml', parse_only=GOLDDERBY_ODDS_PAGE)
+    return soup.find('div', id='odds-page')
+
+
+def parse_goldderby_odds(html_content, movie_names):
+    '''
+    Parses a Goldderby Best Picture odds page to extract the votes and odds for each of the given movies
+    '''
+    return parse_odds_page(find_odds_page(html_content), movie_names)
+
+
+def parse_odds_page(odds_page, movie_names):
+    '''
+    Extracts the votes and odds for each of the given movies from a Goldderby odds-page section,
+    or for every movie listed when movie_names is None
+    '''
+    if not odds_page:
+        return None
+
+    best_picture_section = None
+    for title in odds_page.find_all('div', class_='category-title'):
+        if 'Best Picture' in title.get_text(strip=True):
+            best_picture_section = title
+            break
+
+    if not best_picture_section:
+        return None
+
+    predictions_list = best_picture_section.find_next('ul', class_='predictions-list')
+    if not predictions_list:
+        return None
+
+    movies_and_predictions = []
+    # locates each movie and appends its details (name, votes, odds) to a list
+    for item in predictions_list.find_all('li'):
+        movie_name = item.find('div', class_='predictions-name').get_text(strip=True)
+        if movie_names is None or movie_name in movie_names:
+            odds_elements = item.find_all('div', class_='predictions-odds')
+            if len(odds_elements) >= 3:
+                nomination = odds_elements[0].get_text(strip=True)
+                try:
+                    win = int(odds_elements[1].get_text(strip=True))
+                except ValueError:
+                    win = 0
+                odds = odds_elements[2].get_text(strip=True)
+                movies_and_predictions.append({
+                    'Movie Name': movie_name,
+                    'Nomination Vote': nomination,
+                    'Win Vote': win,
+                    'Odds': odds_clean(odds)
+                })
+    return movies_and_predictions
+
+
+def parse_oddschecker_odds(html_content):
+    '''
+    Walks the Oddschecker odds table once and indexes it by runner name, so looking up any movie is a dict lookup
+    '''
+    soup = BeautifulSoup(html_content, 'lxml', parse_only=ODDS_ROWS)
+
+    odds_rows = {}
+    for row in soup.find_all('tr'):
+        name_tag = row.find(attrs={'data-name': True})
+        if not name_tag:
+            continue
+
+        prices = {}
+        best_ew = None
+        for cell in row.find_all('td'):
+            odds_value = cell.get('data-o')
+            if cell.get('data-best-ew') == 'true':
+                if not odds_value:
+                    p_tag = cell.find('p')
+                    odds_value = p_tag.get_text(strip=True) if p_tag else None
+                best_ew = odds_value
+            if odds_value and cell.has_attr('data-bk'):
+                prices[cell['data-bk']] = odds_value
+
+        name = name_tag['data-name']
+        odds_rows[name] = OddsRow(name, prices, best_ew)
+    return odds_rows
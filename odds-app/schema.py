@@ -0,0 +1,404 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from sqlalchemy import REAL, Column, Date, DateTime, Float, Index, Integer, MetaData, PrimaryKeyConstraint, Table, Text, inspect, text
+
+load_dotenv()
+
+metadata = MetaData()
+
+# the ceremony year the scraper follows and the app shows by default, e.g. 2025 for the 97th Academy Awards
+CURRENT_SEASON = int(os.getenv('CURRENT_SEASON', '2025'))
+# a season's predictions start once the previous ceremony is over, snapshots from April on count towards the next year
+SEASON_START_MONTH = 4
+
+movie_stats = Table(
+    'movie_stats', metadata,
+    Column('Movie Name', Text, primary_key=True),
+    Column('Director', Text),
+    Column('Released', Date),
+    Column('Actors', Text),
+    Column('Plot', Text),
+    Column('RT Score', Text),
+    Column('imdb_id', Text),
+    Column('Poster', Text),
+    # local copies of the poster kept by get_poster.py, named by content hash under static/posters
+    Column('poster_file', Text),
+    Column('poster_thumb', Text),
+    Column('poster_updated', DateTime),
+    # the season the movie is a nominee in, NULL for rows from before seasons were tracked which count as CURRENT_SEASON
+    Column('Season', Integer),
+)
+
+# the seasons the history covers, with the slug of their Goldderby pages
+seasons = Table(
+    'seasons', metadata,
+    Column('season', Integer, primary_key=True),
+    Column('goldderby_slug', Text),
+)
+
+# one row per movie per snapshot, partitioned by season (the year of the ceremony) so queries about the current
+# season never read older ones. On postgres this is the partitioned parent with one partition per season, on sqlite
+# each season is its own table and goldderby is a view over all of them. Either way season_table(season) is the
+# single season's table, and it's kept out of metadata since create_all can't build it on sqlite.
+history_metadata = MetaData()
+
+goldderby = Table(
+    'goldderby', history_metadata,
+    Column('Movie Name', Text, nullable=False),
+    Column('Experts Vote', Integer),
+    Column('Experts Odds', Text),
+    Column('Star24 Vote', Integer),
+    Column('Star24 Odds', Text),
+    Column('Users Vote', Integer),
+    Column('Users Odds', Text),
+    Column('Date', Date, nullable=False),
+    Column('pct_vote_expert', Integer),
+    Column('pct_vote_star24', Integer),
+    Column('pct_vote_user', Integer),
+    Column('imp_prob_expert', Integer),
+    Column('imp_prob_star24', Integer),
+    Column('imp_prob_user', Integer),
+    Column('betting_odds', Text),
+    Column('betting_pct', Integer),
+    # the implied probabilities with the overround removed, normalised to sum to 100 within each snapshot
+    Column('norm_prob_expert', Float),
+    Column('norm_prob_star24', Float),
+    Column('norm_prob_user', Float),
+    Column('norm_betting_pct', Float),
+    Column('Season', Integer, nullable=False),
+    # within a season's partition the primary key doubles as the ("Date", "Movie Name") index the latest-snapshot queries use
+    PrimaryKeyConstraint('Date', 'Movie Name', 'Season', name='pk_goldderby'),
+    # serves the per-movie history on the movie pages, already sorted by date
+    Index('ix_goldderby_movie_name_date', 'Movie Name', 'Date'),
+    postgresql_partition_by='LIST ("Season")',
+)
+
+# every bookmaker's price per movie per snapshot in long format, only the priced cells are stored
+bookmaker_odds = Table(
+    'bookmaker_odds', metadata,
+    Column('Date', Date, nullable=False),
+    Column('Movie Name', Text, nullable=False),
+    Column('bookmaker', Text, nullable=False),
+    Column('decimal_odds', REAL),
+    PrimaryKeyConstraint('Date', 'Movie Name', 'bookmaker', name='pk_bookmaker_odds'),
+)
+
+# the betting market's view per movie per snapshot, derived from bookmaker_odds
+market_consensus = Table(
+    'market_consensus', metadata,
+    Column('Date', Date, nullable=False),
+    Column('Movie Name', Text, nullable=False),
+    Column('consensus_pct', Float),
+    Column('dispersion', Float),
+    Column('bookmakers', Integer),
+    Column('overround', Float),
+    PrimaryKeyConstraint('Date', 'Movie Name', name='pk_market_consensus'),
+)
+
+# the series followed between snapshots, see changes.py
+TRACKED_SERIES = ('pct_vote_expert', 'pct_vote_star24', 'pct_vote_user', 'imp_prob_expert', 'imp_prob_star24',
+                  'imp_prob_user', 'betting_pct', 'consensus_pct')
+
+# every movie's latest value of each tracked series, updated in place by every run
+odds_current = Table(
+    'odds_current', metadata,
+    Column('Season', Integer, nullable=False),
+    Column('Movie Name', Text, nullable=False),
+    *[Column(name, goldderby.c[name].type if name in goldderby.c else market_consensus.c[name].type)
+      for name in TRACKED_SERIES],
+    # when any of the movie's values last changed, and when a run last saw the movie
+    Column('changed_at', DateTime),
+    Column('checked_at', DateTime),
+    PrimaryKeyConstraint('Season', 'Movie Name', name='pk_odds_current'),
+)
+
+# one row per series whenever its value changes, so storage grows with market movement rather than with polling
+odds_changes = Table(
+    'odds_changes', metadata,
+    Column('Season', Integer, nullable=False),
+    Column('Movie Name', Text, nullable=False),
+    Column('series', Text, nullable=False),
+    Column('changed_at', DateTime, nullable=False),
+    Column('value', Float),
+    # serves a movie's series in time order for the movie pages
+    PrimaryKeyConstraint('Season', 'Movie Name', 'series', 'changed_at', name='pk_odds_changes'),
+)
+
+movie_news = Table(
+    'movie_news', metadata,
+    Column('movie_name', Text, primary_key=True),
+    Column('articles', Text),
+    Column('last_updated', DateTime),
+)
+
+# each movie page's stats, chart series and articles in one row, rebuilt by bundles.py when any of them change
+movie_bundles = Table(
+    'movie_bundles', metadata,
+    Column('Movie Name', Text, primary_key=True),
+    # the season whose odds the series follow, to join the movie's odds_current row
+    Column('Season', Integer),
+    Column('bundle', Text),
+    Column('built_at', DateTime),
+)
+
+fetch_cache = Table(
+    'fetch_cache', metadata,
+    Column('url', Text, primary_key=True),
+    Column('etag', Text),
+    Column('last_modified', Text),
+    Column('content_hash', Text),
+    Column('parsed', Text),
+    Column('fetched_at', Text),
+)
+
+
+def begin_ddl(conn):
+    '''
+    pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so statements like DROP and ALTER TABLE
+    would each commit on their own. Starting the transaction explicitly keeps them atomic.
+    '''
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql('BEGIN')
+
+
+def clean_table(table, df):
+    '''
+    Coerces a DataFrame (from a csv or an old untyped table) to a table's columns and types:
+    stray index columns are dropped, 'N/A' becomes NULL and rows repeating a primary key keep the last copy
+    '''
+    import pandas as pd
+
+    df = df[[column.name for column in table.columns if column.name in df.columns]].copy()
+    df = df.replace('N/A', None)
+
+    for column in table.columns:
+        if column.name not in df.columns:
+            continue
+        if isinstance(column.type, Integer):
+            df[column.name] = pd.to_numeric(df[column.name], errors='coerce').round().astype('Int64')
+        elif isinstance(column.type, Date):
+            df[column.name] = pd.to_datetime(df[column.name], errors='coerce').dt.date
+        elif isinstance(column.type, DateTime):
+            df[column.name] = pd.to_datetime(df[column.name], errors='coerce')
+
+    key = [column.name for column in table.primary_key.columns]
+    return df.drop_duplicates(subset=key, keep='last')
+
+
+def load_table(table, df, conn):
+    '''
+    Appends cleaned rows to an existing typed table
+    '''
+    clean_table(table, df).to_sql(table.name, conn, index=False, if_exists='append')
+
+
+def season_for_date(day):
+    '''
+    The season a snapshot taken on day counts towards
+    '''
+    return day.year + 1 if day.month >= SEASON_START_MONTH else day.year
+
+
+def assign_seasons(df):
+    '''
+    Fills in the Season of goldderby rows that don't have one from their snapshot date
+    '''
+    import pandas as pd
+
+    dates = pd.to_datetime(df['Date'], errors='coerce')
+    seasons_from_dates = (dates.dt.year + (dates.dt.month >= SEASON_START_MONTH)).astype('Int64')
+    if 'Season' in df.columns:
+        seasons_from_dates = pd.to_numeric(df['Season'], errors='coerce').astype('Int64').fillna(seasons_from_dates)
+    return df.assign(Season=seasons_from_dates)
+
+
+def partition_name(season):
+    return f'goldderby_{int(season)}'
+
+
+@lru_cache(maxsize=None)
+def season_table(season):
+    '''
+    The table holding one season of the goldderby history. Its index is only created on sqlite,
+    postgres partitions inherit goldderby's.
+    '''
+    name = partition_name(season)
+    columns = [Column(column.name, column.type, nullable=column.nullable) for column in goldderby.columns]
+    key = [column.name for column in goldderby.primary_key.columns]
+    return Table(name, MetaData(), *columns, PrimaryKeyConstraint(*key), Index(f'ix_{name}_movie_name_date', 'Movie Name', 'Date'))
+
+
+def history_kind(conn):
+    '''
+    What goldderby currently is: 'partitioned' (postgres) or 'view' (sqlite) once seasons are set up,
+    'table' for an unpartitioned history from before, None if there's no history yet
+    '''
+    if conn.dialect.name == 'postgresql':
+        kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('goldderby')")).scalar()
+        return {'p': 'partitioned', 'r': 'table', 'v': 'view'}.get(kind)
+    return conn.execute(text("SELECT type FROM sqlite_master WHERE name = 'goldderby'")).scalar()
+
+
+def refresh_history_view(conn):
+    '''
+    Recreates the sqlite goldderby view as the union of every season's table
+    '''
+    names = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'goldderby_[0-9][0-9][0-9][0-9]' ORDER BY name"
+    )).scalars().all()
+    conn.execute(text('DROP VIEW IF EXISTS goldderby'))
+    if names:
+        columns = ', '.join(f'"{column.name}"' for column in goldderby.columns)
+        union = ' UNION ALL '.join(f'SELECT {columns} FROM "{name}"' for name in names)
+        conn.execute(text(f'CREATE VIEW goldderby AS {union}'))
+
+
+def add_season(conn, season, goldderby_slug=None):
+    '''
+    Registers a season and creates its partition if it doesn't exist yet: a partition of goldderby on postgres,
+    a table of its own added to the goldderby view on sqlite. Run it inside a transaction opened with begin_ddl.
+    '''
+    season = int(season)
+    seasons.create(conn, checkfirst=True)
+    known = conn.execute(text('SELECT goldderby_slug FROM seasons WHERE season = :season'), {'season': season}).first()
+    if known is None:
+        conn.execute(seasons.insert().values(season=season, goldderby_slug=goldderby_slug))
+    elif goldderby_slug and goldderby_slug != known.goldderby_slug:
+        conn.execute(seasons.update().where(seasons.c.season == season).values(goldderby_slug=goldderby_slug))
+
+    if conn.dialect.name == 'postgresql':
+        goldderby.create(conn, checkfirst=True)
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{partition_name(season)}" PARTITION OF goldderby FOR VALUES IN ({season})'))
+    elif not inspect(conn).has_table(partition_name(season)):
+        season_table(season).create(conn)
+        refresh_history_view(conn)
+
+
+def create_tables(engine, season=CURRENT_SEASON):
+    '''
+    Creates any missing table, along with the goldderby partition for the given season.
+    An unpartitioned goldderby from before seasons is split into partitions first.
+    '''
+    metadata.create_all(engine)
+    partition_history(engine)
+    add_history_columns(engine)
+    with engine.begin() as conn:
+        begin_ddl(conn)
+        add_season(conn, season)
+
+
+def add_history_columns(engine):
+    '''
+    Adds goldderby columns introduced since the history was partitioned: to goldderby on postgres, whose
+    partitions follow it, and to every season's table on sqlite, whose view is then rebuilt with them
+    '''
+    with engine.connect() as conn:
+        kind = history_kind(conn)
+        names = [] if kind != 'view' else conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'goldderby_[0-9][0-9][0-9][0-9]'"
+        )).scalars().all()
+    if kind == 'partitioned':
+        add_missing_columns(engine, goldderby)
+    elif kind == 'view':
+        for name in names:
+            add_missing_columns(engine, season_table(int(name.rsplit('_', 1)[1])))
+        with engine.begin() as conn:
+            begin_ddl(conn)
+            refresh_history_view(conn)
+
+
+def partition_history(engine):
+    '''
+    Moves an unpartitioned goldderby table, typed or dumped by to_sql, into per-season partitions in one transaction
+    '''
+    import pandas as pd
+
+    with engine.begin() as conn:
+        begin_ddl(conn)
+        if history_kind(conn) != 'table':
+            return
+        rows = assign_seasons(pd.read_sql(text('SELECT * FROM goldderby'), conn))
+        conn.execute(text('ALTER TABLE goldderby RENAME TO goldderby_legacy'))
+        # index and constraint names outlive the rename, and would clash with the partitioned table's
+        for index in inspect(conn).get_indexes('goldderby_legacy'):
+            conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+        legacy_key = inspect(conn).get_pk_constraint('goldderby_legacy').get('name')
+        if conn.dialect.name == 'postgresql' and legacy_key:
+            conn.execute(text(f'ALTER TABLE goldderby_legacy RENAME CONSTRAINT "{legacy_key}" TO "{legacy_key}_legacy"'))
+
+        for season, season_rows in rows.groupby('Season'):
+            add_season(conn, season)
+            load_table(season_table(season), season_rows, conn)
+        conn.execute(text('DROP TABLE goldderby_legacy'))
+    print(f"Partitioned goldderby by season ({len(rows)} rows).")
+
+
+def needs_migration(engine, table):
+    '''
+    Tables created by DataFrame.to_sql have no primary key, which is how older databases are recognised
+    '''
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return False
+    return not inspector.get_pk_constraint(table.name).get('constrained_columns')
+
+
+def add_missing_columns(engine, table):
+    '''
+    Adds columns introduced since a typed table was created, they start out NULL
+    '''
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                print(f"Added {table.name}.{column.name}.")
+
+
+def migrate_database(engine):
+    '''
+    Converts tables created by DataFrame.to_sql into the typed schema, keeping their rows.
+    Each table is rebuilt in its own transaction: the old table is renamed aside, the typed one created
+    and filled from it, then the old one dropped. Typed tables just get any columns added since,
+    and goldderby is moved into per-season partitions.
+    '''
+    import pandas as pd
+
+    for table in metadata.sorted_tables:
+        if not needs_migration(engine, table):
+            if inspect(engine).has_table(table.name):
+                add_missing_columns(engine, table)
+            continue
+
+        legacy_name = f'{table.name}_legacy'
+        with engine.begin() as conn:
+            begin_ddl(conn)
+            rows = pd.read_sql(text(f'SELECT * FROM "{table.name}"'), conn)
+            conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{legacy_name}"'))
+            # postgres keeps index names after a rename, so a leftover to_sql index would clash with the new ones
+            for index in inspect(conn).get_indexes(legacy_name):
+                conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+            table.create(conn)
+            load_table(table, rows, conn)
+            conn.execute(text(f'DROP TABLE "{legacy_name}"'))
+        print(f"Migrated {table.name} ({len(rows)} rows).")
+
+    # tables that didn't exist at all are simply created, then the history is split into seasons
+    create_tables(engine)
+
+
+if __name__ == "__main__":
+    from database import create_db_engine
+
+    engine = create_db_engine()
+    migrate_database(engine)
+
+    # seasons from before the history was kept as changes get theirs derived from the daily snapshots
+    from changes import seed_changes
+    seed_changes(engine)
+    # and every movie page gets its bundle
+    from bundles import rebuild_bundles
+    rebuild_bundles(engine)
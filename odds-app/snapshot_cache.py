@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from metrics import cache_lookup
+
+load_dotenv()
+
+
+class SnapshotCache:
+    '''
+    Keeps the rendered odds tables for the latest goldderby snapshot in memory.
+
+    Entries are grouped by a version made of the latest goldderby "Date" and a generation
+    counter that the updater bumps after writing a new snapshot. Only the newest few versions
+    are kept (LRU), so old snapshots fall out on their own once a new one lands.
+    '''
+
+    def __init__(self, max_versions=4, version_ttl=30):
+        self.max_versions = max_versions
+        # how long (seconds) the latest "Date" is trusted before the db is asked again
+        self.version_ttl = version_ttl
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._latest_date = None
+        self._checked_at = None
+
+    def bump(self):
+        '''
+        Marks the cached snapshot as stale, called whenever new goldderby rows are written
+        '''
+        with self._lock:
+            self._generation += 1
+            self._checked_at = None
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+            self._checked_at = None
+
+    def version(self, fetch_latest_date):
+        '''
+        Returns the current (generation, latest date) pair, only calling fetch_latest_date
+        once the previous answer is older than version_ttl
+        '''
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.version_ttl:
+                return self._generation, self._latest_date
+
+        latest_date = fetch_latest_date()
+
+        with self._lock:
+            self._latest_date = latest_date
+            self._checked_at = time.monotonic()
+            return self._generation, self._latest_date
+
+    def get_or_build(self, key, build, fetch_latest_date):
+        '''
+        Returns the cached value for key under the current snapshot version, building it with
+        build() on a miss
+        '''
+        version = self.version(fetch_latest_date)
+
+        with self._lock:
+            entries = self._versions.get(version)
+            if entries is not None and key in entries:
+                self._versions.move_to_end(version)
+                cache_lookup('snapshot', 'hit')
+                return entries[key]
+
+        cache_lookup('snapshot', 'miss')
+        value = build()
+
+        with self._lock:
+            entries = self._versions.setdefault(version, {})
+            entries[key] = value
+            self._versions.move_to_end(version)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+        return value
+
+
+snapshot_cache = SnapshotCache(
+    max_versions=int(os.environ.get('SNAPSHOT_CACHE_VERSIONS', 4)),
+    version_ttl=float(os.environ.get('SNAPSHOT_CACHE_TTL', 30)),
+)
@@ -0,0 +1,89 @@
+'''
+The modules live in the odds-app folder and are imported as top-level modules, as the scripts import each other.
+Every database, archive and export the tests touch is a throwaway one, set up before any module reads its settings.
+'''
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+sys.path.insert(0, ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix='odds-tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{SCRATCH}/module.db',
+    'ARCHIVE_DIR': os.path.join(SCRATCH, 'archive'),
+    'EXPORT_DIR': os.path.join(SCRATCH, 'export'),
+    'CURRENT_SEASON': '2025',
+    'ZYTE_API_KEY': 'test',
+})
+os.environ.pop('DATABASE_REPLICA_URL', None)
+os.environ.pop('REDIS_URL', None)
+
+
+def fixture(name, **values):
+    with open(os.path.join(FIXTURES, name)) as f:
+        html = f.read()
+    for key, value in values.items():
+        html = html.replace(f'{{{key}}}', str(value))
+    return html
+
+
+def goldderby_page(anora=40, conclave=35):
+    return fixture('goldderby.html', anora=anora, conclave=conclave)
+
+
+def oddschecker_response(request=None):
+    return httpx.Response(200, json={'browserHtml': fixture('oddschecker.html')})
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    '''
+    A fresh sqlite database with every table, which the updater writes to in place of its own
+    '''
+    import weekly_update
+    from database import create_db_engine
+    from schema import create_tables
+
+    engine = create_db_engine(f'sqlite:///{tmp_path}/odds.db')
+    create_tables(engine)
+    monkeypatch.setattr(weekly_update, 'engine', engine)
+    # the static export is covered on its own, runs here only write the database
+    monkeypatch.setattr(weekly_update, 'export_site', lambda engine: None)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def stub_server():
+    '''
+    An http client whose requests are answered by the stub: routes maps a url to a function of the request
+    returning the response. Unknown urls are a 404. The requests made are kept in stub.requests.
+    '''
+    class Stub:
+        def __init__(self):
+            self.routes = {}
+            self.requests = []
+
+        def handle(self, request):
+            self.requests.append(request)
+            # the Zyte extract api is asked for the page in its json body, the stub answers for that page
+            url = json.loads(request.content)['url'] if request.url.host == 'api.zyte.com' else str(request.url)
+            route = self.routes.get(url)
+            if route is None:
+                return httpx.Response(404)
+            return route(request)
+
+        def make_client(self, *args, **kwargs):
+            return httpx.Client(transport=httpx.MockTransport(self.handle))
+
+    stub = Stub()
+    stub.client = stub.make_client()
+    yield stub
+    stub.client.close()
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from changes import record_changes, tracked_values
+
+
+@pytest.fixture
+def client(engine):
+    from app import app
+    from snapshot_cache import snapshot_cache
+
+    with engine.begin() as conn:
+        conn.execute(text('INSERT INTO movie_stats ("Movie Name", "Season") VALUES (\'Anora\', 2025)'))
+    app.config['RENDER_ENGINE'] = engine
+    snapshot_cache.clear()
+    yield app.test_client()
+    app.config['RENDER_ENGINE'] = None
+    snapshot_cache.clear()
+
+
+def observe(engine, at, star24):
+    record_changes(engine, 2025, tracked_values(pd.DataFrame({'Movie Name': ['Anora'], 'pct_vote_star24': [star24]})), at)
+
+
+def test_history_etag_follows_the_data_and_the_latest_check(engine, client):
+    from snapshot_cache import snapshot_cache
+
+    observe(engine, datetime(2025, 1, 6, 10), 40)
+    first = client.get('/api/movie/Anora/history')
+    assert first.status_code == 200 and first.json['latest'] == '2025-01-06 10:00:00.000000'
+
+    # another worker has counted a different number of invalidations, the data is the same
+    snapshot_cache.bump()
+    again = client.get('/api/movie/Anora/history', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.headers['ETag'] == first.headers['ETag']
+
+    # a run finding the same odds moves every series' last point on to when it checked
+    observe(engine, datetime(2025, 1, 6, 10, 30), 40)
+    checked = client.get('/api/movie/Anora/history', headers={'If-None-Match': first.headers['ETag']})
+    assert checked.status_code == 200 and checked.headers['ETag'] != first.headers['ETag']
+    assert checked.json['series']['pct_vote_star24']['x'][-1] != first.json['series']['pct_vote_star24']['x'][-1]
+
+    observe(engine, datetime(2025, 1, 6, 11), 45)
+    snapshot_cache.clear()
+    changed = client.get('/api/movie/Anora/history', headers={'If-None-Match': checked.headers['ETag']})
+    assert changed.status_code == 200 and changed.headers['ETag'] != checked.headers['ETag']
+    assert changed.json['series']['pct_vote_star24']['y'][:2] == [40, 45]
+
+
+def test_history_rejects_unknown_series(client):
+    assert client.get('/api/movie/Anora/history?series=nope').status_code == 400
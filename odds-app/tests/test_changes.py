@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import text
+
+from changes import record_changes, tracked_values
+from discrepancy import DiscrepancyEngine
+
+RUNS = [datetime(2025, 1, 6, 10, minute) for minute in (0, 5, 10)]
+
+
+def observed(*movies, star24=40, betting=30):
+    return tracked_values(pd.DataFrame({'Movie Name': list(movies), 'imp_prob_star24': star24, 'betting_pct': betting}))
+
+
+def add_movies(engine, *movies):
+    with engine.begin() as conn:
+        for movie in movies:
+            conn.execute(text('INSERT INTO movie_stats ("Movie Name") VALUES (:movie)'), {'movie': movie})
+
+
+def current(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(text('SELECT * FROM odds_current'), conn, parse_dates=['changed_at', 'checked_at']).set_index('Movie Name')
+
+
+def test_unchanged_movies_keep_when_they_last_changed(engine):
+    record_changes(engine, 2025, observed('Anora', 'Conclave'), RUNS[0])
+    record_changes(engine, 2025, observed('Anora', 'Conclave', star24=[45, 40]), RUNS[1])
+
+    state = current(engine)
+    assert state.loc['Anora', 'changed_at'] == RUNS[1]
+    assert state.loc['Conclave', 'changed_at'] == RUNS[0]
+    assert (state['checked_at'] == RUNS[1]).all()
+
+
+def test_a_movie_back_after_missing_a_check_counts_as_changed(engine):
+    record_changes(engine, 2025, observed('Anora', 'Conclave'), RUNS[0])
+    record_changes(engine, 2025, observed('Anora'), RUNS[1])
+    # back with the very values it left with
+    record_changes(engine, 2025, observed('Anora', 'Conclave'), RUNS[2])
+
+    state = current(engine)
+    assert state.loc['Conclave', 'changed_at'] == RUNS[2]
+    assert state.loc['Anora', 'changed_at'] == RUNS[0]
+
+
+def test_the_live_table_drops_and_picks_up_a_returning_movie(engine):
+    add_movies(engine, 'Anora', 'Conclave')
+    discrepancies = DiscrepancyEngine(engine, 2025)
+    record_changes(engine, 2025, observed('Anora', 'Conclave'), RUNS[0])
+    discrepancies.refresh()
+    subscription = discrepancies.subscribe()
+
+    record_changes(engine, 2025, observed('Anora'), RUNS[1])
+    discrepancies.refresh()
+    assert [row.movie_name for row in discrepancies.rows()] == ['Anora']
+
+    record_changes(engine, 2025, observed('Anora', 'Conclave'), RUNS[2])
+    assert [row.movie_name for row in discrepancies.refresh()] == ['Conclave']
+    assert sorted(row.movie_name for row in discrepancies.rows()) == ['Anora', 'Conclave']
+
+    messages = [subscription.get_nowait() for _ in range(subscription.qsize())]
+    assert messages[0] == ('removed', ['Conclave'])
+    assert messages[1][0] == 'rows' and [row['movie_name'] for row in messages[1][1]] == ['Conclave']
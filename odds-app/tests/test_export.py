@@ -0,0 +1,24 @@
+import threading
+
+import export
+
+
+def test_an_export_overlapping_another_is_skipped(monkeypatch, tmp_path):
+    rendering, finish = threading.Event(), threading.Event()
+
+    def render_export(engine, root=None):
+        rendering.set()
+        finish.wait(5)
+        return root
+
+    monkeypatch.setattr(export, 'render_export', render_export)
+    first = threading.Thread(target=export.export_site, args=[None, tmp_path])
+    first.start()
+    assert rendering.wait(5)
+
+    # the scheduler's re-export firing while an updater run's export renders
+    assert export.export_site(None, tmp_path) is None
+
+    finish.set()
+    first.join(5)
+    assert export.export_site(None, tmp_path) == tmp_path
@@ -0,0 +1,106 @@
+import httpx
+
+from conftest import goldderby_page, oddschecker_response
+from fetch import FetchJob, fetch_all
+from weekly_update import GoldderbyPage, goldderby_urls, source_jobs
+
+MOVIES = {'Anora', 'Conclave'}
+URLS = goldderby_urls('oscars-2025-predictions')
+ODDSCHECKER = 'https://www.oddschecker.com/awards/oscars/best-picture'
+
+
+def serve_every_source(stub):
+    for url in URLS.values():
+        stub.routes[url] = lambda request: httpx.Response(200, text=goldderby_page())
+    stub.routes[ODDSCHECKER] = oddschecker_response
+
+
+def test_every_source_is_fetched_and_parsed(stub_server):
+    serve_every_source(stub_server)
+    raw_pages = {}
+
+    scraped = fetch_all(source_jobs(URLS, MOVIES, raw_pages=raw_pages), client=stub_server.client, backoff=0)
+
+    for category in URLS:
+        page = scraped[category]
+        assert isinstance(page, GoldderbyPage)
+        assert {row['Movie Name']: row['Win Vote'] for row in page.rows} == {'Anora': 40, 'Conclave': 35}
+        # the trailing '-' some odds carry is dropped
+        assert {row['Odds'] for row in page.rows} == {'9/2', '11/2'}
+    assert scraped['Oddschecker']['Anora'].best_ew == '7/4'
+    assert scraped['Oddschecker']['Conclave'].prices == {'B3': '3/1', 'SK': '5/2'}
+    assert set(raw_pages) == set(URLS) | {'Oddschecker'}
+
+
+def test_retryable_statuses_are_retried(stub_server):
+    answers = iter([httpx.Response(503), httpx.Response(502), httpx.Response(200, text=goldderby_page())])
+    stub_server.routes[URLS['Experts']] = lambda request: next(answers)
+    jobs = {'Experts': source_jobs(URLS, MOVIES)['Experts']}
+
+    scraped = fetch_all(jobs, client=stub_server.client, retries=3, backoff=0)
+
+    assert len(stub_server.requests) == 3
+    assert len(scraped['Experts'].rows) == 2
+
+
+def test_a_failed_source_maps_to_none(stub_server):
+    serve_every_source(stub_server)
+    stub_server.routes[URLS['Users']] = lambda request: httpx.Response(500)
+    stub_server.routes[ODDSCHECKER] = lambda request: httpx.Response(429)
+
+    scraped = fetch_all(source_jobs(URLS, MOVIES), client=stub_server.client, retries=1, backoff=0)
+
+    assert scraped['Users'] is None
+    assert scraped['Oddschecker'] is None
+    assert len(scraped['Experts'].rows) == 2
+
+
+def test_connection_errors_map_to_none(stub_server):
+    def refuse(request):
+        raise httpx.ConnectError('connection refused', request=request)
+    stub_server.routes[URLS['Star24']] = refuse
+    jobs = {'Star24': source_jobs(URLS, MOVIES)['Star24']}
+
+    assert fetch_all(jobs, client=stub_server.client, retries=2, backoff=0) == {'Star24': None}
+    assert len(stub_server.requests) == 3
+
+
+def test_a_page_that_fails_to_parse_maps_to_none(stub_server):
+    serve_every_source(stub_server)
+    # Zyte answering with something other than json
+    stub_server.routes[ODDSCHECKER] = lambda request: httpx.Response(200, text='<html>rate limited</html>')
+
+    def broken(response):
+        raise ValueError('unexpected page layout')
+    jobs = source_jobs(URLS, MOVIES)
+    jobs['Experts'] = jobs['Experts']._replace(parse=broken)
+
+    scraped = fetch_all(jobs, client=stub_server.client, backoff=0)
+
+    assert scraped['Experts'] is None
+    assert scraped['Oddschecker'] is None
+    assert len(scraped['Star24'].rows) == 2
+
+
+def test_slow_sources_are_fetched_concurrently(stub_server):
+    import threading
+    # every page waits until all of them were requested, which only happens when they're fetched at once
+    requested = threading.Barrier(3, timeout=5)
+
+    def wait_for_the_others(request):
+        requested.wait()
+        return httpx.Response(200, text=goldderby_page())
+    for url in URLS.values():
+        stub_server.routes[url] = wait_for_the_others
+    jobs = {name: job for name, job in source_jobs(URLS, MOVIES).items() if name != 'Oddschecker'}
+
+    scraped = fetch_all(jobs, client=stub_server.client, retries=0)
+
+    assert all(page is not None for page in scraped.values())
+
+
+def test_jobs_pass_their_options(stub_server):
+    stub_server.routes['https://example.com/page'] = lambda request: httpx.Response(200, text=request.headers['X-Test'])
+    job = FetchJob('GET', 'https://example.com/page', 5, lambda response: response.text, {'headers': {'X-Test': 'yes'}})
+
+    assert fetch_all({'page': job}, client=stub_server.client) == {'page': 'yes'}
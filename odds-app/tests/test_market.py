@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from market import OddsMatrix
+from parsers import OddsRow
+
+
+def matrix(books):
+    '''
+    An OddsMatrix from {bookmaker: {runner: price}}
+    '''
+    runners = sorted({runner for prices in books.values() for runner in prices})
+    rows = {runner: OddsRow(runner, {book: prices[runner] for book, prices in books.items() if runner in prices}, None)
+            for runner in runners}
+    return OddsMatrix.from_rows(rows)
+
+
+def test_full_books_are_de_vigged_by_their_own_margin():
+    odds = matrix({'B1': {'A': '1/2', 'B': '2/1'}, 'B2': {'A': '4/6', 'B': '6/4'}})
+    consensus, _, bookmakers = odds.consensus()
+
+    assert consensus.sum() == pytest.approx(100)
+    assert consensus[0] > consensus[1]
+    assert odds.overround() == pytest.approx(np.median([1 / 1.5 + 1 / 3, 1 / (5 / 3) + 1 / 2.5]) * 100 - 100, rel=1e-4)
+    assert bookmakers.tolist() == [2, 2]
+
+
+def test_books_quoting_part_of_the_field():
+    # neither book prices the whole field, their own totals would make A 66.7, B 50 and C 16.7
+    odds = matrix({'B1': {'A': '1/1', 'B': '1/1'}, 'B2': {'A': '1/1', 'C': '9/1'}})
+    consensus, _, _ = odds.consensus()
+
+    assert consensus.sum() == pytest.approx(100)
+    assert consensus.tolist() == pytest.approx([50, 37.5, 12.5], rel=1e-4)
+    # without a full book the margin can't be told
+    assert odds.overround() is None
+
+
+def test_partial_books_take_the_full_books_margin():
+    odds = matrix({
+        'FULL': {'A': '1/1', 'B': '2/1', 'C': '4/1'},
+        'PART': {'A': '1/1', 'B': '2/1'},
+    })
+    consensus, _, bookmakers = odds.consensus()
+
+    full_total = 1 / 2 + 1 / 3 + 1 / 5
+    assert odds.overround() == pytest.approx(full_total * 100 - 100, rel=1e-4)
+    assert odds.overround() > 0
+    assert consensus.sum() == pytest.approx(100)
+    # both books agree on A and B, so the partial book doesn't pull them up
+    assert consensus.tolist() == pytest.approx([50 / full_total, 100 / 3 / full_total, 20 / full_total], rel=1e-4)
+    assert bookmakers.tolist() == [2, 2, 1]
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from odds import add_implied_probabilities
+from schema import add_history_columns
+
+
+def test_normalised_probabilities_sum_to_100_within_each_snapshot():
+    df = pd.DataFrame({
+        'Date': ['2025-01-06', '2025-01-06', '2025-01-06', '2025-01-13', '2025-01-13'],
+        'Movie Name': ['Anora', 'Conclave', 'Wicked', 'Anora', 'Conclave'],
+        'Star24 Odds': ['1/1', '2/1', '3/1', '1/2', 'N/A'],
+    })
+    add_implied_probabilities(df)
+
+    # the raw percentages stay as they were, overround included
+    assert df['imp_prob_star24'].tolist()[:4] == [50, 33, 25, 67]
+    assert pd.isna(df['imp_prob_star24'][4])
+    assert df.groupby('Date')['norm_prob_star24'].sum().tolist() == pytest.approx([100, 100], abs=0.2)
+    assert df['norm_prob_star24'].tolist()[:4] == pytest.approx([46.2, 30.8, 23.1, 100])
+    assert pd.isna(df['norm_prob_star24'][4])
+
+
+def test_existing_season_tables_gain_the_normalised_columns(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE goldderby_2025 ("Date" DATE, "Movie Name" TEXT, "Season" INTEGER)'))
+        conn.execute(text('CREATE VIEW goldderby AS SELECT * FROM goldderby_2025'))
+
+    add_history_columns(engine)
+
+    assert 'norm_betting_pct' in {column['name'] for column in inspect(engine).get_columns('goldderby_2025')}
+    assert 'norm_betting_pct' in {column['name'] for column in inspect(engine).get_columns('goldderby')}
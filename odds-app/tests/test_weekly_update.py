@@ -0,0 +1,89 @@
+import httpx
+import pandas as pd
+from sqlalchemy import text
+
+from conftest import goldderby_page, oddschecker_response
+from fetch import FetchCache, fetch_all
+from weekly_update import build_snapshot, calculate_pct_votes, goldderby_urls, source_jobs, write_snapshot
+
+MOVIES = {'Anora', 'Conclave'}
+URLS = goldderby_urls('oscars-2025-predictions')
+ODDSCHECKER = 'https://www.oddschecker.com/awards/oscars/best-picture'
+EXPERTS = [{'Movie Name': 'Anora', 'Win Vote': 30, 'Odds': '2/1'}, {'Movie Name': 'Conclave', 'Win Vote': 10, 'Odds': '5/1'}]
+
+
+def scrape(stub, failing=()):
+    for category, url in URLS.items():
+        stub.routes[url] = lambda request: httpx.Response(200, text=goldderby_page())
+    stub.routes[ODDSCHECKER] = oddschecker_response
+    for source in failing:
+        url = URLS.get(source, ODDSCHECKER)
+        stub.routes[url] = lambda request: httpx.Response(500)
+    raw_pages = {}
+    return fetch_all(source_jobs(URLS, MOVIES, raw_pages=raw_pages), client=stub.client, retries=0), raw_pages
+
+
+def history(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(text('SELECT * FROM goldderby_2025 ORDER BY "Movie Name"'), conn).set_index('Movie Name')
+
+
+def test_pct_votes_of_a_missing_group_are_na():
+    df = pd.DataFrame({'Date': ['2025-01-06'] * 3, 'Votes': [30, None, 10]})
+    assert calculate_pct_votes(df, 'Votes').tolist() == [75, pd.NA, 25]
+    assert calculate_pct_votes(df.assign(Votes=None), 'Votes').isna().all()
+
+
+def test_snapshot_without_some_sources():
+    weekly_df = build_snapshot(EXPERTS, [], [], None, '2025-01-06', 2025)
+
+    assert weekly_df['pct_vote_expert'].tolist() == [75, 25]
+    assert weekly_df['pct_vote_star24'].isna().all() and weekly_df['pct_vote_user'].isna().all()
+    assert weekly_df['betting_odds'].isna().all() and weekly_df['betting_pct'].isna().all()
+    assert weekly_df['imp_prob_expert'].tolist() == [33, 17]
+
+
+def test_a_run_is_written_from_the_stub_pages(engine, stub_server):
+    scraped, raw_pages = scrape(stub_server)
+
+    assert write_snapshot(2025, '2025-01-06', scraped, raw_pages, MOVIES, FetchCache(engine))
+
+    rows = history(engine)
+    assert rows.loc['Anora', 'pct_vote_star24'] == 53
+    assert rows.loc['Anora', 'betting_odds'] == '7/4'
+    assert rows.loc['Conclave', 'betting_pct'] == 25
+
+
+def test_a_run_missing_a_source_is_still_written(engine, stub_server):
+    scraped, raw_pages = scrape(stub_server, failing=('Users', 'Oddschecker'))
+    assert scraped['Users'] is None and scraped['Oddschecker'] is None
+
+    assert write_snapshot(2025, '2025-01-06', scraped, raw_pages, MOVIES, FetchCache(engine))
+
+    rows = history(engine)
+    assert rows['pct_vote_expert'].tolist() == [53, 47]
+    assert rows['pct_vote_user'].isna().all()
+    assert rows['betting_odds'].isna().all()
+
+
+def test_a_run_without_any_goldderby_page_writes_nothing(engine, stub_server):
+    scraped, raw_pages = scrape(stub_server, failing=('Experts', 'Star24', 'Users'))
+
+    assert not write_snapshot(2025, '2025-01-06', scraped, raw_pages, MOVIES, FetchCache(engine))
+    assert history(engine).empty
+
+
+def test_a_same_day_rerun_keeps_the_values_a_failed_source_had(engine, stub_server):
+    scraped, raw_pages = scrape(stub_server)
+    write_snapshot(2025, '2025-01-06', scraped, raw_pages, MOVIES, FetchCache(engine))
+
+    # later that day the Goldderby votes move but Oddschecker can't be fetched
+    stub_server.routes[URLS['Experts']] = lambda request: httpx.Response(200, text=goldderby_page(anora=50, conclave=25))
+    stub_server.routes[ODDSCHECKER] = lambda request: httpx.Response(500)
+    scraped = fetch_all(source_jobs(URLS, MOVIES), client=stub_server.client, retries=0)
+    assert write_snapshot(2025, '2025-01-06', scraped, {}, MOVIES, FetchCache(engine))
+
+    rows = history(engine)
+    assert rows.loc['Anora', 'pct_vote_expert'] == 67
+    assert rows.loc['Anora', 'betting_odds'] == '7/4'
+    assert rows.loc['Conclave', 'betting_pct'] == 25
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from functools import partial
+
+import fakeredis
+import httpx
+import pytest
+from sqlalchemy import text
+
+import fetch
+import jobs
+import worker
+from conftest import goldderby_page, oddschecker_response
+from weekly_update import goldderby_urls, season_slug
+
+MOVIES = {'Anora', 'Conclave'}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def scraping(engine, stub_server, monkeypatch):
+    '''
+    Workers scraping the stub pages into the test database, counting the snapshots they write
+    '''
+    for url in goldderby_urls(season_slug(2025)).values():
+        stub_server.routes[url] = lambda request: httpx.Response(200, text=goldderby_page())
+    stub_server.routes['https://www.oddschecker.com/awards/oscars/best-picture'] = oddschecker_response
+    monkeypatch.setattr(fetch, 'make_client', stub_server.make_client)
+    monkeypatch.setattr(worker, 'engine', engine)
+    monkeypatch.setattr(worker, 'read_movie_names', lambda: MOVIES)
+    # short waits on the queue and between retries, so the tests finish quickly
+    monkeypatch.setattr(worker, 'next_job', partial(jobs.next_job, timeout=0.2))
+    monkeypatch.setattr(worker, 'fetch_all', partial(fetch.fetch_all, backoff=0))
+
+    writes = []
+    write_snapshot = worker.write_snapshot
+
+    def counted(*args):
+        writes.append(args[:2])
+        return write_snapshot(*args)
+    monkeypatch.setattr(worker, 'write_snapshot', counted)
+    return writes
+
+
+def listen(server):
+    events = []
+    jobs.listen_for_invalidations(fakeredis.FakeRedis(server=server), events.append)
+    # the listener subscribes on its own thread, publishing before it has would go unheard
+    time.sleep(0.2)
+    return events
+
+
+def run_workers(r, count=3, timeout=30):
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker.work, args=(r, stop)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    while r.llen(jobs.QUEUE_KEY) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+
+def snapshot_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(text('SELECT COUNT(*) FROM goldderby_2025')).scalar()
+
+
+def test_schedulers_firing_together_enqueue_one_run(server):
+    r = fakeredis.FakeRedis(server=server)
+
+    assert worker.enqueue(r, 2025, dedupe='2025:2025-01-06T10:00')
+    assert worker.enqueue(r, 2025, dedupe='2025:2025-01-06T10:00') is None
+    assert r.llen(jobs.QUEUE_KEY) == len(worker.SOURCES)
+
+
+def test_workers_write_each_run_once_and_publish_it(engine, server, scraping):
+    r = fakeredis.FakeRedis(server=server)
+    events = listen(server)
+    run_id = worker.enqueue(r, 2025)
+    # a job delivered twice, as after a worker lost its connection mid-job
+    r.lpush(jobs.QUEUE_KEY, r.lindex(jobs.QUEUE_KEY, 0))
+
+    run_workers(r)
+    time.sleep(0.2)
+
+    assert len(scraping) == 1
+    assert jobs.is_written(r, run_id)
+    assert snapshot_rows(engine) == len(MOVIES)
+    assert events == [{'season': 2025, 'date': scraping[0][1]}]
+
+
+def test_completing_a_run_twice_writes_it_once(engine, server, scraping):
+    r = fakeredis.FakeRedis(server=server)
+    run_id = worker.enqueue(r, 2025)
+    run_workers(r)
+
+    assert not worker.complete_run(r, run_id)
+    assert len(scraping) == 1
+
+
+def test_a_held_snapshot_lock_keeps_other_writers_out(server):
+    r = fakeredis.FakeRedis(server=server)
+
+    with jobs.distributed_lock(r, 'snapshot:2025:2025-01-06') as acquired:
+        assert acquired
+        with jobs.distributed_lock(r, 'snapshot:2025:2025-01-06', wait=0.2) as second:
+            assert not second
+    with jobs.distributed_lock(r, 'snapshot:2025:2025-01-06', wait=0.2) as again:
+        assert again
+
+
+def test_a_source_failing_in_a_worker_still_completes_the_run(engine, server, scraping, stub_server):
+    stub_server.routes['https://www.oddschecker.com/awards/oscars/best-picture'] = lambda request: httpx.Response(500)
+    r = fakeredis.FakeRedis(server=server)
+    run_id = worker.enqueue(r, 2025)
+
+    run_workers(r)
+
+    assert jobs.is_written(r, run_id)
+    assert snapshot_rows(engine) == len(MOVIES)
+
+
+def test_a_job_taken_by_a_worker_that_died_is_requeued(engine, server, scraping):
+    r = fakeredis.FakeRedis(server=server)
+    run_id = worker.enqueue(r, 2025)
+    # a worker takes a job and dies before saving its result
+    lost = jobs.next_job(r, 'dead-worker', timeout=0.2)
+    run_workers(r)
+
+    assert not jobs.is_written(r, run_id)
+    assert jobs.requeue_stale(r, older_than=jobs.JOB_TIMEOUT) == 0
+    assert jobs.requeue_stale(r, older_than=0) == 1
+    assert json.loads(r.lindex(jobs.QUEUE_KEY, 0)) == lost
+
+    run_workers(r)
+
+    assert jobs.is_written(r, run_id)
+    assert snapshot_rows(engine) == len(MOVIES)
+    assert not r.llen(jobs.processing_key('dead-worker'))
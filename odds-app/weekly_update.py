@@ -1,50 +1,60 @@
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import select
 import os
+import httpx
 from dotenv import load_dotenv
 from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
 from apscheduler.schedulers.blocking import BlockingScheduler
+from collections import namedtuple
+import metrics
+from archive import archive_run
+from bundles import rebuild_bundles
+from changes import compute_changes, save_changes, tracked_values
+from database import create_db_engine
+from export import EXPORT_INTERVAL, export_site
+from fetch import FetchCache, FetchJob, FetchState, conditional_headers, content_hash, fetch, fetch_all, make_client
+from news import prefetch_news
+from odds import add_implied_probabilities
+from loader import upsert_history, upsert_rows
+from market import OddsMatrix
+from schema import CURRENT_SEASON, bookmaker_odds, market_consensus, seasons
+from parsers import find_odds_page, parse_goldderby_odds, parse_odds_page, parse_oddschecker_odds
 
 load_dotenv()
-engine = create_engine(os.getenv('DATABASE_URL').replace('postgresql://', 'postgresql+psycopg://'))
-
-def odds_clean(odds):
-    """
-    Some odds on the betting website end in '-', this function cleans those up
-    """
-    if odds[-1] == "-":
-        return odds[:-1]
-    else:
-        return odds
+engine = create_db_engine()
+metrics.instrument_engine(engine)
 
 def calculate_pct_votes(df, vote_column, date_column='Date'):
     '''
-    Given a certain date and a group of voters, calculates the percentage of voters who predicted a particular movie to win on that date
+    Given a certain date and a group of voters, calculates the percentage of voters who predicted a particular movie to win on that date.
+    Movies the group's page didn't list, or a group whose page couldn't be scraped, get no percentage (NA).
     '''
-    total_votes_per_date = df.groupby(date_column)[vote_column].transform('sum')
-    pct_votes = (df[vote_column] / total_votes_per_date * 100).round().astype(int)
+    votes = pd.to_numeric(df[vote_column], errors='coerce')
+    total_votes_per_date = votes.groupby(df[date_column]).transform('sum')
+    pct_votes = (votes / total_votes_per_date.where(total_votes_per_date > 0) * 100).round().astype('Int64')
     return pct_votes
 
 
-def odds_to_prob(odds):
-    '''
-    Converts fractional odds to percentage odds
-    '''
-    try:
-        if '/' in odds:
-            vals = odds.split('/')
-            numerator, denominator = int(vals[0]), int(vals[1])
-            prob = (denominator / (numerator + denominator)) * 100
-        else:
-            decimal_odds = float(odds)
-            prob = (1 / decimal_odds) * 100
+# mapping the titles for movies whose names differ across the betting website and Goldderby
+TITLE_MAPPING = {
+    'Joker: Folie à Deux': 'Joker: Folie a Deux',
+    'Gladiator II': 'Gladiator 2',
+    'Nickel Boys': 'The Nickel Boys',
+    'Saturday Night': 'SNL: 1975'
+}
 
-        rounded_prob = int(round(prob))
-        return rounded_prob
-    except:
-        return None
+# per-source timeouts in seconds, Zyte renders the page in a browser so it gets much longer
+GOLDDERBY_TIMEOUT = httpx.Timeout(20.0, connect=5.0)
+ZYTE_TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+
+# minutes between runs when polling, 0 keeps the weekly Monday run
+POLL_INTERVAL_MINUTES = int(os.getenv('POLL_INTERVAL_MINUTES', '0'))
+
+# the Goldderby pages scraped each run, alongside the Oddschecker page
+GOLDDERBY_CATEGORIES = ('Experts', 'Star24', 'Users')
+
+# a scraped Goldderby page: its parsed rows, the fetch state to remember for next time and whether the odds changed
+GoldderbyPage = namedtuple('GoldderbyPage', ['rows', 'state', 'changed'])
 
 
 def find_movies(url, movies_df):
@@ -54,100 +64,144 @@ def find_movies(url, movies_df):
 
     movie_names = set(movies_df['Movie Name'].tolist())
 
-    # setting up scraper
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
-    response = requests.get(url, headers=headers)
-    html_content = response.text
-    soup = BeautifulSoup(html_content, 'html.parser')
+    with make_client() as client:
+        response = fetch(client, 'GET', url, GOLDDERBY_TIMEOUT)
+    return parse_goldderby_odds(response.text, movie_names)
 
-    # finding section in the page's html with the movie odds data
-    odds_page = soup.find('div', id='odds-page')
-    if not odds_page:
+
+def browser_html(response):
+    '''
+    Pulls the rendered Oddschecker page out of a Zyte extract response
+    '''
+    response_json = response.json()
+    if "browserHtml" not in response_json:
+        print("Key 'browserHtml' not found in the response. Full response:")
+        print(response_json)
         return None
+    return response_json["browserHtml"]
 
-    best_picture_section = None
-    for title in odds_page.find_all('div', class_='category-title'):
-        if 'Best Picture' in title.get_text(strip=True):
-            best_picture_section = title
-            break
 
-    if not best_picture_section:
-        return None
+def parse_browser_html(response):
+    html = browser_html(response)
+    return parse_oddschecker_odds(html) if html else None
 
-    predictions_list = best_picture_section.find_next('ul', class_='predictions-list')
-    if not predictions_list:
-        return None
 
-    movies_and_predictions = []
-    # locates each movie and appends its details (name, votes, odds) to a list
-    for item in predictions_list.find_all('li'):
-        movie_name = item.find('div', class_='predictions-name').get_text(strip=True)
-        if movie_name in movie_names:
-            odds_elements = item.find_all('div', class_='predictions-odds')
-            if len(odds_elements) >= 3:
-                nomination = odds_elements[0].get_text(strip=True)
-                try:
-                    win = int(odds_elements[1].get_text(strip=True))
-                except ValueError:
-                    win = 0
-                odds = odds_elements[2].get_text(strip=True)
-                movies_and_predictions.append({
-                    'Movie Name': movie_name,
-                    'Nomination Vote': nomination,
-                    'Win Vote': win,
-                    'Odds': odds_clean(odds)
-                })
-    return movies_and_predictions
-
-
-
-def find_odds_for_movie(movie_name, soup):
+def keep_page(name, parse, raw_pages):
     '''
-    Given a movie name, finds the best odds for that movie to win Best Picture on the betting site
+    Wraps a job's parser so the page it was given is kept in raw_pages for the raw archive.
+    Unchanged (304) pages have no body to keep.
     '''
+    def parse_and_keep(response):
+        if response.status_code == 200:
+            raw_pages[name] = browser_html(response) if name == 'Oddschecker' else response.text
+        return parse(response)
+    return parse_and_keep
+
 
-    betting_title = title_mapping.get(movie_name, movie_name)
-    movie_tag = soup.find('span', {'data-name': betting_title})
+def goldderby_job(url, movie_names, fetch_cache=None):
+    '''
+    Builds a conditional fetch for a Goldderby page. A 304 or an odds-page section whose hash matches the last
+    run reuses the previously parsed rows instead of parsing the page again.
+    '''
+    state = fetch_cache.get(url) if fetch_cache else None
 
+    def parse(response):
+        if response.status_code == 304 and state:
+            metrics.cache_lookup('fetch', 'not_modified')
+            return GoldderbyPage(state.parsed, state, False)
 
-    if not movie_tag:
-        print(f"Warning: Movie '{movie_name}' with betting title '{betting_title}' not found")
-        return None
+        odds_page = find_odds_page(response.text)
+        page_hash = content_hash(str(odds_page)) if odds_page else None
+        new_state = FetchState(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), page_hash, None)
 
-    ew_tag = movie_tag.find_next(
-        lambda tag: tag.name == 'td' and tag.has_attr('data-best-ew') and tag['data-best-ew'] == 'true')
+        if state and page_hash and page_hash == state.content_hash:
+            metrics.cache_lookup('fetch', 'unchanged')
+            return GoldderbyPage(state.parsed, new_state._replace(parsed=state.parsed), False)
 
-    if not ew_tag:
-        print(f"Warning: data-best-ew='true' not found for '{movie_name}'.")
-        return None
+        metrics.cache_lookup('fetch', 'miss')
+        rows = parse_odds_page(odds_page, movie_names)
+        return GoldderbyPage(rows, new_state._replace(parsed=rows), True)
 
+    return FetchJob('GET', url, GOLDDERBY_TIMEOUT, parse, {'headers': conditional_headers(state)})
 
-    odds_value = ew_tag.get('data-o', None)
 
-    if not odds_value:
-        p_tag = ew_tag.find('p')
-        odds_value = p_tag.get_text(strip=True) if p_tag else None
+def source_jobs(base_urls, movie_names, fetch_cache=None, raw_pages=None):
+    '''
+    The fetch job for each source: the three Goldderby pages and the Oddschecker page.
+    The fetched pages are collected in raw_pages when it's given.
+    '''
+    jobs = {
+        category: goldderby_job(url, movie_names, fetch_cache)
+        for category, url in base_urls.items()
+    }
+    jobs['Oddschecker'] = FetchJob(
+        'POST',
+        "https://api.zyte.com/v1/extract",
+        ZYTE_TIMEOUT,
+        parse_browser_html,
+        {
+            'auth': (os.getenv("ZYTE_API_KEY"), ""),
+            'json': {
+                "url": "https://www.oddschecker.com/awards/oscars/best-picture",
+                "browserHtml": True,
+            },
+        },
+    )
+    if raw_pages is not None:
+        jobs = {name: job._replace(parse=keep_page(name, job.parse, raw_pages)) for name, job in jobs.items()}
+    return jobs
 
-    return odds_value
 
-def weekly_movie_data_updater():
-    # URLs for each category
-    base_urls = {
-        'Experts': "https://www.goldderby.com/odds/expert-odds/oscars-nominations-2025-predictions/",
-        'Star24': "https://www.goldderby.com/odds/top24-odds/oscars-nominations-2025-predictions/",
-        'Users': "https://www.goldderby.com/odds/user-odds/oscars-nominations-2025-predictions/"
+def scrape_sources(base_urls, movie_names, fetch_cache=None, raw_pages=None):
+    '''
+    Fetches every source concurrently over one connection pool, parsing each page as soon as it arrives
+    '''
+    return fetch_all(source_jobs(base_urls, movie_names, fetch_cache, raw_pages))
+
+
+
+def find_odds_for_movie(movie_name, odds_rows):
+    '''
+    Given a movie name, finds the best odds for that movie to win Best Picture on the betting site
+    '''
+
+    betting_title = TITLE_MAPPING.get(movie_name, movie_name)
+    odds_row = odds_rows.get(betting_title)
+
+    if not odds_row:
+        print(f"Warning: Movie '{movie_name}' with betting title '{betting_title}' not found")
+        return None
+
+    if not odds_row.best_ew:
+        print(f"Warning: data-best-ew='true' not found for '{movie_name}'.")
+        return None
+
+    return odds_row.best_ew
+
+def goldderby_urls(slug):
+    '''
+    URLs of a season's Goldderby pages for each category
+    '''
+    return {
+        'Experts': f"https://www.goldderby.com/odds/expert-odds/{slug}/",
+        'Star24': f"https://www.goldderby.com/odds/top24-odds/{slug}/",
+        'Users': f"https://www.goldderby.com/odds/user-odds/{slug}/"
     }
 
-    movies_df = pd.read_csv('movies_df.csv')
 
-    # scrape data
-    all_data = []
-    data_experts = find_movies(base_urls['Experts'], movies_df) or []
-    data_star24 = find_movies(base_urls['Star24'], movies_df) or []
-    data_users = find_movies(base_urls['Users'], movies_df) or []
+def season_slug(season):
+    '''
+    The Goldderby slug recorded for a season, the nominations predictions page by default
+    '''
+    with engine.connect() as conn:
+        slug = conn.execute(select(seasons.c.goldderby_slug).where(seasons.c.season == season)).scalar()
+    return slug or f'oscars-nominations-{season}-predictions'
 
+
+def build_snapshot(data_experts, data_star24, data_users, odds_rows, snapshot_date, season):
+    '''
+    Combines one snapshot's three Goldderby categories and the betting site into goldderby rows
+    '''
     # process combined data
     combined_data = {}
     for movie in data_experts:
@@ -155,11 +209,11 @@ def weekly_movie_data_updater():
             'Movie Name': movie['Movie Name'],
             'Experts Vote': movie['Win Vote'],
             'Experts Odds': movie['Odds'],
-            'Star24 Vote': 'N/A',
-            'Star24 Odds': 'N/A',
-            'Users Vote': 'N/A',
-            'Users Odds': 'N/A',
-            'Date': datetime.now().strftime('%Y-%m-%d')
+            'Star24 Vote': None,
+            'Star24 Odds': None,
+            'Users Vote': None,
+            'Users Odds': None,
+            'Date': snapshot_date
         }
 
     for movie in data_star24:
@@ -169,13 +223,13 @@ def weekly_movie_data_updater():
         else:
             combined_data[movie['Movie Name']] = {
                 'Movie Name': movie['Movie Name'],
-                'Experts Vote': 'N/A',
-                'Experts Odds': 'N/A',
+                'Experts Vote': None,
+                'Experts Odds': None,
                 'Star24 Vote': movie['Win Vote'],
                 'Star24 Odds': movie['Odds'],
-                'Users Vote': 'N/A',
-                'Users Odds': 'N/A',
-                'Date': datetime.now().strftime('%Y-%m-%d')
+                'Users Vote': None,
+                'Users Odds': None,
+                'Date': snapshot_date
             }
 
     for movie in data_users:
@@ -185,68 +239,149 @@ def weekly_movie_data_updater():
         else:
             combined_data[movie['Movie Name']] = {
                 'Movie Name': movie['Movie Name'],
-                'Experts Vote': 'N/A',
-                'Experts Odds': 'N/A',
-                'Star24 Vote': 'N/A',
-                'Star24 Odds': 'N/A',
+                'Experts Vote': None,
+                'Experts Odds': None,
+                'Star24 Vote': None,
+                'Star24 Odds': None,
                 'Users Vote': movie['Win Vote'],
                 'Users Odds': movie['Odds'],
-                'Date': datetime.now().strftime('%Y-%m-%d')
+                'Date': snapshot_date
             }
 
-    all_data.extend(combined_data.values())
-
     # create df and calculate percentages and implied probabilities
-    weekly_df = pd.DataFrame(all_data)
+    weekly_df = pd.DataFrame(list(combined_data.values()))
     weekly_df['pct_vote_expert'] = calculate_pct_votes(weekly_df, 'Experts Vote')
     weekly_df['pct_vote_star24'] = calculate_pct_votes(weekly_df, 'Star24 Vote')
     weekly_df['pct_vote_user'] = calculate_pct_votes(weekly_df, 'Users Vote')
 
-    weekly_df['imp_prob_expert'] = weekly_df['Experts Odds'].apply(lambda x: odds_to_prob(x) if x != 'N/A' else None)
-    weekly_df['imp_prob_star24'] = weekly_df['Star24 Odds'].apply(lambda x: odds_to_prob(x) if x != 'N/A' else None)
-    weekly_df['imp_prob_user'] = weekly_df['Users Odds'].apply(lambda x: odds_to_prob(x) if x != 'N/A' else None)
+    # assign extracted data to a column in the weekly_df records
+    if odds_rows is not None:
+        weekly_df['betting_odds'] = weekly_df['Movie Name'].apply(lambda name: find_odds_for_movie(name, odds_rows))
+    else:
+        weekly_df['betting_odds'] = None
+
+    # implied probabilities for the three Goldderby groups and the betting site, converted in one vectorized pass
+    add_implied_probabilities(weekly_df)
+    weekly_df['Season'] = season
+    return weekly_df
+
 
+def market_frames(odds_rows, movie_names, snapshot_date):
+    '''
+    Every bookmaker's price for the given movies and the market consensus they imply, as bookmaker_odds
+    and market_consensus rows
+    '''
+    runner_names = {TITLE_MAPPING.get(name, name): name for name in movie_names}
+    matrix = OddsMatrix.from_rows(odds_rows)
+    return matrix.to_long(snapshot_date, runner_names), matrix.consensus_frame(snapshot_date, runner_names)
+
+
+def weekly_movie_data_updater(season=CURRENT_SEASON):
+    # URLs for each category of the season's Goldderby pages
+    base_urls = goldderby_urls(season_slug(season))
+
+    movies_df = pd.read_csv('movies_df.csv')
     movie_names = set(movies_df['Movie Name'].tolist())
 
-    ## getting the betting site odds data
-    api_response = requests.post(
-        "https://api.zyte.com/v1/extract",
-        auth=(os.getenv("ZYTE_API_KEY"), ""),
-        json={
-            "url": "https://www.oddschecker.com/awards/oscars/best-picture",
-            "browserHtml": True,
-        },
-    )
-    response_json = api_response.json()
-    if "browserHtml" in response_json:
-        browser_html = response_json["browserHtml"]
-    else:
-        print("Key 'browserHtml' not found in the response. Full response:")
-        print(response_json)
+    # scrape data
+    fetch_cache = FetchCache(engine)
+    raw_pages = {}
+    scraped = scrape_sources(base_urls, movie_names, fetch_cache, raw_pages)
+    snapshot_date = datetime.now().strftime('%Y-%m-%d')
+    return write_snapshot(season, snapshot_date, scraped, raw_pages, movie_names, fetch_cache)
 
-    soup = BeautifulSoup(browser_html, 'html.parser')
 
-    # mapping the titles for movies whose names differ across the betting website and Goldderby
-    title_mapping = {
-        'Joker: Folie à Deux': 'Joker: Folie a Deux',
-        'Gladiator II': 'Gladiator 2',
-        'Nickel Boys': 'The Nickel Boys',
-        'Saturday Night': 'SNL: 1975'
-    }
+def write_snapshot(season, snapshot_date, scraped, raw_pages, movie_names, fetch_cache):
+    '''
+    Saves one run's scraped sources as the season's snapshot for snapshot_date, returning whether anything was written
+    '''
+    pages = [scraped[category] for category in GOLDDERBY_CATEGORIES if scraped.get(category)]
+    data_experts = (scraped.get('Experts') and scraped['Experts'].rows) or []
+    data_star24 = (scraped.get('Star24') and scraped['Star24'].rows) or []
+    data_users = (scraped.get('Users') and scraped['Users'].rows) or []
 
-    # assign extracted data to a column in the weekly_df records
-    weekly_df['betting_odds'] = weekly_df['Movie Name'].apply(lambda name: find_odds_for_movie(name, soup))
-    weekly_df['betting_pct'] = weekly_df['betting_odds'].apply(lambda x: int(odds_to_prob(x)) if x != 'N/A' and odds_to_prob(x) is not None else None)
+    if not (data_experts or data_star24 or data_users):
+        print("Warning: none of the Goldderby pages could be scraped, nothing to update.")
+        return False
+
+    ## getting the betting site odds data
+    odds_rows = scraped.get('Oddschecker')
+    weekly_df = build_snapshot(data_experts, data_star24, data_users, odds_rows, snapshot_date, season)
 
+    # keeping every bookmaker's price, not just the best each-way one, along with the market consensus they imply
+    prices, consensus = None, None
+    if odds_rows:
+        prices, consensus = market_frames(odds_rows, movie_names, snapshot_date)
+
+    # skipping the run when neither the Goldderby pages nor any tracked value changed, so frequent polling costs no storage
+    changes = compute_changes(engine, season, tracked_values(weekly_df, consensus), datetime.now())
+    if pages and not any(page.changed for page in pages) and changes.events.empty:
+        print("The odds haven't changed since the last run, nothing to update.")
+        return False
+
+    if odds_rows:
+        upsert_rows(engine, bookmaker_odds, prices)
+        upsert_rows(engine, market_consensus, consensus)
 
     # save to db
-    weekly_df.to_sql('goldderby', engine, if_exists='append', index=False)
+    # upserting into the season's partition on ("Date", "Movie Name"), so re-running the job on the same day replaces that day's rows
+    upsert_history(engine, weekly_df)
+    # and keeping just what moved since the last run, which is what the tables and charts read
+    save_changes(engine, changes)
+    # the pages of the movies whose odds moved get their bundles rebuilt, the others only extend to the latest check
+    try:
+        rebuild_bundles(engine, changes.events['Movie Name'].unique())
+    except Exception as e:
+        print(f"Warning: couldn't rebuild the movie bundles, python bundles.py rebuilds them: {e}")
+
+    # keeping the raw pages and parsed rows, so the history can be re-parsed later without the network
+    try:
+        archive_run(season, snapshot_date, raw_pages, movie_names, weekly_df, prices)
+    except OSError as e:
+        print(f"Warning: couldn't archive this run: {e}")
+
+    # only remembering what was fetched once the rows are saved, so a failed run is retried in full next time
+    fetch_cache.store([page.state for page in pages])
+
+    # re-rendering the static site, a failed export leaves the previous one up until it goes stale
+    try:
+        export_site(engine)
+    except Exception as e:
+        print(f"Warning: couldn't export the site: {e}")
+    return True
+
+
+def schedule_runs(scheduler, job, args=None):
+    '''
+    Schedules job every POLL_INTERVAL_MINUTES, or every Monday at 10:00 without it. Intervals count
+    from a fixed start, so every scheduler fires at the same moments.
+    '''
+    if POLL_INTERVAL_MINUTES:
+        scheduler.add_job(job, 'interval', minutes=POLL_INTERVAL_MINUTES, start_date=datetime(2000, 1, 1), args=args)
+    else:
+        scheduler.add_job(job, 'cron', day_of_week='mon', hour=10, minute=0, args=args)
+
+
+def timed_update():
+    '''
+    Runs the updater, recording how long it took and whether it succeeded
+    '''
+    with metrics.updater_run():
+        weekly_movie_data_updater()
+
 
+if __name__ == "__main__":
+    # the scheduler has no web app, it serves its own metrics when UPDATER_METRICS_PORT is set
+    metrics.serve_metrics()
+    scheduler = BlockingScheduler()
 
-scheduler = BlockingScheduler()
+    # task to run every Monday at 10:00 AM, or every few minutes when polling
+    schedule_runs(scheduler, timed_update)
 
-# task to run every Monday at 10:00 AM
-scheduler.add_job(weekly_movie_data_updater, 'cron', day_of_week='mon', hour=10, minute=0)
+    # refreshing nominees' news before it goes stale, so movie pages rarely find expired articles
+    scheduler.add_job(prefetch_news, 'interval', hours=1, args=[engine])
+    # and re-exporting the static site with the fresh news, before the export being served ages out
+    scheduler.add_job(export_site, 'interval', seconds=EXPORT_INTERVAL, args=[engine])
 
-print("Scheduler started. Waiting for the next task...")
-scheduler.start()
\ No newline at end of file
+    print("Scheduler started. Waiting for the next task...")
+    scheduler.start()
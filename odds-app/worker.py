@@ -0,0 +1,170 @@
+'''
+Scrapes in worker mode, so several processes can share the work without double-scraping or double-writing:
+
+- the scheduler enqueues each snapshot into Redis as one job per source (safe to run on several hosts,
+  a scheduled run is only enqueued once)
+- any number of workers fetch and parse the sources in parallel, each job staying on the worker's processing
+  list until its result is saved, and the scheduler puts the jobs of workers that died back on the queue
+- the worker whose source completes a run writes the snapshot under a distributed lock, once, then
+  publishes an invalidation the web app listens for to refresh its cached tables
+
+    python worker.py schedule            # enqueues a run every Monday at 10:00 (or every POLL_INTERVAL_MINUTES)
+                                         # and prefetches news hourly, re-exports the site and requeues
+                                         # the jobs of workers that died
+    python worker.py work --threads 4    # fetches, parses and writes, run as many as you like
+    python worker.py enqueue             # enqueues a run now
+
+REDIS_URL points at the Redis server, redis://localhost:6379/0 by default.
+'''
+import argparse
+import threading
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+from export import EXPORT_INTERVAL, export_site
+from fetch import FetchCache, FetchState, fetch_all
+from jobs import (distributed_lock, enqueue_run, finish_job, is_written, mark_written, next_job, publish_invalidation,
+                  redis_client, requeue_stale, run_results, save_result)
+from news import prefetch_news
+from parsers import OddsRow
+from schema import CURRENT_SEASON
+from weekly_update import (GOLDDERBY_CATEGORIES, GoldderbyPage, engine, goldderby_urls, schedule_runs, season_slug,
+                           source_jobs, write_snapshot)
+
+SOURCES = GOLDDERBY_CATEGORIES + ('Oddschecker',)
+
+
+def read_movie_names():
+    return set(pd.read_csv('movies_df.csv')['Movie Name'].tolist())
+
+
+def encode_page(source, page):
+    '''
+    A source's parsed result as JSON, to pass it between workers
+    '''
+    if page is None:
+        return None
+    if source == 'Oddschecker':
+        return {name: row._asdict() for name, row in page.items()}
+    return {'rows': page.rows, 'state': page.state._asdict(), 'changed': page.changed}
+
+
+def decode_page(source, encoded):
+    if encoded is None:
+        return None
+    if source == 'Oddschecker':
+        return {name: OddsRow(**row) for name, row in encoded.items()}
+    return GoldderbyPage(encoded['rows'], FetchState(**encoded['state']), encoded['changed'])
+
+
+def scrape_source(season, source):
+    '''
+    Fetches and parses one source of a run, returning its encoded result and the raw page
+    '''
+    raw_pages = {}
+    jobs = source_jobs(goldderby_urls(season_slug(season)), read_movie_names(), FetchCache(engine), raw_pages)
+    page = fetch_all({source: jobs[source]})[source]
+    return {'page': encode_page(source, page), 'raw': raw_pages.get(source)}
+
+
+def complete_run(r, run_id):
+    '''
+    Writes a run's snapshot from every source's result. The lock serializes writers of the same snapshot,
+    and a run already marked written is skipped, so each run is written exactly once.
+    '''
+    season, snapshot_date, results = run_results(r, run_id)
+    with distributed_lock(r, f'snapshot:{season}:{snapshot_date}') as acquired:
+        if not acquired:
+            print(f"Warning: couldn't lock the {season} snapshot of {snapshot_date}, run {run_id} isn't written")
+            return False
+        if is_written(r, run_id):
+            return False
+
+        scraped = {source: decode_page(source, result['page']) for source, result in results.items()}
+        raw_pages = {source: result['raw'] for source, result in results.items() if result['raw']}
+        with metrics.updater_run():
+            wrote = write_snapshot(season, snapshot_date, scraped, raw_pages, read_movie_names(), FetchCache(engine))
+        mark_written(r, run_id)
+
+    if wrote:
+        publish_invalidation(r, season, snapshot_date)
+    return wrote
+
+
+def work(r, stop=None, worker_id=None):
+    '''
+    Takes jobs off the queue until stop is set, completing the runs whose last source it scraped
+    '''
+    worker_id = worker_id or uuid.uuid4().hex
+    while not (stop and stop.is_set()):
+        job = next_job(r, worker_id)
+        if job is None:
+            continue
+        try:
+            result = scrape_source(job['season'], job['source'])
+        except Exception as e:
+            # the run still completes, without this source, as a failed fetch would in a single-process run
+            print(f"Warning: scraping {job['source']} for run {job['run']} failed: {e}")
+            result = {'page': None, 'raw': None}
+        completed = save_result(r, job['run'], job['source'], result)
+        finish_job(r, worker_id, job)
+        if completed:
+            try:
+                complete_run(r, job['run'])
+            except Exception as e:
+                print(f"Warning: writing run {job['run']} failed: {e}")
+
+
+def enqueue(r, season=CURRENT_SEASON, dedupe=None):
+    snapshot_date = datetime.now().strftime('%Y-%m-%d')
+    run_id = enqueue_run(r, season, snapshot_date, SOURCES, dedupe)
+    if run_id:
+        print(f"Enqueued run {run_id} for the {season} snapshot of {snapshot_date}.")
+    return run_id
+
+
+def enqueue_scheduled(r, season=CURRENT_SEASON):
+    # every scheduler fires at the same minute, keying the run on it lets only the first one through
+    enqueue(r, season, dedupe=f"{season}:{datetime.now():%Y-%m-%dT%H:%M}")
+
+
+def requeue(r):
+    count = requeue_stale(r)
+    if count:
+        print(f"Requeued {count} jobs held by workers that stopped responding.")
+    return count
+
+
+def schedule(r):
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    scheduler = BlockingScheduler()
+    schedule_runs(scheduler, enqueue_scheduled, args=[r])
+    scheduler.add_job(prefetch_news, 'interval', hours=1, args=[engine])
+    scheduler.add_job(export_site, 'interval', seconds=EXPORT_INTERVAL, args=[engine])
+    scheduler.add_job(requeue, 'interval', minutes=1, args=[r])
+    print("Scheduler started. Waiting for the next run...")
+    scheduler.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['schedule', 'work', 'enqueue'])
+    parser.add_argument('--threads', type=int, default=1, help='jobs worked on at once by this process')
+    parser.add_argument('--season', type=int, default=CURRENT_SEASON, help='season to enqueue a run for')
+    args = parser.parse_args()
+
+    r = redis_client()
+    metrics.serve_metrics()
+    if args.command == 'schedule':
+        schedule(r)
+    elif args.command == 'enqueue':
+        enqueue(r, args.season)
+    else:
+        threads = [threading.Thread(target=work, args=(r,), daemon=True) for _ in range(args.threads - 1)]
+        for thread in threads:
+            thread.start()
+        work(r)